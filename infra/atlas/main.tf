@@ -110,6 +110,10 @@ resource "mongodbatlas_search_index" "portrait-embeddings-search-cosine" {
     {
         "type": "filter",
         "path": "embedder_type"
+    },
+    {
+        "type": "filter",
+        "path": "portrait_id"
     }
 ]
 EOF
@@ -141,6 +145,10 @@ resource "mongodbatlas_search_index" "portrait-embeddings-search-euclidean" {
     {
         "type": "filter",
         "path": "experiment"
+    },
+    {
+        "type": "filter",
+        "path": "portrait_id"
     }
 ]
 EOF
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import numpy as np
+from dependency_injector.wiring import Provide, inject
+from tabulate import tabulate
+
+from portrait_search.dependencies import Container
+from portrait_search.embeddings.embedders import EMBEDDERS, Embedder, ready_embedder_types
+from portrait_search.embeddings.splitters import Splitter
+from portrait_search.portraits.repository import PortraitRepository
+
+N_DESCRIPTIONS = 500
+BATCH_SIZES = (16, 32, 64)
+
+
+def _original_order(embedder: Embedder, texts: list[str], batch_size: int) -> None:
+    # how Embedder.embed batched texts before length bucketing
+    np.concatenate([embedder._embed(texts[i : i + batch_size]) for i in range(0, len(texts), batch_size)])
+
+
+def _length_bucketed(embedder: Embedder, texts: list[str], batch_size: int) -> None:
+    embedder.embed(texts, batch_size)
+
+
+@inject
+async def benchmark_embedding_throughput(
+    portrait_repository: PortraitRepository = Provide[Container.portrait_repository],
+    splitter: Splitter = Provide[Container.splitter],
+) -> None:
+    portraits = await portrait_repository.get_many()
+    chunks = [chunk for portrait in portraits[:N_DESCRIPTIONS] for chunk in splitter.split(portrait.description)]
+    print(f"Embedding {len(chunks)} chunks of {min(len(portraits), N_DESCRIPTIONS)} descriptions")
+
+    results = []
+    # PCA embedders without a fitted projection can not embed yet
+    for embedder_type in ready_embedder_types():
+        embedder = EMBEDDERS[embedder_type]
+        embedder.embed(chunks[:8])  # warm up
+        for batch_size in BATCH_SIZES:
+            for method, embed in (("original order", _original_order), ("length-bucketed", _length_bucketed)):
+                start = time.perf_counter()
+                embed(embedder, chunks, batch_size)
+                elapsed = time.perf_counter() - start
+                results.append(
+                    {
+                        "embedder": embedder_type,
+                        "batch size": batch_size,
+                        "method": method,
+                        "chunks/s": len(chunks) / elapsed,
+                    }
+                )
+
+    print(tabulate(results, headers="keys", tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    container = Container()
+    container.init_resources()
+    container.wire(modules=[__name__])
+
+    asyncio.run(benchmark_embedding_throughput())
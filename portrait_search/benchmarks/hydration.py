@@ -0,0 +1,81 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+
+from bson import ObjectId
+from dependency_injector.wiring import Provide, inject
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from tabulate import tabulate
+
+from portrait_search.dependencies import Container
+from portrait_search.portraits.entities import PortraitRecord
+from portrait_search.portraits.repository import PortraitRepository
+
+N_QUERIES = 20
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands sent to MongoDB, i.e. network round-trips."""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        self.count += 1
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        pass
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        pass
+
+
+async def _measure(
+    hydrate: Callable[[list[ObjectId]], Awaitable[list[PortraitRecord]]],
+    portrait_ids: list[ObjectId],
+    counter: CommandCounter,
+) -> tuple[float, float]:
+    counter.count = 0
+    start = time.perf_counter()
+    for _ in range(N_QUERIES):
+        await hydrate(portrait_ids)
+    elapsed = time.perf_counter() - start
+    return counter.count / N_QUERIES, elapsed / N_QUERIES * 1000
+
+
+@inject
+async def benchmark_hydration(
+    mongodb_uri: str = Provide[Container.config.provided.mongodb_uri],
+    mongodb_database_name: str = Provide[Container.config.provided.mongodb_database_name],
+) -> None:
+    counter = CommandCounter()
+    connection = AsyncIOMotorClient(mongodb_uri, event_listeners=[counter])
+    portrait_repository = PortraitRepository(connection[mongodb_database_name])
+
+    async def get_one_by_one(ids: list[ObjectId]) -> list[PortraitRecord]:
+        return [await portrait_repository.get_one(id) for id in ids]
+
+    results = []
+    for limit in (5, 10, 30):
+        entities = (
+            await connection[mongodb_database_name][portrait_repository.collection]
+            .find({}, {"_id": 1}, limit=limit)
+            .to_list(length=None)
+        )
+        portrait_ids = [entity["_id"] for entity in entities]
+        for method, hydrate in (("get_one", get_one_by_one), ("get_by_ids", portrait_repository.get_by_ids)):
+            round_trips, latency_ms = await _measure(hydrate, portrait_ids, counter)
+            results.append(
+                {"method": method, "limit": len(portrait_ids), "round-trips": round_trips, "latency, ms": latency_ms}
+            )
+
+    print(tabulate(results, headers="keys", tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    container = Container()
+    container.init_resources()
+    container.wire(modules=[__name__])
+
+    asyncio.run(benchmark_hydration())
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import numpy as np
+from dependency_injector.wiring import Provide, inject
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from tabulate import tabulate
+
+from portrait_search.core.enums import EmbedderType, SplitterType
+from portrait_search.core.mongodb import PyObjectId
+from portrait_search.dependencies import Container
+from portrait_search.embeddings.entities import EmbeddingRecord
+from portrait_search.embeddings.repository import MongoEmbeddingRepository
+
+N_VECTORS = 100_000
+DIMENSIONALITY = 768
+INSERT_BATCH_SIZE = 1000
+
+
+class BenchmarkEmbeddingRepository(MongoEmbeddingRepository):
+    """Writes to its own collection, so the benchmark does not touch real embeddings."""
+
+    def __init__(self, db: AsyncIOMotorDatabase, binary_vectors: bool):
+        super().__init__(db, binary_vectors=binary_vectors)
+        self.collection_name = f"benchmark_embeddings_{'binary' if binary_vectors else 'array'}"
+
+    @property
+    def collection(self) -> str:
+        return self.collection_name
+
+
+def _synthetic_records(rng: np.random.Generator, count: int) -> list[EmbeddingRecord]:
+    vectors = rng.normal(size=(count, DIMENSIONALITY)).astype(np.float32)
+    return [
+        EmbeddingRecord(
+            portrait_id=PyObjectId(),
+            embedding=vector,
+            embedded_text="synthetic",
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        )
+        for vector in vectors
+    ]
+
+
+@inject
+async def benchmark_mongo_vectors(db: AsyncIOMotorDatabase = Provide[Container.db]) -> None:
+    print(f"Storing {N_VECTORS} {DIMENSIONALITY}-dimensional vectors")
+    results = []
+    for binary_vectors in (False, True):
+        repository = BenchmarkEmbeddingRepository(db, binary_vectors)
+        await db.drop_collection(repository.collection)
+        rng = np.random.default_rng(0)
+        try:
+            start = time.perf_counter()
+            for _ in range(0, N_VECTORS, INSERT_BATCH_SIZE):
+                await repository.insert_many(_synthetic_records(rng, INSERT_BATCH_SIZE))
+            insert_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            read = 0
+            async for records in repository.iter_many(INSERT_BATCH_SIZE):
+                read += len(records)
+            read_elapsed = time.perf_counter() - start
+
+            stats = await db.command("collStats", repository.collection)
+            results.append(
+                {
+                    "vectors": "packed float32" if binary_vectors else "array of doubles",
+                    "document size, bytes": stats["avgObjSize"],
+                    "data size, MB": stats["size"] / 2**20,
+                    "storage size, MB": stats["storageSize"] / 2**20,
+                    "insert, vectors/s": N_VECTORS / insert_elapsed,
+                    "read, vectors/s": read / read_elapsed,
+                }
+            )
+        finally:
+            await db.drop_collection(repository.collection)
+
+    print(tabulate(results, headers="keys", tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    container = Container()
+    container.init_resources()
+    container.wire(modules=[__name__])
+
+    asyncio.run(benchmark_mongo_vectors())
@@ -0,0 +1,57 @@
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from dependency_injector.wiring import Provide, inject
+from tabulate import tabulate
+
+from portrait_search.dependencies import Container
+from portrait_search.embeddings.cache import SplitCache
+from portrait_search.embeddings.splitters import SPLITTERS
+from portrait_search.portraits.repository import PortraitRepository
+
+N_DESCRIPTIONS = 2000
+
+
+@inject
+async def benchmark_split_throughput(
+    portrait_repository: PortraitRepository = Provide[Container.portrait_repository],
+) -> None:
+    portraits = await portrait_repository.get_many()
+    descriptions = [portrait.description for portrait in portraits[:N_DESCRIPTIONS]]
+    print(f"Splitting {len(descriptions)} descriptions")
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for splitter_type, splitter in SPLITTERS.items():
+            start = time.perf_counter()
+            chunks = [chunk for description in descriptions for chunk in splitter.split(description)]
+            split_elapsed = time.perf_counter() - start
+
+            # a rerun of generation, all descriptions are already split
+            SplitCache(max_size=0, path=Path(temp_dir)).split(splitter, descriptions)
+            start = time.perf_counter()
+            SplitCache(max_size=0, path=Path(temp_dir)).split(splitter, descriptions)
+            cached_elapsed = time.perf_counter() - start
+
+            results.append(
+                {
+                    "splitter": splitter_type,
+                    "chunks": len(chunks),
+                    "unique chunks": len(set(chunks)),
+                    "chunks/description": len(chunks) / len(descriptions),
+                    "descriptions/s": len(descriptions) / split_elapsed,
+                    "cached descriptions/s": len(descriptions) / cached_elapsed,
+                }
+            )
+
+    print(tabulate(results, headers="keys", tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    container = Container()
+    container.init_resources()
+    container.wire(modules=[__name__])
+
+    asyncio.run(benchmark_split_throughput())
@@ -0,0 +1,46 @@
+import statistics
+import subprocess
+import sys
+import time
+
+from tabulate import tabulate
+
+N_RUNS = 5
+
+SCENARIOS = {
+    # what `python -m portrait_search.validate_datasets` imports before doing any work
+    "lazy registries": "import portrait_search.validate_datasets",
+    # the same with every registered model built, as it was when the registries were built at import time
+    "eager registries": (
+        "import portrait_search.validate_datasets\n"
+        "from portrait_search.embeddings.embedders import EMBEDDERS\n"
+        "from portrait_search.embeddings.splitters import SPLITTERS\n"
+        "list(EMBEDDERS.values()), list(SPLITTERS.values())"
+    ),
+}
+
+
+def _run(code: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True)
+    return time.perf_counter() - start
+
+
+def benchmark_startup() -> None:
+    results = []
+    for scenario, code in SCENARIOS.items():
+        timings = [_run(code) for _ in range(N_RUNS)]
+        results.append(
+            {
+                "scenario": scenario,
+                "mean, s": statistics.mean(timings),
+                "min, s": min(timings),
+                "max, s": max(timings),
+            }
+        )
+
+    print(tabulate(results, headers="keys", tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    benchmark_startup()
@@ -1,9 +1,34 @@
 from pathlib import Path
 
-from pydantic import Field
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
-from .enums import DistanceType, EmbedderType, SplitterType
+from .enums import (
+    AggregatorType,
+    DistanceType,
+    EmbedderBackend,
+    EmbedderType,
+    EmbeddingRepositoryType,
+    RetrieverType,
+    SplitterType,
+)
+
+
+class VectorIndexParams(BaseModel):
+    """HNSW parameters of vector indexes, the defaults are the Chroma defaults."""
+
+    construction_ef: int = 100
+    search_ef: int = 10
+    m: int = 16
+    # Atlas $vectorSearch candidates per requested result, its counterpart of search_ef
+    num_candidates_factor: int = 20
+    # overrides of the parameters above by "<splitter type>/<embedder type>"
+    collections: dict[str, dict[str, int]] = {}
+
+    def for_collection(self, splitter_type: SplitterType, embedder_type: EmbedderType) -> "VectorIndexParams":
+        return self.model_copy(
+            update={**self.collections.get(f"{splitter_type}/{embedder_type}", {}), "collections": {}}
+        )
 
 
 class Config(BaseSettings):
@@ -20,10 +45,41 @@ class Config(BaseSettings):
     embedder_type: EmbedderType = Field(
         default=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS, alias="EMBEDDER_TYPE"
     )
+    embedder_backend: EmbedderBackend = Field(default=EmbedderBackend.TORCH, alias="EMBEDDER_BACKEND")
+    onnx_quantize: bool = Field(default=True, alias="ONNX_QUANTIZE")
     splitter_type: SplitterType = Field(
         default=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40, alias="SPLITTER_TYPE"
     )
+    # searched by its own metric by the numpy and mongo repositories, chroma reranks euclidean and dot product results
+    # from cosine candidates and may miss some of them, see DistanceType
     distance_type: DistanceType = Field(default=DistanceType.COSINE, alias="DISTANCE_TYPE")
+    # how similarities of the chunks of a portrait are combined into the portrait score
+    aggregator_type: AggregatorType = Field(default=AggregatorType.MEAN, alias="AGGREGATOR_TYPE")
+    embedding_repository_type: EmbeddingRepositoryType = Field(
+        default=EmbeddingRepositoryType.CHROMA, alias="EMBEDDING_REPOSITORY_TYPE"
+    )
+    mongo_binary_vectors: bool = Field(default=False, alias="MONGO_BINARY_VECTORS")
+    vector_index: VectorIndexParams = Field(default_factory=VectorIndexParams, alias="VECTOR_INDEX")
+
+    query_embedding_cache_size: int = Field(default=1024, alias="QUERY_EMBEDDING_CACHE_SIZE")
+    query_embedding_cache_on_disk: bool = Field(default=False, alias="QUERY_EMBEDDING_CACHE_ON_DISK")
+    embedding_batch_max_size: int = Field(default=32, alias="EMBEDDING_BATCH_MAX_SIZE")
+    embedding_batch_max_wait_ms: float = Field(default=5.0, alias="EMBEDDING_BATCH_MAX_WAIT_MS")
+    generation_portrait_batch_size: int = Field(default=256, alias="GENERATION_PORTRAIT_BATCH_SIZE")
+    generation_embed_batch_size: int = Field(default=64, alias="GENERATION_EMBED_BATCH_SIZE")
+    generation_workers: int = Field(default=1, alias="GENERATION_WORKERS")
+    retriever_type: RetrieverType = Field(default=RetrieverType.SIMILARITY, alias="RETRIEVER_TYPE")
+    # chunks the vector search returns per requested portrait, lexical matches widen the hybrid search instead
+    similarity_candidates_factor: int = Field(default=3, alias="SIMILARITY_CANDIDATES_FACTOR")
+    hybrid_similarity_candidates_factor: int = Field(default=1, alias="HYBRID_SIMILARITY_CANDIDATES_FACTOR")
+    # portraits shortlisted by their pooled vectors per requested portrait before their chunks are scored,
+    # 0 searches all chunks
+    pooled_shortlist_factor: int = Field(default=0, alias="POOLED_SHORTLIST_FACTOR")
+    search_cache_ttl_seconds: float = Field(default=300.0, alias="SEARCH_CACHE_TTL_SECONDS")
+    search_cache_max_entries: int = Field(default=1024, alias="SEARCH_CACHE_MAX_ENTRIES")
+
+    server_host: str = Field(default="0.0.0.0", alias="SERVER_HOST")
+    server_port: int = Field(default=8080, alias="SERVER_PORT")
 
     experiment: str = Field(default=None, alias="EXPERIMENT")
 
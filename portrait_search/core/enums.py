@@ -6,6 +6,10 @@ class EmbedderType(StrEnum):
     ALL_MINI_LM_L6_V2 = "all-MiniLM-L6-v2"
     MS_MARCO_DISTILBERT_BASE_V4 = "msmarco-distilbert-base-v4"
     MS_MARCO_ROBERTA_BASE_ANCE_FIRSTP = "msmarco-roberta-base-ance-firstp"
+    INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS_PCA_256 = (
+        "instrtucor-large-pathfinder-character-instructions-pca-256"
+    )
+    ALL_MINI_LM_L6_V2_PCA_128 = "all-MiniLM-L6-v2-pca-128"
 
 
 class SplitterType(StrEnum):
@@ -20,6 +24,32 @@ class SplitterType(StrEnum):
 
 
 class DistanceType(StrEnum):
+    # the chroma repository indexes cosine similarity only: euclidean and dot product results are reranked from
+    # ChromaEmbeddingRepository.RERANK_CANDIDATES_FACTOR times more cosine candidates, chunks which rank high by
+    # them but low by cosine, typically long vectors, can be missed
     COSINE = "cosine"
     EUCLIDEAN = "eucledian"
     DOT_PRODUCT = "dot-product"
+
+
+class EmbeddingRepositoryType(StrEnum):
+    CHROMA = "chroma"
+    MONGO = "mongo"
+    NUMPY = "numpy"
+
+
+class AggregatorType(StrEnum):
+    MEAN = "mean"
+    MAX = "max"
+    SUM_TOP_3 = "sum-top-3"
+    RECIPROCAL_RANK_FUSION = "reciprocal-rank-fusion"
+
+
+class RetrieverType(StrEnum):
+    SIMILARITY = "similarity"
+    HYBRID = "hybrid"
+
+
+class EmbedderBackend(StrEnum):
+    TORCH = "torch"
+    ONNX = "onnx"
@@ -0,0 +1,55 @@
+import os
+import uuid
+from pathlib import Path
+
+
+class Generation:
+    """
+    Counter bumped on every write to the search index, caches derived from the index compare it to drop stale
+    entries. With a path, every bump also writes a new token to the file and the token is part of the value, so
+    writes of other processes sharing the file, as the generation scripts and the server share the local data
+    folder, change the generation too.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = path
+        self.count = 0
+
+    @property
+    def value(self) -> tuple[int, str]:
+        return self.count, self._shared_token()
+
+    def bump(self) -> None:
+        self.count += 1
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # replaced, not rewritten: a reader never sees a partially written token
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(uuid.uuid4().hex)
+        tmp_path.replace(self.path)
+
+    def _shared_token(self) -> str:
+        if self.path is None:
+            return ""
+        try:
+            return self.path.read_text()
+        except FileNotFoundError:
+            return ""
+
+
+INDEX_GENERATION = Generation()
+# bumped on writes of portraits only, indexes derived from the portraits skip writes of embeddings
+PORTRAIT_GENERATION = Generation()
+
+
+def share_index_generation(path: Path) -> Generation:
+    """Makes the index generation of this process shared with all processes using the same file."""
+    INDEX_GENERATION.path = path
+    return INDEX_GENERATION
+
+
+def share_portrait_generation(path: Path) -> Generation:
+    """Makes the portrait generation of this process shared with all processes using the same file."""
+    PORTRAIT_GENERATION.path = path
+    return PORTRAIT_GENERATION
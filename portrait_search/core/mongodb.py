@@ -1,5 +1,5 @@
 import abc
-from collections.abc import Callable, Generator
+from collections.abc import AsyncIterator, Callable, Generator, Sequence
 from typing import Any, Generic, TypeVar
 
 from bson import ObjectId
@@ -7,6 +7,8 @@ from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pydantic import BaseModel, ConfigDict, Field
 from pydantic_core import core_schema
 
+from .generation import INDEX_GENERATION, Generation
+
 
 class PyObjectId(ObjectId):
     @classmethod
@@ -33,6 +35,13 @@ class PyObjectId(ObjectId):
         )
 
 
+class RecordsNotFoundError(Exception):
+    def __init__(self, collection: str, missing_ids: list[ObjectId]) -> None:
+        super().__init__(f"Records not found in {collection}: {', '.join(str(id) for id in missing_ids)}")
+        self.collection = collection
+        self.missing_ids = missing_ids
+
+
 def get_connection(url: str) -> AsyncIOMotorClient:
     return AsyncIOMotorClient(url)
 
@@ -51,6 +60,9 @@ TRecord = TypeVar("TRecord", bound=MongoDBRecord)
 
 
 class MongoDBRepository(abc.ABC, Generic[TRecord]):
+    # bumped on every write to the collection
+    generations: tuple[Generation, ...] = (INDEX_GENERATION,)
+
     def __init__(self, db: AsyncIOMotorDatabase, t: type[TRecord]) -> None:
         self.db = db
         self.t = t
@@ -59,16 +71,25 @@ class MongoDBRepository(abc.ABC, Generic[TRecord]):
     def collection(self) -> str:
         raise NotImplementedError()
 
+    def _to_entity(self, record: TRecord) -> dict[str, Any]:
+        """Converts a record to a document, overridden by repositories which store fields in their own format."""
+        return record.model_dump(by_alias=True, exclude={"id"})
+
+    def _from_entity(self, entity: dict[str, Any]) -> TRecord:
+        return self.t.model_validate(entity)
+
     async def insert_one(self, record: TRecord) -> TRecord:
-        entity = record.model_dump(by_alias=True, exclude={"id"})
+        entity = self._to_entity(record)
         insertion_result = await self.db[self.collection].insert_one(entity)
+        self._bump_generations()
         new_record = record.model_copy()
         new_record.id = insertion_result.inserted_id
         return new_record
 
     async def insert_many(self, records: list[TRecord]) -> list[TRecord]:
-        entities = [record.model_dump(by_alias=True, exclude={"id"}) for record in records]
+        entities = [self._to_entity(record) for record in records]
         insertion_result = await self.db[self.collection].insert_many(entities)
+        self._bump_generations()
         new_records = [record.model_copy() for record in records]
         for new_record, inserted_id in zip(new_records, insertion_result.inserted_ids):
             new_record.id = inserted_id
@@ -76,16 +97,55 @@ class MongoDBRepository(abc.ABC, Generic[TRecord]):
 
     async def get_one(self, id: ObjectId) -> TRecord:
         entity = await self.db[self.collection].find_one({"_id": id})
-        return self.t.model_validate(entity)
+        return self._from_entity(entity)
+
+    async def get_by_ids(self, ids: Sequence[ObjectId]) -> list[TRecord]:
+        """
+        Returns records for the given ids with a single query, in the same order as ids.
+        Raises RecordsNotFoundError listing every id which is missing from the collection.
+        """
+        if not ids:
+            return []
+        entities = await self.db[self.collection].find({"_id": {"$in": list(set(ids))}}).to_list(length=None)
+        records_by_id = {entity["_id"]: self._from_entity(entity) for entity in entities}
+        missing_ids = [id for id in ids if id not in records_by_id]
+        if missing_ids:
+            raise RecordsNotFoundError(self.collection, missing_ids)
+        return [records_by_id[id] for id in ids]
+
+    async def get_ids(self, **filter: Any) -> set[ObjectId]:
+        """Returns ids of the matching records, the records are not fetched."""
+        return set(await self.db[self.collection].distinct("_id", filter))
 
     async def get_many(self, **filter: Any) -> list[TRecord]:
         entities = await self.db[self.collection].find(filter).to_list(length=None)
-        return [self.t.model_validate(entity) for entity in entities]
+        return [self._from_entity(entity) for entity in entities]
+
+    async def iter_many(
+        self, batch_size: int, after_id: ObjectId | None = None, **filter: Any
+    ) -> AsyncIterator[list[TRecord]]:
+        """Yields records in batches ordered by id, starting after the given id. Only one batch is kept in memory."""
+        if after_id is not None:
+            filter = {**filter, "_id": {"$gt": after_id}}
+        cursor = self.db[self.collection].find(filter).sort("_id", 1).batch_size(batch_size)
+        batch = []
+        async for entity in cursor:
+            batch.append(self._from_entity(entity))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
     async def delete(self, id: ObjectId | None) -> None:
         if id is None:
             return
         await self.db[self.collection].delete_one({"_id": id})
+        self._bump_generations()
+
+    def _bump_generations(self) -> None:
+        for generation in self.generations:
+            generation.bump()
 
     async def prepare_collection_resources(self) -> None:
         """
@@ -0,0 +1,50 @@
+import threading
+from collections.abc import Callable, Iterator, Mapping
+from typing import Generic, TypeVar
+
+TKey = TypeVar("TKey")
+TValue = TypeVar("TValue")
+
+
+class LazyRegistry(Mapping[TKey, TValue], Generic[TKey, TValue]):
+    """
+    Registry of factories. A value is built on first access to its key and reused afterwards, so registering
+    heavy objects like models costs nothing until they are actually used.
+    """
+
+    def __init__(self) -> None:
+        self._factories: dict[TKey, Callable[[], TValue]] = {}
+        self._values: dict[TKey, TValue] = {}
+        # reentrant: a factory may use other values of the registry
+        self._lock = threading.RLock()
+
+    def register(self, key: TKey, factory: Callable[[], TValue]) -> None:
+        with self._lock:
+            self._factories[key] = factory
+            self._values.pop(key, None)
+
+    def build_new(self, key: TKey) -> TValue:
+        """Builds a new value which is not shared with the registry."""
+        return self._factories[key]()
+
+    def is_built(self, key: TKey) -> bool:
+        return key in self._values
+
+    def __getitem__(self, key: TKey) -> TValue:
+        if key in self._values:
+            return self._values[key]
+        factory = self._factories[key]
+        with self._lock:
+            # another thread might have built the value while this one was waiting for the lock
+            if key not in self._values:
+                self._values[key] = factory()
+            return self._values[key]
+
+    def __iter__(self) -> Iterator[TKey]:
+        return iter(self._factories)
+
+    def __len__(self) -> int:
+        return len(self._factories)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._factories
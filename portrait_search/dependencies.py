@@ -1,19 +1,30 @@
 from dependency_injector import containers, providers
 
 from portrait_search.core.config import Config
+from portrait_search.core.generation import share_index_generation, share_portrait_generation
 from portrait_search.core.logging import init_logging
 from portrait_search.core.mongodb import get_connection, get_database
 from portrait_search.data_sources.config import data_sources_from_yaml
-from portrait_search.embeddings.embedders import EMBEDDERS
+from portrait_search.embeddings.cache import EmbeddingCache, SplitCache
+from portrait_search.embeddings.embedders import EMBEDDERS, set_projections_folder
+from portrait_search.embeddings.onnx import OnnxEmbedder
+from portrait_search.embeddings.pooled import PooledVectorStore
 from portrait_search.embeddings.repository import (
     ChromaEmbeddingRepository,
     EmbeddingRepository,
+    MongoEmbeddingRepository,
+    NumpyEmbeddingRepository,
 )
+from portrait_search.embeddings.service import BatchingEmbeddingService, init_embedding_executor
 from portrait_search.embeddings.splitters import SPLITTERS
 from portrait_search.open_ai.client import OpenAIClient
 from portrait_search.portraits.repository import PortraitRepository
+from portrait_search.retrieval.cache import CachedRetriever, SearchResultCache
+from portrait_search.retrieval.hybrid import HybridRetriever
+from portrait_search.retrieval.lexical import LexicalIndex
 from portrait_search.retrieval.retriever import Retriever
 from portrait_search.retrieval.similarity import SimilarityRetriever
+from portrait_search.retrieval.tags import TagIndex
 
 
 class Container(containers.DeclarativeContainer):
@@ -21,6 +32,20 @@ class Container(containers.DeclarativeContainer):
 
     # Configuration resources
     logging = providers.Resource(init_logging)
+    # writes of generation scripts reach caches of the server through the shared local data folder
+    index_generation = providers.Resource(
+        share_index_generation,
+        path=config.provided.local_data_folder.provided.joinpath.call("index_generation"),
+    )
+    portrait_generation = providers.Resource(
+        share_portrait_generation,
+        path=config.provided.local_data_folder.provided.joinpath.call("portrait_generation"),
+    )
+    # projections of PCA embedders are fitted on the index and stored next to it
+    projections_folder = providers.Resource(
+        set_projections_folder,
+        folder=config.provided.local_data_folder.provided.joinpath.call("projections"),
+    )
 
     mongodb_connection = providers.Resource(
         get_connection,
@@ -37,18 +62,33 @@ class Container(containers.DeclarativeContainer):
     )
 
     # Data science config
-    splitter = providers.Resource(
+    # Callables instead of resources: resources are initialized eagerly, and the registries load models lazily
+    splitter = providers.Callable(
         lambda config: SPLITTERS[config.splitter_type],
         config=config,
     )
-    embedder = providers.Resource(
-        lambda config: EMBEDDERS[config.embedder_type],
-        config=config,
+    embedder = providers.Selector(
+        config.provided.embedder_backend,
+        torch=providers.Callable(
+            lambda config: EMBEDDERS[config.embedder_type],
+            config=config,
+        ),
+        # ONNX embedder owns its model, it must not patch the torch one shared through the registry
+        onnx=providers.Singleton(
+            OnnxEmbedder,
+            embedder=providers.Callable(EMBEDDERS.build_new, config.provided.embedder_type),
+            cache_folder=config.provided.local_data_folder.provided.joinpath.call("onnx"),
+            quantize=config.provided.onnx_quantize,
+        ),
     )
     distance_type = providers.Resource(
         lambda config: config.distance_type,
         config=config,
     )
+    aggregator_type = providers.Resource(
+        lambda config: config.aggregator_type,
+        config=config,
+    )
 
     # Portrait repository
     portrait_repository = providers.Factory(
@@ -63,8 +103,26 @@ class Container(containers.DeclarativeContainer):
     chroma_embedding_repository = providers.Factory(
         ChromaEmbeddingRepository,
         databases_path=config.provided.local_data_folder,
+        index_params=config.provided.vector_index,
+    )
+    mongo_embedding_repository = providers.Factory(
+        MongoEmbeddingRepository,
+        db=db,
+        binary_vectors=config.provided.mongo_binary_vectors,
+        index_params=config.provided.vector_index,
+    )
+    numpy_embedding_repository = providers.Singleton(
+        NumpyEmbeddingRepository,
+        databases_path=config.provided.local_data_folder,
+    )
+    embedding_repository.override(
+        providers.Selector(
+            config.provided.embedding_repository_type,
+            chroma=chroma_embedding_repository,
+            mongo=mongo_embedding_repository,
+            numpy=numpy_embedding_repository,
+        )
     )
-    embedding_repository.override(chroma_embedding_repository)
 
     # OpenAI client
     openai_client = providers.Factory(
@@ -72,6 +130,56 @@ class Container(containers.DeclarativeContainer):
         api_key=config.provided.openai_api_key,
     )
 
+    # Query embedding cache
+    query_embedding_cache = providers.Singleton(
+        EmbeddingCache,
+        max_size=config.provided.query_embedding_cache_size,
+        path=providers.Callable(
+            lambda config: config.local_data_folder / "query_embedding_cache"
+            if config.query_embedding_cache_on_disk
+            else None,
+            config=config,
+        ),
+    )
+
+    # Chunks of portrait descriptions repeat across splitters and reruns, bulk lookups go to disk
+    chunk_embedding_cache = providers.Singleton(
+        EmbeddingCache,
+        max_size=0,
+        path=config.provided.local_data_folder.provided.joinpath.call("chunk_embedding_cache"),
+    )
+
+    # Descriptions are split again only when they change
+    split_cache = providers.Singleton(
+        SplitCache,
+        max_size=0,
+        path=config.provided.local_data_folder.provided.joinpath.call("split_cache"),
+    )
+
+    # Embedder inference off the event loop, per retriever: experiments override the embedder.
+    # Services share one inference thread, shut down with the resources
+    embedding_executor = providers.Resource(init_embedding_executor)
+    embedding_service = providers.Factory(
+        BatchingEmbeddingService,
+        embedder=embedder,
+        cache=query_embedding_cache,
+        max_batch_size=config.provided.embedding_batch_max_size,
+        max_wait_ms=config.provided.embedding_batch_max_wait_ms,
+        executor=embedding_executor,
+    )
+
+    # Mean chunk embedding of every portrait, written by the embeddings generation
+    pooled_vector_store = providers.Singleton(
+        PooledVectorStore,
+        folder=config.provided.local_data_folder.provided.joinpath.call("pooled_vectors"),
+    )
+
+    # Bitmaps of portrait tags to filter searches, updated incrementally as portraits are inserted
+    tag_index = providers.Singleton(
+        TagIndex,
+        path=config.provided.local_data_folder.provided.joinpath.call("tag_index.npz"),
+    )
+
     # Retriever
     retriever = providers.Dependency(Retriever)  # type: ignore[type-abstract]
     vector_similarity_retriever = providers.Factory(
@@ -81,6 +189,49 @@ class Container(containers.DeclarativeContainer):
         embedding_repository=embedding_repository,
         splitter=splitter,
         embedder=embedder,
+        query_embedding_cache=query_embedding_cache,
+        embedding_service=embedding_service,
+        candidates_factor=config.provided.similarity_candidates_factor,
+        aggregator_type=aggregator_type,
+        pooled_vector_store=pooled_vector_store,
+        shortlist_factor=config.provided.pooled_shortlist_factor,
+        tag_index=tag_index,
+    )
+    # BM25 index of portrait descriptions, updated incrementally as portraits are inserted
+    lexical_index = providers.Singleton(
+        LexicalIndex,
+        path=config.provided.local_data_folder.provided.joinpath.call("lexical_index.npz"),
+    )
+    hybrid_retriever = providers.Factory(
+        HybridRetriever,
+        vector_retriever=providers.Factory(
+            vector_similarity_retriever,
+            candidates_factor=config.provided.hybrid_similarity_candidates_factor,
+        ),
+        lexical_index=lexical_index,
+        tag_index=tag_index,
+        portrait_repository=portrait_repository,
+        embedding_repository=embedding_repository,
+        splitter=splitter,
+        embedder=embedder,
+    )
+    search_result_cache = providers.Singleton(
+        SearchResultCache,
+        ttl_seconds=config.provided.search_cache_ttl_seconds,
+        max_entries=config.provided.search_cache_max_entries,
+    )
+    cached_retriever = providers.Factory(
+        CachedRetriever,
+        retriever=providers.Selector(
+            config.provided.retriever_type,
+            similarity=vector_similarity_retriever,
+            hybrid=hybrid_retriever,
+        ),
+        cache=search_result_cache,
+        distance_type=distance_type,
+        splitter=splitter,
+        embedder=embedder,
+        aggregator_type=aggregator_type,
     )
 
-    retriever.override(vector_similarity_retriever)
+    retriever.override(cached_retriever)
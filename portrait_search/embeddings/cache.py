@@ -0,0 +1,215 @@
+import hashlib
+import json
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from .embedders import Embedder
+from .entities import Vectors
+from .splitters import Splitter
+
+# keeps the number of sqlite query parameters under SQLITE_MAX_VARIABLE_NUMBER
+SQLITE_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of text embeddings keyed by (embedder type, instructions, cache namespace, text).
+    The first tier is an in-memory LRU bounded by max_size, the optional second tier is a sqlite database
+    in the given folder which survives restarts.
+    """
+
+    def __init__(self, max_size: int = 1024, path: Path | None = None) -> None:
+        self.max_size = max_size
+        self.memory: OrderedDict[str, Vectors] = OrderedDict()
+        self.disk: sqlite3.Connection | None = None
+        if path is not None:
+            path.mkdir(parents=True, exist_ok=True)
+            # generation workers share the database, wait for their writes instead of failing
+            self.disk = sqlite3.connect(path / "embeddings.sqlite", check_same_thread=False, timeout=30)
+            self.disk.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.memory)
+
+    @staticmethod
+    def key(embedder: Embedder, text: str) -> str:
+        # keys of embedders without a namespace are kept from before namespaces
+        namespace = f"{embedder.cache_namespace}\0" if embedder.cache_namespace else ""
+        return hashlib.sha256(f"{embedder.type}\0{embedder.instructions}\0{namespace}{text}".encode()).hexdigest()
+
+    def get(self, key: str) -> Vectors | None:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+
+        if self.disk is not None:
+            row = self.disk.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self._put_in_memory(key, vector)
+                self.hits += 1
+                self.disk_hits += 1
+                return vector
+
+        self.misses += 1
+        return None
+
+    def get_from_memory(self, key: str) -> Vectors | None:
+        """Same as get without the disk tier, never blocks on IO. Misses are not counted, get counts them."""
+        if key not in self.memory:
+            return None
+        self.memory.move_to_end(key)
+        self.hits += 1
+        return self.memory[key]
+
+    def put(self, key: str, vector: Vectors) -> None:
+        self._put_in_memory(key, vector)
+        if self.disk is not None:
+            with self.disk:
+                self.disk.execute(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                    (key, vector.tobytes()),
+                )
+
+    def _put_in_memory(self, key: str, vector: Vectors) -> None:
+        if self.max_size <= 0:
+            return
+        # a copy, a row of an embedded matrix would keep the whole matrix in memory
+        self.memory[key] = vector.copy()
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys: list[str]) -> list[Vectors | None]:
+        """Same as get for many keys, the disk tier is queried in batches."""
+        vectors: dict[str, Vectors] = {}
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                vectors[key] = self.memory[key]
+
+        if self.disk is not None:
+            missing = list({key for key in keys if key not in vectors})
+            for i in range(0, len(missing), SQLITE_BATCH_SIZE):
+                batch = missing[i : i + SQLITE_BATCH_SIZE]
+                rows = self.disk.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({', '.join('?' * len(batch))})", batch
+                )
+                for key, blob in rows:
+                    vectors[key] = np.frombuffer(blob, dtype=np.float32)
+                    self._put_in_memory(key, vectors[key])
+                    self.disk_hits += 1
+
+        result = [vectors.get(key) for key in keys]
+        self.hits += sum(vector is not None for vector in result)
+        self.misses += sum(vector is None for vector in result)
+        return result
+
+    def put_many(self, items: list[tuple[str, Vectors]]) -> None:
+        """Same as put for many items, written to the disk tier in a single transaction."""
+        for key, vector in items:
+            self._put_in_memory(key, vector)
+        if self.disk is not None:
+            with self.disk:
+                self.disk.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                    [(key, vector.tobytes()) for key, vector in items],
+                )
+
+    def embed(self, embedder: Embedder, texts: list[str], batch_size: int | None = None) -> Vectors:
+        """
+        Same as embedder.embed, but only texts missing from the cache are passed to the model.
+        Repeated texts are embedded once.
+        """
+        if not texts:
+            return embedder.embed([])
+
+        keys = [self.key(embedder, text) for text in texts]
+        cached = self.get_many(keys)
+        missing = {keys[i]: texts[i] for i, vector in enumerate(cached) if vector is None}
+        new_vectors: dict[str, Vectors] = {}
+        if missing:
+            new_vectors = dict(zip(missing, embedder.embed(list(missing.values()), batch_size)))
+            self.put_many(list(new_vectors.items()))
+        return np.stack([new_vectors[key] if vector is None else vector for key, vector in zip(keys, cached)])
+
+
+class SplitCache:
+    """
+    Two-tier cache of description chunks keyed by (splitter type, description hash), laid out as EmbeddingCache.
+    Splitters are deterministic, a description is split again only when it changes.
+    """
+
+    def __init__(self, max_size: int = 1024, path: Path | None = None) -> None:
+        self.max_size = max_size
+        self.memory: OrderedDict[str, list[str]] = OrderedDict()
+        self.disk: sqlite3.Connection | None = None
+        if path is not None:
+            path.mkdir(parents=True, exist_ok=True)
+            self.disk = sqlite3.connect(path / "splits.sqlite", check_same_thread=False, timeout=30)
+            self.disk.execute("CREATE TABLE IF NOT EXISTS splits (key TEXT PRIMARY KEY, chunks TEXT NOT NULL)")
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(splitter: Splitter, text: str) -> str:
+        return f"{splitter.type}\0{hashlib.sha256(text.encode()).hexdigest()}"
+
+    def _put_in_memory(self, key: str, chunks: list[str]) -> None:
+        if self.max_size <= 0:
+            return
+        self.memory[key] = chunks
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys: list[str]) -> list[list[str] | None]:
+        splits: dict[str, list[str]] = {}
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                splits[key] = self.memory[key]
+
+        if self.disk is not None:
+            missing = list({key for key in keys if key not in splits})
+            for i in range(0, len(missing), SQLITE_BATCH_SIZE):
+                batch = missing[i : i + SQLITE_BATCH_SIZE]
+                rows = self.disk.execute(
+                    f"SELECT key, chunks FROM splits WHERE key IN ({', '.join('?' * len(batch))})", batch
+                )
+                for key, chunks in rows:
+                    splits[key] = json.loads(chunks)
+                    self._put_in_memory(key, splits[key])
+
+        result = [splits.get(key) for key in keys]
+        self.hits += sum(chunks is not None for chunks in result)
+        self.misses += sum(chunks is None for chunks in result)
+        return result
+
+    def put_many(self, items: list[tuple[str, list[str]]]) -> None:
+        for key, chunks in items:
+            self._put_in_memory(key, chunks)
+        if self.disk is not None:
+            with self.disk:
+                self.disk.executemany(
+                    "INSERT OR REPLACE INTO splits VALUES (?, ?)",
+                    [(key, json.dumps(chunks)) for key, chunks in items],
+                )
+
+    def split(self, splitter: Splitter, texts: list[str]) -> list[list[str]]:
+        """Same as splitter.split for every text, but only texts missing from the cache are split."""
+        keys = [self.key(splitter, text) for text in texts]
+        cached = self.get_many(keys)
+        new_splits = {keys[i]: splitter.split(texts[i]) for i, chunks in enumerate(cached) if chunks is None}
+        if new_splits:
+            self.put_many(list(new_splits.items()))
+        return [new_splits[key] if chunks is None else chunks for key, chunks in zip(keys, cached)]
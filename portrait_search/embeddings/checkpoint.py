@@ -0,0 +1,34 @@
+import json
+from pathlib import Path
+
+from bson import ObjectId
+
+from portrait_search.core.enums import EmbedderType, SplitterType
+
+
+class GenerationCheckpoint:
+    """
+    Id of the last portrait embedded for a (splitter, embedder, experiment), stored in a json file.
+    Portraits are embedded in id order, so an interrupted generation resumes after the checkpoint.
+    It is cleared when generation completes, the next run checks all descriptions for changes.
+    """
+
+    def __init__(
+        self, folder: Path, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None
+    ) -> None:
+        self.path = folder / f"{splitter_type}-{embedder_type}-{experiment or 'default'}.json"
+
+    def load(self) -> ObjectId | None:
+        if not self.path.exists():
+            return None
+        return ObjectId(json.loads(self.path.read_text())["last_portrait_id"])
+
+    def save(self, last_portrait_id: ObjectId) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # write and rename, a crash must not leave a broken checkpoint
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"last_portrait_id": str(last_portrait_id)}))
+        tmp_path.replace(self.path)
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
@@ -1,3 +1,6 @@
+import numpy as np
+from numpy.typing import NDArray
+
 from portrait_search.core.enums import DistanceType
 
 DISTANCE_TO_SIMILARITY = {
@@ -5,3 +8,27 @@ DISTANCE_TO_SIMILARITY = {
     DistanceType.EUCLIDEAN: lambda x: 1 / (1 + x),
     DistanceType.DOT_PRODUCT: lambda x: x,
 }
+
+
+def similarity_matrix(
+    vectors: NDArray[np.float32], norms: NDArray[np.float32], queries: NDArray[np.float32], distance_type: DistanceType
+) -> NDArray[np.float32]:
+    """
+    Returns a (vectors x queries) matrix of similarities, the higher the better, given the norms of the vectors:
+    the cosine similarity, the dot product or 1 / (1 + euclidean distance). Every embedding repository scores its
+    results with it, so similarities do not depend on the backend.
+    """
+    if queries.shape[1] != vectors.shape[1]:
+        raise ValueError(
+            f"Query dimensionality {queries.shape[1]} does not match vector dimensionality {vectors.shape[1]}"
+        )
+    dot = vectors @ queries.T
+    if distance_type == DistanceType.DOT_PRODUCT:
+        return dot
+    query_norms = np.linalg.norm(queries, axis=1)
+    if distance_type == DistanceType.COSINE:
+        return dot / np.maximum(np.outer(norms, query_norms), np.finfo(np.float32).eps)
+    if distance_type == DistanceType.EUCLIDEAN:
+        squared_distances = norms[:, None] ** 2 + query_norms[None, :] ** 2 - 2 * dot
+        return DISTANCE_TO_SIMILARITY[distance_type](np.sqrt(np.maximum(squared_distances, 0)))  # type: ignore
+    raise ValueError(f"distance_type {distance_type} is not supported in NumPy")
@@ -1,17 +1,29 @@
 import abc
+import hashlib
+from collections.abc import Callable
+from functools import partial
+from pathlib import Path
 from typing import Any
 
 import numpy as np
-from InstructorEmbedding import INSTRUCTOR
-from numpy.typing import NDArray
-from sentence_transformers import SentenceTransformer
 
 from portrait_search.core.enums import EmbedderType
+from portrait_search.core.registry import LazyRegistry
+
+from .entities import Vectors, to_vectors
+
+DEFAULT_BATCH_SIZE = 32
 
 
 class Embedder(abc.ABC):
-    def __init__(self, expected_dimensionality: int | None = None) -> None:
+    # distinguishes cached vectors of embedders of the same type and instructions computed by another backend
+    cache_namespace = ""
+
+    def __init__(self, expected_dimensionality: int | None = None, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
         self.expected_dimensionality = expected_dimensionality
+        self.batch_size = batch_size
+        # instructions are a part of the model input for instruction-following models
+        self.instructions = ""
         self._type: EmbedderType | None = None
 
     def __repr__(self) -> str:
@@ -27,66 +39,212 @@ class Embedder(abc.ABC):
     def type(self, value: EmbedderType) -> None:
         self._type = value
 
-    def embed(self, texts: list[str]) -> list[list[float]]:
-        vectors = self._embed(texts)
-        return self._match_dimensionality(vectors).tolist()
+    def embed(self, texts: list[str], batch_size: int | None = None) -> Vectors:
+        """
+        Embeds texts in batches of similar token length, so that little padding is computed.
+        Returns a float32 matrix with a row per text, in the order of texts.
+        """
+        if not texts:
+            return np.empty((0, self.expected_dimensionality or 0), dtype=np.float32)
+
+        batch_size = batch_size or self.batch_size
+        order = np.argsort(self._token_lengths(texts), kind="stable")
+        vectors: Vectors | None = None
+        for start in range(0, len(texts), batch_size):
+            indices = order[start : start + batch_size]
+            batch = to_vectors(self._embed([texts[i] for i in indices]))
+            if vectors is None:
+                # zeros pad vectors up to the expected dimensionality
+                vectors = np.zeros((len(texts), self._output_dimensionality(batch.shape[1])), dtype=np.float32)
+            vectors[indices, : batch.shape[1]] = batch
+        return vectors  # type: ignore[return-value]
 
     @abc.abstractmethod
-    def _embed(self, texts: list[str]) -> NDArray[np.float_]:
+    def _embed(self, texts: list[str]) -> Vectors:
         raise NotImplementedError()
 
-    def _match_dimensionality(self, vectors: NDArray[np.float_]) -> NDArray[np.float_]:
-        if self.expected_dimensionality is None:
-            return vectors
+    def _token_lengths(self, texts: list[str]) -> list[int]:
+        """Lengths used to sort texts into batches, the number of characters unless a model has a tokenizer."""
+        return [len(text) for text in texts]
 
-        if self.expected_dimensionality == vectors.shape[1]:
-            return vectors
+    def _output_dimensionality(self, dimensionality: int) -> int:
+        if self.expected_dimensionality is None:
+            return dimensionality
 
-        if self.expected_dimensionality < vectors.shape[1]:
+        if self.expected_dimensionality < dimensionality:
             raise ValueError(
                 f"Expected dimensionality {self.expected_dimensionality} is smaller than the"
-                f"actual dimensionality {vectors.shape[1]}. Can not reduce dimensionality."
+                f"actual dimensionality {dimensionality}. Can not reduce dimensionality."
             )
+        return self.expected_dimensionality
+
 
-        zeros = np.zeros((vectors.shape[0], self.expected_dimensionality - vectors.shape[1]))
-        result = np.concatenate((vectors, zeros), axis=1)
-        return result
+EMBEDDERS: LazyRegistry[EmbedderType, Embedder] = LazyRegistry()
 
 
-EMBEDDERS: dict[EmbedderType, Embedder] = {}
+def register_embedder(embedder_type: EmbedderType, factory: Callable[[], Embedder]) -> None:
+    """Registers an embedder factory, the model is loaded only when the embedder is first used."""
 
+    def build() -> Embedder:
+        embedder = factory()
+        embedder.type = embedder_type
+        return embedder
 
-def register_embedder(embedder_type: EmbedderType, embedder: Embedder) -> None:
-    EMBEDDERS[embedder_type] = embedder
-    embedder.type = embedder_type
+    EMBEDDERS.register(embedder_type, build)
 
 
 class InstructorEmbedder(Embedder):
     def __init__(self, instructions: str, model_name: str, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
+        # imported here, loading torch is expensive and not needed until a model is built
+        from InstructorEmbedding import INSTRUCTOR
+
         self.instructions = instructions
         self.model = INSTRUCTOR(model_name)
 
-    def _embed(self, texts: list[str]) -> NDArray[np.float_]:
+    def _embed(self, texts: list[str]) -> Vectors:
         pairs = [[self.instructions, text] for text in texts]
-        return np.array(self.model.encode(pairs))  # type: ignore
+        return to_vectors(self.model.encode(pairs, batch_size=len(pairs)))
+
+    def _token_lengths(self, texts: list[str]) -> list[int]:
+        # instructions are the same for all texts and do not change the order
+        return _tokenizer_lengths(self.model.tokenizer, texts)
 
 
 class SentenceTransformerEmbedder(Embedder):
     def __init__(self, model_name: str, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
+        from sentence_transformers import SentenceTransformer
+
         self.model = SentenceTransformer(model_name)
 
-    def _embed(self, texts: list[str]) -> NDArray[np.float_]:
-        return np.array(self.model.encode(texts, convert_to_numpy=True))
+    def _embed(self, texts: list[str]) -> Vectors:
+        return to_vectors(self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True))
+
+    def _token_lengths(self, texts: list[str]) -> list[int]:
+        return _tokenizer_lengths(self.model.tokenizer, texts)
+
+
+def _tokenizer_lengths(tokenizer: Any, texts: list[str]) -> list[int]:
+    input_ids = tokenizer(texts, add_special_tokens=False, return_attention_mask=False)["input_ids"]
+    return [len(ids) for ids in input_ids]
+
+
+class PCAEmbedder(Embedder):
+    """
+    Projects vectors of another embedder on their first n_components principal components, which keep most of
+    the variance of the corpus in a fraction of the dimensions.
+    The projection is fitted on corpus chunk embeddings by generate_embeddings and saved to path, queries are
+    projected with the same one. Without a path, the projection is only kept in memory.
+    """
+
+    def __init__(
+        self, embedder_type: EmbedderType, n_components: int, path: Path | None, fit_sample_size: int = 20000
+    ) -> None:
+        super().__init__(batch_size=EMBEDDERS[embedder_type].batch_size)
+        self.embedder = EMBEDDERS[embedder_type]
+        self.n_components = n_components
+        self.path = path
+        self.fit_sample_size = fit_sample_size
+        self.mean: Vectors | None = None
+        self.components: Vectors | None = None
+
+    def __repr__(self) -> str:
+        return f"PCA {self.n_components} {self.embedder}"
+
+    @property
+    def is_fitted(self) -> bool:
+        if self.components is None and self.path is not None and self.path.exists():
+            with np.load(self.path) as projection:
+                self._set_projection(projection["mean"], projection["components"])
+        return self.components is not None
+
+    def _set_projection(self, mean: Vectors, components: Vectors) -> None:
+        self.mean = to_vectors(mean)
+        self.components = to_vectors(components)
+        # cached vectors are projected, vectors of another projection must not be reused
+        digest = hashlib.sha256(self.components.tobytes()).hexdigest()[:16]
+        self.instructions = f"{self.embedder.instructions}\0pca {digest}"
+
+    def fit(self, vectors: Vectors) -> None:
+        """Fits the projection on vectors of the wrapped embedder, one per row."""
+        mean = vectors.mean(axis=0)
+        centered = vectors - mean
+        # eigenvectors of the covariance matrix in ascending order of eigenvalues, the matrix is only dim x dim
+        _, eigenvectors = np.linalg.eigh(centered.T @ centered)
+        self._set_projection(mean, eigenvectors[:, ::-1][:, : self.n_components])
+
+    def save(self) -> None:
+        if self.mean is None or self.components is None:
+            raise ValueError(f"{self} is not fitted")
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, mean=self.mean, components=self.components)
+        tmp_path.replace(self.path)
+
+    def _embed(self, texts: list[str]) -> Vectors:
+        if not self.is_fitted or self.mean is None or self.components is None:
+            raise ValueError(f"{self} is not fitted, generate embeddings to fit it")
+        # the texts are already a batch, embedded as in fitting
+        return (self.embedder.embed(texts, len(texts)) - self.mean) @ self.components
+
+    def _token_lengths(self, texts: list[str]) -> list[int]:
+        return self.embedder._token_lengths(texts)
+
+
+# set from the config by the container, the registry is built outside of it
+_projections_folder: Path | None = None
+
+
+def set_projections_folder(folder: Path) -> Path:
+    """
+    Sets the folder of the projections of PCA embedders of the registry, before the registry builds them.
+    Without it, their projections are only kept in memory.
+    """
+    global _projections_folder
+    _projections_folder = folder
+    return folder
+
+
+def _projections_path(embedder_type: EmbedderType, n_components: int) -> Path | None:
+    if _projections_folder is None:
+        return None
+    return _projections_folder / f"{embedder_type}-pca-{n_components}.npz"
+
+
+def ready_embedder_types() -> list[EmbedderType]:
+    """Types of the registered embedders which can embed, PCA embedders only once their projection is fitted."""
+    return [
+        embedder_type
+        for embedder_type, embedder in EMBEDDERS.items()
+        if not isinstance(embedder, PCAEmbedder) or embedder.is_fitted
+    ]
 
 
 register_embedder(
     EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
-    InstructorEmbedder("Represents a description of a Pathfinder character:", "hkunlp/instructor-large"),
+    partial(InstructorEmbedder, "Represents a description of a Pathfinder character:", "hkunlp/instructor-large"),
 )
-register_embedder(EmbedderType.ALL_MINI_LM_L6_V2, SentenceTransformerEmbedder("all-MiniLM-L6-v2"))
-# register_embedder(EmbedderType.MS_MARCO_DISTILBERT_BASE_V4, SentenceTransformerEmbedder("msmarco-distilbert-base-v4"))
+register_embedder(EmbedderType.ALL_MINI_LM_L6_V2, partial(SentenceTransformerEmbedder, "all-MiniLM-L6-v2"))
+register_embedder(
+    EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS_PCA_256,
+    lambda: PCAEmbedder(
+        EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        256,
+        _projections_path(EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS, 256),
+    ),
+)
+register_embedder(
+    EmbedderType.ALL_MINI_LM_L6_V2_PCA_128,
+    lambda: PCAEmbedder(EmbedderType.ALL_MINI_LM_L6_V2, 128, _projections_path(EmbedderType.ALL_MINI_LM_L6_V2, 128)),
+)
+# register_embedder(
+#     EmbedderType.MS_MARCO_DISTILBERT_BASE_V4, partial(SentenceTransformerEmbedder, "msmarco-distilbert-base-v4")
+# )
 # register_embedder(
-#     EmbedderType.MS_MARCO_ROBERTA_BASE_ANCE_FIRSTP, SentenceTransformerEmbedder("msmarco-roberta-base-ance-firstp")
+#     EmbedderType.MS_MARCO_ROBERTA_BASE_ANCE_FIRSTP,
+#     partial(SentenceTransformerEmbedder, "msmarco-roberta-base-ance-firstp"),
 # )
@@ -1,30 +1,59 @@
-from pydantic import BaseModel
+from typing import Annotated, Any
+
+import numpy as np
+from numpy.typing import NDArray
+from pydantic import BaseModel, PlainSerializer, PlainValidator
 
 from portrait_search.core.enums import EmbedderType, SplitterType
 from portrait_search.core.mongodb import MongoDBRecord, PyObjectId
 
+# one vector per row for matrices
+Vectors = NDArray[np.float32]
+
+
+def to_vectors(value: Any) -> Vectors:
+    """Converts a vector or a matrix to float32, without a copy if it is already float32."""
+    return np.asarray(value, dtype=np.float32)
+
+
+# Vectors are float32 arrays in memory, converted to lists of floats only when dumped to storage
+Vector = Annotated[Vectors, PlainValidator(to_vectors), PlainSerializer(lambda vector: vector.tolist())]
+
+
+def _eq_by_value(self: BaseModel, other: object) -> bool:
+    # pydantic compares fields with ==, which is ambiguous for arrays
+    if type(other) is not type(self):
+        return NotImplemented
+    return self.model_dump() == other.model_dump()  # type: ignore[attr-defined]
+
 
 class EmbeddingRecord(MongoDBRecord):
     portrait_id: PyObjectId
 
-    embedding: list[float]
+    embedding: Vector
     embedded_text: str
 
     splitter_type: SplitterType
     embedder_type: EmbedderType
 
     experiment: str | None = None
+    # hash of the embedded description, splitter and embedder, see t2v.description_hash
+    description_hash: str | None = None
+
+    __eq__ = _eq_by_value
 
 
 class EmbeddingSimilarity(BaseModel):
     portrait_id: PyObjectId
 
-    embedding: list[float]
+    embedding: Vector
     embedded_text: str
-    query: list[float] | None = None
+    query: Vector | None = None
     query_text: str | None = None
 
     similarity: float
 
+    __eq__ = _eq_by_value
+
     def to_explanation(self) -> str:
         return f"Query: {self.query_text}\nPortrait text: {self.embedded_text}\nSimilarity: {self.similarity}"
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import queue
+from collections.abc import AsyncIterator
+from typing import NamedTuple
+
+import numpy as np
+from bson import ObjectId
+
+from portrait_search.core.enums import EmbedderType, SplitterType
+from portrait_search.portraits.repository import PortraitRepository
+
+from .cache import EmbeddingCache, SplitCache
+from .embedders import EMBEDDERS, Embedder, PCAEmbedder
+from .entities import EmbeddingRecord, Vectors
+from .splitters import SPLITTERS, Splitter
+from .t2v import description_hash, portraits2embeddings
+
+
+async def embed_portraits(
+    splitter: Splitter,
+    embedder: Embedder,
+    portrait_repository: PortraitRepository,
+    chunk_embedding_cache: EmbeddingCache,
+    existing_hashes: dict[ObjectId, str | None],
+    after_id: ObjectId | None,
+    portrait_batch_size: int,
+    embed_batch_size: int,
+    split_cache: SplitCache | None = None,
+) -> AsyncIterator[tuple[list[EmbeddingRecord], set[ObjectId], ObjectId]]:
+    """
+    Yields embeddings of new portraits and portraits with changed descriptions, compared to the description hashes
+    of existing embeddings. Embeddings are yielded in batches ordered by portrait id, starting after the given id,
+    together with the ids of the embedded portraits, also of those whose description has no chunks, and the id of
+    the last portrait of the batch.
+    A projection of a PCA embedder is fitted first, if it does not exist yet.
+    """
+    if isinstance(embedder, PCAEmbedder) and not embedder.is_fitted:
+        await fit_projection(
+            embedder,
+            splitter,
+            portrait_repository,
+            chunk_embedding_cache,
+            portrait_batch_size,
+            embed_batch_size,
+            split_cache,
+        )
+    async for portraits in portrait_repository.iter_many(portrait_batch_size, after_id=after_id):
+        changed_portraits = [
+            p
+            for p in portraits
+            if existing_hashes.get(p.id) != description_hash(p.description, splitter, embedder)  # type: ignore[arg-type]
+        ]
+        embeddings = portraits2embeddings(
+            changed_portraits, splitter, embedder, chunk_embedding_cache, embed_batch_size, split_cache
+        )
+        yield embeddings, {p.id for p in changed_portraits}, portraits[-1].id  # type: ignore[misc]
+
+
+async def fit_projection(
+    embedder: PCAEmbedder,
+    splitter: Splitter,
+    portrait_repository: PortraitRepository,
+    chunk_embedding_cache: EmbeddingCache,
+    portrait_batch_size: int,
+    embed_batch_size: int,
+    split_cache: SplitCache | None = None,
+) -> None:
+    """Fits and saves the projection on chunk embeddings of the first portraits, up to the fit sample size."""
+    vectors: list[Vectors] = []
+    async for portraits in portrait_repository.iter_many(portrait_batch_size):
+        embeddings = portraits2embeddings(
+            portraits, splitter, embedder.embedder, chunk_embedding_cache, embed_batch_size, split_cache
+        )
+        vectors.extend(embedding.embedding for embedding in embeddings)
+        if len(vectors) >= embedder.fit_sample_size:
+            break
+    if not vectors:
+        return
+    embedder.fit(np.stack(vectors[: embedder.fit_sample_size]))
+    embedder.save()
+
+
+class WorkerTask(NamedTuple):
+    splitter_type: SplitterType
+    after_id: ObjectId | None
+    existing_hashes: dict[ObjectId, str | None]
+
+
+class WorkerMessage(NamedTuple):
+    worker_id: int
+    embedder_type: EmbedderType
+    splitter_type: SplitterType | None
+    embeddings: list[EmbeddingRecord]
+    changed_portrait_ids: set[ObjectId]
+    last_portrait_id: ObjectId | None
+    # the last message of a task, after all its batches, or without a splitter type the last message of a worker,
+    # sent even if the worker failed
+    done: bool = False
+
+
+def embedder_worker(
+    embedder_type: EmbedderType,
+    tasks: list[WorkerTask],
+    results: "queue.Queue[WorkerMessage]",
+    portrait_batch_size: int,
+    embed_batch_size: int,
+) -> None:
+    """
+    Runs in a worker process: loads the embedder once and embeds portraits for every splitter of the tasks.
+    Embeddings are sent to the results queue, the parent process writes them to the repository. The queue is bounded,
+    the worker waits while the parent falls behind.
+    """
+    try:
+        asyncio.run(_embed_for_embedder(embedder_type, tasks, results, portrait_batch_size, embed_batch_size))
+    finally:
+        results.put(WorkerMessage(os.getpid(), embedder_type, None, [], set(), None, done=True))
+
+
+async def _embed_for_embedder(
+    embedder_type: EmbedderType,
+    tasks: list[WorkerTask],
+    results: "queue.Queue[WorkerMessage]",
+    portrait_batch_size: int,
+    embed_batch_size: int,
+) -> None:
+    # imported here, the container imports this module
+    from portrait_search.dependencies import Container
+
+    container = Container()
+    container.init_resources()
+    portrait_repository = container.portrait_repository()
+    chunk_embedding_cache = container.chunk_embedding_cache()
+    split_cache = container.split_cache()
+    embedder = EMBEDDERS[embedder_type]
+    for task in tasks:
+        batches = embed_portraits(
+            SPLITTERS[task.splitter_type],
+            embedder,
+            portrait_repository,
+            chunk_embedding_cache,
+            task.existing_hashes,
+            task.after_id,
+            portrait_batch_size,
+            embed_batch_size,
+            split_cache,
+        )
+        async for embeddings, changed_portrait_ids, last_portrait_id in batches:
+            results.put(
+                WorkerMessage(
+                    os.getpid(), embedder_type, task.splitter_type, embeddings, changed_portrait_ids, last_portrait_id
+                )
+            )
+        results.put(WorkerMessage(os.getpid(), embedder_type, task.splitter_type, [], set(), None, done=True))
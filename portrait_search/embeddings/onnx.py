@@ -0,0 +1,103 @@
+import hashlib
+from pathlib import Path
+from typing import Any
+
+from .embedders import Embedder
+from .entities import Vectors
+
+ONNX_INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+ONNX_OUTPUT_NAME = "last_hidden_state"
+ONNX_OPSET_VERSION = 14
+
+
+def export_to_onnx(auto_model: Any, tokenizer: Any, path: Path, quantize: bool) -> None:
+    """Exports a HuggingFace transformer to ONNX with dynamic batch and sequence axes, optionally int8 quantized."""
+    # imported here, torch and onnx are only needed when the model is exported for the first time
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    sample = tokenizer(["An elf rogue holding a dagger"], return_tensors="pt")
+    input_names = [name for name in ONNX_INPUT_NAMES if name in sample]
+    fp32_path = path.with_suffix(".fp32.onnx") if quantize else path
+
+    return_dict = auto_model.config.return_dict
+    auto_model.config.return_dict = False  # export a plain tuple of outputs
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                auto_model,
+                ({name: sample[name] for name in input_names},),
+                str(fp32_path),
+                input_names=input_names,
+                output_names=[ONNX_OUTPUT_NAME],
+                dynamic_axes={name: {0: "batch", 1: "sequence"} for name in [*input_names, ONNX_OUTPUT_NAME]},
+                opset_version=ONNX_OPSET_VERSION,
+            )
+    finally:
+        auto_model.config.return_dict = return_dict
+
+    if quantize:
+        quantize_dynamic(str(fp32_path), str(path), weight_type=QuantType.QInt8)
+        fp32_path.unlink()
+
+
+class OnnxAutoModel:
+    """Drop-in replacement of a HuggingFace transformer in sentence-transformers which runs in ONNX Runtime."""
+
+    def __init__(self, path: Path, config: Any) -> None:
+        import onnxruntime
+
+        self.config = config
+        self.session = onnxruntime.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+        self.input_names = {session_input.name for session_input in self.session.get_inputs()}
+
+    def __call__(self, return_dict: bool = False, **inputs: Any) -> tuple[Any]:
+        import torch
+
+        feed = {name: value.cpu().numpy() for name, value in inputs.items() if name in self.input_names}
+        (last_hidden_state,) = self.session.run([ONNX_OUTPUT_NAME], feed)
+        return (torch.from_numpy(last_hidden_state),)
+
+
+class OnnxEmbedder(Embedder):
+    """
+    Runs the transformer of a sentence-transformers based embedder through ONNX Runtime on CPU.
+    Tokenization, pooling and normalization stay in the wrapped embedder, so vectors are interchangeable with the
+    torch ones: the embedder keeps the wrapped embedder type and searches the same index. Cached query vectors are
+    not shared with the torch embedder, they are namespaced by the exported model.
+    The exported model is cached in cache_folder, the torch weights of the transformer are released.
+    """
+
+    def __init__(self, embedder: Embedder, cache_folder: Path, quantize: bool = True) -> None:
+        super().__init__(embedder.expected_dimensionality, embedder.batch_size)
+        model = getattr(embedder, "model", None)
+        if model is None:
+            raise ValueError(f"{embedder} is not a sentence-transformers embedder, can not run it in ONNX Runtime")
+
+        self.embedder = embedder
+        self.instructions = embedder.instructions
+        self.type = embedder.type
+        self.quantize = quantize
+        self.path = cache_folder / f"{embedder.type}{'-int8' if quantize else ''}.onnx"
+
+        transformer = model[0]
+        if not self.path.exists():
+            export_to_onnx(transformer.auto_model, transformer.tokenizer, self.path, quantize)
+        # vectors of the exported model differ slightly from the torch ones, quantized ones even more
+        with self.path.open("rb") as model_file:
+            model_digest = hashlib.file_digest(model_file, "sha256").hexdigest()[:16]
+        self.cache_namespace = f"onnx-{'int8' if quantize else 'fp32'}-{model_digest}"
+        onnx_auto_model = OnnxAutoModel(self.path, transformer.auto_model.config)
+        # plain attribute instead of a torch submodule
+        del transformer.auto_model
+        transformer.auto_model = onnx_auto_model
+
+    def __repr__(self) -> str:
+        return f"ONNX{' int8' if self.quantize else ''} {self.embedder}"
+
+    def _embed(self, texts: list[str]) -> Vectors:
+        return self.embedder._embed(texts)
+
+    def _token_lengths(self, texts: list[str]) -> list[int]:
+        return self.embedder._token_lengths(texts)
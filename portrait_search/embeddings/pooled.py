@@ -0,0 +1,179 @@
+import os
+from collections import defaultdict
+from collections.abc import Collection
+from pathlib import Path
+
+import numpy as np
+from bson import ObjectId
+from numpy.typing import NDArray
+
+from portrait_search.core.enums import DistanceType, EmbedderType, SplitterType
+
+from .distance import similarity_matrix
+from .entities import EmbeddingRecord, Vectors
+from .repository import EmbeddingRepository
+
+# portraits whose chunk embeddings are fetched at once when pooled vectors are recomputed
+SYNC_BATCH_SIZE = 500
+
+
+class PooledVectors:
+    """
+    Mean of the chunk embeddings of every portrait for a (splitter, embedder, experiment), with the description hash
+    of the embeddings it was pooled from. One vector per portrait instead of one per chunk: small enough to be searched
+    exhaustively to shortlist portraits, whose chunks are then scored exactly.
+    Persisted as one npz file, rewritten on save.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.vectors: dict[ObjectId, Vectors] = {}
+        self.description_hashes: dict[ObjectId, str | None] = {}
+        self.changed = False
+        self.mtime: float | None = None
+        # the vectors stacked into a matrix, in the order of portrait_ids, rebuilt after changes
+        self.portrait_ids: list[ObjectId] = []
+        self.rows: dict[ObjectId, int] = {}
+        self.matrix: NDArray[np.float32] | None = None
+        self.norms: NDArray[np.float32] | None = None
+        if path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def __contains__(self, portrait_id: ObjectId) -> bool:
+        return portrait_id in self.vectors
+
+    def update(self, embeddings: list[EmbeddingRecord]) -> None:
+        """Pools the embeddings of every portrait, replacing its pooled vector. All chunks of a portrait are given."""
+        embeddings_by_portrait_id: defaultdict[ObjectId, list[EmbeddingRecord]] = defaultdict(list)
+        for embedding in embeddings:
+            embeddings_by_portrait_id[embedding.portrait_id].append(embedding)
+        for portrait_id, portrait_embeddings in embeddings_by_portrait_id.items():
+            self.vectors[portrait_id] = np.mean([embedding.embedding for embedding in portrait_embeddings], axis=0)
+            self.description_hashes[portrait_id] = portrait_embeddings[0].description_hash
+        if embeddings_by_portrait_id:
+            self._changed()
+
+    def remove(self, portrait_ids: Collection[ObjectId]) -> None:
+        removed = False
+        for portrait_id in portrait_ids:
+            removed |= self.vectors.pop(portrait_id, None) is not None
+            self.description_hashes.pop(portrait_id, None)
+        if removed:
+            self._changed()
+
+    async def sync(
+        self,
+        embedding_repository: EmbeddingRepository,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        description_hashes: dict[ObjectId, str | None],
+        experiment: str | None = None,
+    ) -> None:
+        """
+        Pools stored embeddings of portraits which have no pooled vector or one pooled from other embeddings,
+        compared to the description hashes of stored embeddings, and removes portraits without embeddings.
+        """
+        self.remove(self.vectors.keys() - description_hashes.keys())
+        outdated = sorted(
+            portrait_id
+            for portrait_id, description_hash in description_hashes.items()
+            if portrait_id not in self.vectors or self.description_hashes[portrait_id] != description_hash
+        )
+        for i in range(0, len(outdated), SYNC_BATCH_SIZE):
+            self.update(
+                await embedding_repository.get_by_portrait_ids(
+                    splitter_type, embedder_type, outdated[i : i + SYNC_BATCH_SIZE], experiment
+                )
+            )
+
+    def search(
+        self,
+        query_vectors: Vectors,
+        distance_type: DistanceType,
+        limit: int = 10,
+        portrait_ids: Collection[ObjectId] | None = None,
+    ) -> list[ObjectId]:
+        """Returns ids of the portraits most similar to any of the query vectors, best first, among the given ones."""
+        if not self.vectors or len(query_vectors) == 0 or limit <= 0:
+            return []
+        matrix, norms = self._matrix()
+        rows = np.arange(len(norms))
+        if portrait_ids is not None:
+            rows = np.array([self.rows[id] for id in portrait_ids if id in self.rows], dtype=np.intp)
+            matrix, norms = matrix[rows], norms[rows]
+        # a portrait is a candidate if it is close to any chunk of the query
+        scores = similarity_matrix(matrix, norms, np.asarray(query_vectors, dtype=np.float32), distance_type).max(
+            axis=1
+        )
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(scores))
+        return [self.portrait_ids[i] for i in rows[top[np.argsort(-scores[top], kind="stable")]]]
+
+    def _matrix(self) -> tuple[NDArray[np.float32], NDArray[np.float32]]:
+        if self.matrix is None or self.norms is None:
+            self.portrait_ids = list(self.vectors)
+            self.rows = {portrait_id: row for row, portrait_id in enumerate(self.portrait_ids)}
+            self.matrix = np.stack([self.vectors[portrait_id] for portrait_id in self.portrait_ids]).astype(
+                np.float32, copy=False
+            )
+            self.norms = np.linalg.norm(self.matrix, axis=1)
+        return self.matrix, self.norms
+
+    def _changed(self) -> None:
+        self.changed = True
+        self.matrix = None
+        self.norms = None
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        portrait_ids = list(self.vectors)
+        tmp_path = self.path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path,
+            portrait_ids=np.frombuffer(b"".join(id.binary for id in portrait_ids), dtype=np.uint8).reshape(-1, 12),
+            vectors=np.stack([self.vectors[id] for id in portrait_ids]) if portrait_ids else np.zeros((0, 0)),
+            description_hashes=np.array([self.description_hashes[id] or "" for id in portrait_ids], dtype="S64"),
+        )
+        tmp_path.replace(self.path)
+        self.changed = False
+        self.mtime = os.path.getmtime(self.path)
+
+    def _load(self) -> None:
+        self.mtime = os.path.getmtime(self.path)
+        data = np.load(self.path)
+        vectors = data["vectors"].astype(np.float32)
+        for portrait_id, vector, description_hash in zip(data["portrait_ids"], vectors, data["description_hashes"]):
+            self.vectors[ObjectId(portrait_id.tobytes())] = vector
+            self.description_hashes[ObjectId(portrait_id.tobytes())] = description_hash.decode() or None
+
+    def is_outdated(self) -> bool:
+        """Whether the file was written by another process since it was loaded or saved here."""
+        mtime = os.path.getmtime(self.path) if self.path.exists() else None
+        return mtime != self.mtime
+
+
+class PooledVectorStore:
+    """Pooled vectors of every (splitter, embedder, experiment), loaded on first use and reloaded when rewritten."""
+
+    def __init__(self, folder: Path) -> None:
+        self.folder = folder
+        self.pooled_vectors: dict[tuple[SplitterType, EmbedderType, str | None], PooledVectors] = {}
+
+    def get(self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None) -> PooledVectors:
+        key = (splitter_type, embedder_type, experiment)
+        pooled_vectors = self.pooled_vectors.get(key)
+        if pooled_vectors is None or (not pooled_vectors.changed and pooled_vectors.is_outdated()):
+            path = self.folder / f"{splitter_type}-{embedder_type}-{experiment or 'default'}.npz"
+            pooled_vectors = self.pooled_vectors[key] = PooledVectors(path)
+        return pooled_vectors
+
+    def release(self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None) -> None:
+        """Drops the loaded pooled vectors, the next get loads them again."""
+        self.pooled_vectors.pop((splitter_type, embedder_type, experiment), None)
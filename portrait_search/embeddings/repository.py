@@ -1,15 +1,26 @@
 import abc
+import asyncio
+import json
+import os
 from collections import defaultdict
+from collections.abc import Collection, Iterable
+from itertools import product
 from pathlib import Path
+from typing import Any
 
 import chromadb
+import numpy as np
+from bson import Binary, ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from numpy.typing import NDArray
 
+from portrait_search.core.config import VectorIndexParams
 from portrait_search.core.enums import DistanceType, EmbedderType, SplitterType
+from portrait_search.core.generation import INDEX_GENERATION
 from portrait_search.core.mongodb import MongoDBRepository, PyObjectId
-from portrait_search.embeddings.distance import DISTANCE_TO_SIMILARITY
+from portrait_search.embeddings.distance import similarity_matrix
 
-from .entities import EmbeddingRecord, EmbeddingSimilarity
+from .entities import EmbeddingRecord, EmbeddingSimilarity, Vectors, to_vectors
 
 
 class EmbeddingRepository(abc.ABC):
@@ -17,16 +28,77 @@ class EmbeddingRepository(abc.ABC):
     async def get_by_type(self, splitter_type: SplitterType, embedder_type: EmbedderType) -> list[EmbeddingRecord]:
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    async def get_by_portrait_ids(
+        self,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        portrait_ids: Collection[ObjectId],
+        experiment: str | None = None,
+    ) -> list[EmbeddingRecord]:
+        """Returns all embeddings of the type of the given portraits."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def get_embedded_portrait_ids(
+        self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None = None
+    ) -> set[ObjectId]:
+        """Returns ids of portraits which have embeddings of the type, without loading the embeddings."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def get_description_hashes(
+        self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None = None
+    ) -> dict[ObjectId, str | None]:
+        """
+        Returns description hashes of embedded portraits by portrait id, without loading the embeddings.
+        The hash is None for embeddings stored before hashes were recorded.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def delete_by_portrait_ids(
+        self,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        portrait_ids: Collection[ObjectId],
+        experiment: str | None = None,
+    ) -> None:
+        """Deletes all embeddings of the type of the given portraits."""
+        raise NotImplementedError()
+
     @abc.abstractmethod
     async def vector_search(
         self,
-        query_vector: list[float],
+        query_vector: Vectors,
         splitter_type: SplitterType,
         embedder_type: EmbedderType,
         distance_type: DistanceType,
         experiment: str | None = None,
         limit: int = 10,
+        portrait_ids: Collection[ObjectId] | None = None,
     ) -> list[EmbeddingSimilarity]:
+        """
+        Returns the embeddings most similar to the query vector, best first. Similarities are the same on every
+        backend, the higher the better: see similarity_matrix.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def vector_search_many(
+        self,
+        query_vectors: Vectors,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        distance_type: DistanceType,
+        experiment: str | None = None,
+        limit: int = 10,
+        portrait_ids: Collection[ObjectId] | None = None,
+    ) -> list[list[EmbeddingSimilarity]]:
+        """
+        Same as vector_search, but searches for all query vectors, one per row, in one backend call.
+        With portrait ids, only embeddings of the portraits are searched.
+        """
         raise NotImplementedError()
 
     @abc.abstractmethod
@@ -41,6 +113,8 @@ class ChromaEmbeddingRepository(EmbeddingRepository):
         EmbedderType.ALL_MINI_LM_L6_V2: "allMLML6v2",
         EmbedderType.MS_MARCO_DISTILBERT_BASE_V4: "msmarcoDBBv4",
         EmbedderType.MS_MARCO_ROBERTA_BASE_ANCE_FIRSTP: "msmarcoRBAFp",
+        EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS_PCA_256: "instrLargePFCharPca256",
+        EmbedderType.ALL_MINI_LM_L6_V2_PCA_128: "allMLML6v2Pca128",
     }
     SPLITTER_TYPE_MAPPING = {
         SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_100_OVERLAP_60: "langchainRec100o60",
@@ -52,30 +126,51 @@ class ChromaEmbeddingRepository(EmbeddingRepository):
         SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_300_OVERLAP_100: "langchainRec300o100",
         SplitterType.COMBINE_LCHUNK_160_O40_AND_LCHUNK_120_O60: "combineL160o40L120o60",
     }
-    DISTANCE_TYPE_MAPPING = {
-        DistanceType.EUCLIDEAN: "l2",
-        DistanceType.COSINE: "cosine",
-        DistanceType.DOT_PRODUCT: "ip",
-    }
+    # each embedding is stored once, normalized, in an inner product space: the inner product of normalized
+    # vectors is the cosine similarity, dot products and euclidean distances are derived from it and the norms
+    SPACE = "ip"
+    LEGACY_SPACES = ("l2", "cosine", "ip")
+    # dot product and euclidean results are reranked from this many times more cosine candidates
+    RERANK_CANDIDATES_FACTOR = 4
+    MIGRATION_BATCH_SIZE = 1000
 
-    def __init__(self, databases_path: Path):
+    def __init__(self, databases_path: Path, index_params: VectorIndexParams | None = None):
         self.client = chromadb.PersistentClient(path=str(databases_path / "chroma.db"))
+        self.index_params = index_params or VectorIndexParams()
 
-    def _distance_type_to_space(self, distance_type: DistanceType) -> str:
-        if distance_type in self.DISTANCE_TYPE_MAPPING:
-            return self.DISTANCE_TYPE_MAPPING[distance_type]
-        raise ValueError(f"distance_type {distance_type} is not supported in Chroma")
-
-    def get_collection(
-        self, splitter_type: SplitterType, embedder_type: EmbedderType, distance_type: DistanceType
-    ) -> chromadb.Collection:
+    def _collection_name(self, splitter_type: SplitterType, embedder_type: EmbedderType) -> str:
         stype = self.SPLITTER_TYPE_MAPPING[splitter_type]
         etype = self.EMBEDDER_TYPE_MAPPTING[embedder_type]
-        dtype = self._distance_type_to_space(distance_type)
-        name = f"e-{stype}-{etype}-{dtype}"
-        return self.client.get_or_create_collection(
-            name, metadata={"hnsw:space": self._distance_type_to_space(distance_type)}
-        )
+        return f"e-{stype}-{etype}"
+
+    def get_collection(self, splitter_type: SplitterType, embedder_type: EmbedderType) -> chromadb.Collection:
+        name = self._collection_name(splitter_type, embedder_type)
+        # not get_or_create_collection: it overwrites the metadata of an existing collection, while its index keeps
+        # the HNSW parameters of its creation, so the metadata would no longer tell them
+        try:
+            return self.client.get_collection(name)
+        except ValueError:
+            return self.client.create_collection(name, metadata=self._collection_metadata(splitter_type, embedder_type))
+
+    def _collection_metadata(self, splitter_type: SplitterType, embedder_type: EmbedderType) -> dict[str, Any]:
+        params = self.index_params.for_collection(splitter_type, embedder_type)
+        return {
+            "hnsw:space": self.SPACE,
+            "hnsw:construction_ef": params.construction_ef,
+            "hnsw:search_ef": params.search_ef,
+            "hnsw:M": params.m,
+        }
+
+    def _is_stale(self, collection: chromadb.Collection, metadata: dict[str, Any]) -> bool:
+        # collections created before the parameters were configurable were built with the defaults
+        defaults = VectorIndexParams()
+        current = {
+            "hnsw:construction_ef": defaults.construction_ef,
+            "hnsw:search_ef": defaults.search_ef,
+            "hnsw:M": defaults.m,
+            **(collection.metadata or {}),
+        }
+        return any(current.get(key) != value for key, value in metadata.items())
 
     def _chroma_get_to_embedding_record(
         self, get_result: chromadb.GetResult, splitter_type: SplitterType, embedder_type: EmbedderType
@@ -91,7 +186,7 @@ class ChromaEmbeddingRepository(EmbeddingRepository):
 
         results = []
         for id, metatada, document, embedding in zip(
-            get_result["ids"], get_result["metadatas"], get_result["documents"], get_result["embeddings"]
+            get_result["ids"], get_result["metadatas"], get_result["documents"], to_vectors(get_result["embeddings"])
         ):
             if not isinstance(metatada["portrait_id"], str):
                 raise ValueError("metatada['portrait_id'] must be str")
@@ -100,16 +195,24 @@ class ChromaEmbeddingRepository(EmbeddingRepository):
                 EmbeddingRecord(
                     id=PyObjectId(id),  # type: ignore
                     portrait_id=PyObjectId(metatada["portrait_id"]),
-                    embedding=list(embedding),
+                    # vectors of legacy collections are stored as is, without a norm
+                    embedding=embedding * float(metatada.get("norm", 1.0)),
                     embedded_text=document,
                     splitter_type=splitter_type,
                     embedder_type=embedder_type,
+                    experiment=str(metatada.get("experiment") or "") or None,
+                    description_hash=str(metatada.get("description_hash") or "") or None,
                 )
             )
         return results
 
     def _chroma_query_to_embedding_similarity(
-        self, query_result: chromadb.QueryResult, distance_type: DistanceType
+        self,
+        query_result: chromadb.QueryResult,
+        distance_type: DistanceType,
+        query_vector: Vectors,
+        query_index: int = 0,
+        limit: int = 10,
     ) -> list[EmbeddingSimilarity]:
         if query_result is None:
             return []
@@ -122,59 +225,148 @@ class ChromaEmbeddingRepository(EmbeddingRepository):
         if query_result["distances"] is None:
             raise ValueError("query_result must have distances")
 
-        results = []
-        for id, metatada, document, embedding, distance in zip(
-            query_result["ids"][0],
-            query_result["metadatas"][0],
-            query_result["documents"][0],
-            query_result["embeddings"][0],
-            query_result["distances"][0],
-        ):
+        metadatas = query_result["metadatas"][query_index]
+        if not metadatas:
+            return []
+        for metatada in metadatas:
             if not isinstance(metatada["portrait_id"], str):
                 raise ValueError("metatada['portrait_id'] must be str")
-            similarity = DISTANCE_TO_SIMILARITY[distance_type](distance)
+        norms = np.array([metatada["norm"] for metatada in metadatas], dtype=np.float32)
+        embeddings = to_vectors(query_result["embeddings"][query_index]) * norms[:, None]
+        # scored from the vectors, not from the inner product distances of the collection space
+        similarities = similarity_matrix(embeddings, norms, to_vectors(query_vector)[np.newaxis], distance_type)[:, 0]
+
+        results = []
+        for i in np.argsort(-similarities, kind="stable")[:limit]:
             results.append(
                 EmbeddingSimilarity(
-                    id=PyObjectId(id),  # type: ignore
-                    portrait_id=PyObjectId(metatada["portrait_id"]),
-                    embedding=list(embedding),
-                    embedded_text=document,
-                    similarity=similarity,
+                    portrait_id=PyObjectId(str(metadatas[i]["portrait_id"])),
+                    embedding=embeddings[i],
+                    embedded_text=query_result["documents"][query_index][i],
+                    similarity=float(similarities[i]),
                 )
             )
         return results
 
     async def get_by_type(self, splitter_type: SplitterType, embedder_type: EmbedderType) -> list[EmbeddingRecord]:
-        # Similarity does not matter in this context, data should be replicated across all spaces
-        collection = self.get_collection(splitter_type, embedder_type, DistanceType.EUCLIDEAN)
+        collection = self.get_collection(splitter_type, embedder_type)
         records = collection.get(include=["documents", "embeddings", "metadatas"])
         return self._chroma_get_to_embedding_record(records, splitter_type, embedder_type)
 
+    async def get_by_portrait_ids(
+        self,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        portrait_ids: Collection[ObjectId],
+        experiment: str | None = None,
+    ) -> list[EmbeddingRecord]:
+        if not portrait_ids:
+            return []
+        collection = self.get_collection(splitter_type, embedder_type)
+        records = collection.get(
+            where=self._where(experiment, portrait_ids), include=["documents", "embeddings", "metadatas"]
+        )
+        return self._chroma_get_to_embedding_record(records, splitter_type, embedder_type)
+
+    def _where(self, experiment: str | None, portrait_ids: Collection[ObjectId] | None = None) -> dict[str, Any] | None:
+        conditions: list[dict[str, Any]] = []
+        if experiment:
+            conditions.append({"experiment": experiment})
+        if portrait_ids is not None:
+            conditions.append({"portrait_id": {"$in": [str(portrait_id) for portrait_id in portrait_ids]}})
+        if len(conditions) > 1:
+            return {"$and": conditions}
+        return conditions[0] if conditions else None
+
+    async def get_embedded_portrait_ids(
+        self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None = None
+    ) -> set[ObjectId]:
+        return set(await self.get_description_hashes(splitter_type, embedder_type, experiment))
+
+    async def get_description_hashes(
+        self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None = None
+    ) -> dict[ObjectId, str | None]:
+        collection = self.get_collection(splitter_type, embedder_type)
+        records = collection.get(where={"experiment": experiment} if experiment else None, include=["metadatas"])
+        return {
+            ObjectId(str(metadata["portrait_id"])): str(metadata.get("description_hash") or "") or None
+            for metadata in records["metadatas"] or []
+        }
+
+    async def delete_by_portrait_ids(
+        self,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        portrait_ids: Collection[ObjectId],
+        experiment: str | None = None,
+    ) -> None:
+        if not portrait_ids:
+            return
+        collection = self.get_collection(splitter_type, embedder_type)
+        ids = collection.get(where=self._where(experiment, portrait_ids), include=[])["ids"]
+        if ids:
+            collection.delete(ids=ids)
+            INDEX_GENERATION.bump()
+
     async def vector_search(
         self,
-        query_vector: list[float],
+        query_vector: Vectors,
         splitter_type: SplitterType,
         embedder_type: EmbedderType,
         distance_type: DistanceType,
         experiment: str | None = None,
         limit: int = 10,
+        portrait_ids: Collection[ObjectId] | None = None,
     ) -> list[EmbeddingSimilarity]:
-        collection = self.get_collection(splitter_type, embedder_type, distance_type)
-        if experiment:
-            where: chromadb.Where | None = {"experiment": experiment}
-        else:
-            where = None
+        similarities = await self.vector_search_many(
+            query_vector[np.newaxis],
+            splitter_type,
+            embedder_type,
+            distance_type,
+            experiment=experiment,
+            limit=limit,
+            portrait_ids=portrait_ids,
+        )
+        return similarities[0]
+
+    async def vector_search_many(
+        self,
+        query_vectors: Vectors,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        distance_type: DistanceType,
+        experiment: str | None = None,
+        limit: int = 10,
+        portrait_ids: Collection[ObjectId] | None = None,
+    ) -> list[list[EmbeddingSimilarity]]:
+        """
+        Cosine similarity is searched by the index. Euclidean and dot product results are reranked from
+        RERANK_CANDIDATES_FACTOR times more cosine candidates, so they lose recall: a chunk ranking in the limit by
+        them but not in the candidates by cosine is not found.
+        """
+        if len(query_vectors) == 0:
+            return []
+        if portrait_ids is not None and not portrait_ids:
+            return [[] for _ in query_vectors]
+        collection = self.get_collection(splitter_type, embedder_type)
+        n_results = limit if distance_type == DistanceType.COSINE else limit * self.RERANK_CANDIDATES_FACTOR
+        normalized_query_vectors, _ = _normalize(to_vectors(query_vectors))
         records = collection.query(
-            query_embeddings=query_vector,
-            n_results=limit,
-            where=where,
+            query_embeddings=normalized_query_vectors.tolist(),
+            n_results=n_results,
+            where=self._where(experiment, portrait_ids),  # type: ignore[arg-type]
             include=["documents", "embeddings", "metadatas", "distances"],
         )
-        similarities = self._chroma_query_to_embedding_similarity(records, distance_type)
-        for similarity in similarities:
-            similarity.query = query_vector
+        all_similarities = []
+        for query_index, query_vector in enumerate(query_vectors):
+            similarities = self._chroma_query_to_embedding_similarity(
+                records, distance_type, query_vector, query_index, limit
+            )
+            for similarity in similarities:
+                similarity.query = query_vector
+            all_similarities.append(similarities)
 
-        return similarities
+        return all_similarities
 
     async def insert_many(self, records: list[EmbeddingRecord]) -> list[EmbeddingRecord]:
         records_by_type = defaultdict(list)
@@ -182,78 +374,651 @@ class ChromaEmbeddingRepository(EmbeddingRepository):
             record.id = PyObjectId()
             records_by_type[(record.splitter_type, record.embedder_type)].append(record)
 
-        for similarity_type in DistanceType:
-            for (splitter_type, embedder_type), records in records_by_type.items():
-                collection = self.get_collection(splitter_type, embedder_type, similarity_type)
-                ids = [str(record.id) for record in records]
-                documents = [record.embedded_text for record in records]
-                embeddings = [record.embedding for record in records]
-                metadatas = [
-                    {"portrait_id": str(record.portrait_id), "experiment": record.experiment or ""}
-                    for record in records
-                ]
+        for (splitter_type, embedder_type), type_records in records_by_type.items():
+            self._add(self.get_collection(splitter_type, embedder_type), type_records)
+        INDEX_GENERATION.bump()
+        return records
+
+    def _add(self, collection: chromadb.Collection, records: list[EmbeddingRecord], upsert: bool = False) -> None:
+        vectors, norms = _normalize(np.stack([record.embedding for record in records]))
+        metadatas = [
+            {
+                "portrait_id": str(record.portrait_id),
+                "experiment": record.experiment or "",
+                "description_hash": record.description_hash or "",
+                "norm": float(norm),
+            }
+            for record, norm in zip(records, norms)
+        ]
+        add = collection.upsert if upsert else collection.add
+        add(
+            ids=[str(record.id) for record in records],
+            documents=[record.embedded_text for record in records],
+            embeddings=vectors.tolist(),
+            metadatas=metadatas,  # type: ignore
+        )
+
+    def migrate_legacy_collections(self) -> dict[str, int]:
+        """
+        Moves embeddings of collections stored once per distance type into a single collection per
+        (splitter, embedder) and deletes the legacy collections. Safe to rerun after a failure.
+        Returns the number of migrated embeddings per new collection.
+        """
+        existing = {collection.name for collection in self.client.list_collections()}
+        migrated = {}
+        for splitter_type, embedder_type in product(self.SPLITTER_TYPE_MAPPING, self.EMBEDDER_TYPE_MAPPTING):
+            name = self._collection_name(splitter_type, embedder_type)
+            legacy_names = [f"{name}-{space}" for space in self.LEGACY_SPACES if f"{name}-{space}" in existing]
+            if not legacy_names:
+                continue
 
-                collection.add(
-                    ids=ids,
-                    documents=documents,
-                    embeddings=embeddings,  # type: ignore
-                    metadatas=metadatas,  # type: ignore
+            # data is replicated across all legacy spaces
+            legacy_collection = self.client.get_collection(legacy_names[0])
+            collection = self.get_collection(splitter_type, embedder_type)
+            migrated[name] = 0
+            for offset in range(0, legacy_collection.count(), self.MIGRATION_BATCH_SIZE):
+                batch = legacy_collection.get(
+                    include=["documents", "embeddings", "metadatas"], limit=self.MIGRATION_BATCH_SIZE, offset=offset
                 )
-        return records
+                records = self._chroma_get_to_embedding_record(batch, splitter_type, embedder_type)
+                self._add(collection, records, upsert=True)
+                migrated[name] += len(records)
+            for legacy_name in legacy_names:
+                self.client.delete_collection(legacy_name)
+        INDEX_GENERATION.bump()
+        return migrated
+
+    def rebuild_stale_collections(self) -> dict[str, int]:
+        """
+        Rebuilds collections created with other HNSW parameters than the configured ones: Chroma fixes them
+        when a collection is created. Safe to rerun after a failure.
+        Returns the number of reindexed embeddings per collection.
+        """
+        existing = {collection.name: collection for collection in self.client.list_collections()}
+        rebuilt = {}
+        for splitter_type, embedder_type in product(self.SPLITTER_TYPE_MAPPING, self.EMBEDDER_TYPE_MAPPTING):
+            name = self._collection_name(splitter_type, embedder_type)
+            metadata = self._collection_metadata(splitter_type, embedder_type)
+            rebuild_name = f"{name}-rebuild"
+            if rebuild_name in existing:
+                # a failed rebuild, the original collection is complete unless it was already deleted
+                if name in existing:
+                    self.client.delete_collection(rebuild_name)
+                else:
+                    existing[rebuild_name].modify(name=name)
+                    existing[name] = existing.pop(rebuild_name)
+            if name not in existing or not self._is_stale(existing[name], metadata):
+                continue
+
+            collection = existing[name]
+            rebuild = self.client.create_collection(rebuild_name, metadata=metadata)
+            rebuilt[name] = 0
+            for offset in range(0, collection.count(), self.MIGRATION_BATCH_SIZE):
+                batch = collection.get(
+                    include=["documents", "embeddings", "metadatas"], limit=self.MIGRATION_BATCH_SIZE, offset=offset
+                )
+                records = self._chroma_get_to_embedding_record(batch, splitter_type, embedder_type)
+                self._add(rebuild, records, upsert=True)
+                rebuilt[name] += len(records)
+            self.client.delete_collection(name)
+            rebuild.modify(name=name)
+        INDEX_GENERATION.bump()
+        return rebuilt
+
+
+def _normalize(vectors: Vectors) -> tuple[Vectors, Vectors]:
+    """Returns L2-normalized vectors, one per row, and their norms."""
+    norms = np.linalg.norm(vectors, axis=1)
+    return vectors / np.maximum(norms, np.finfo(np.float32).eps)[:, None], norms
+
 
+# BSON binary vector subtype: a dtype byte (float32) and a padding byte, followed by little-endian elements
+BSON_VECTOR_SUBTYPE = 9
+BSON_VECTOR_FLOAT32_HEADER = b"\x27\x00"
 
-class MongoEmbeddingRepository(MongoDBRepository[EmbeddingRecord]):
-    def __init__(self, db: AsyncIOMotorDatabase):
+
+def _encode_vector(vector: Vectors) -> Binary:
+    return Binary(BSON_VECTOR_FLOAT32_HEADER + vector.astype("<f4", copy=False).tobytes(), BSON_VECTOR_SUBTYPE)
+
+
+def _decode_vector(value: Any) -> Any:
+    """Decodes a packed float32 vector without a copy, arrays of doubles are left to the model."""
+    if isinstance(value, Binary) and value.subtype == BSON_VECTOR_SUBTYPE:
+        return np.frombuffer(value, dtype="<f4", offset=len(BSON_VECTOR_FLOAT32_HEADER))
+    return value
+
+
+class MongoEmbeddingRepository(MongoDBRepository[EmbeddingRecord], EmbeddingRepository):
+    # $vectorSearch limit of numCandidates
+    MAX_NUM_CANDIDATES = 10000
+
+    def __init__(
+        self, db: AsyncIOMotorDatabase, binary_vectors: bool = False, index_params: VectorIndexParams | None = None
+    ):
         super().__init__(db, EmbeddingRecord)
+        self.index_params = index_params or VectorIndexParams()
+        # packed float32 instead of an array of doubles: 4 instead of 9 bytes per dimension, decoded without a copy.
+        # Vectors of both formats are read, so a collection can be converted gradually.
+        self.binary_vectors = binary_vectors
 
     @property
     def collection(self) -> str:
         return "embeddings"
 
+    def _to_entity(self, record: EmbeddingRecord) -> dict[str, Any]:
+        if not self.binary_vectors:
+            return super()._to_entity(record)
+        entity = record.model_dump(by_alias=True, exclude={"id", "embedding"})
+        entity["embedding"] = _encode_vector(record.embedding)
+        return entity
+
+    def _from_entity(self, entity: dict[str, Any]) -> EmbeddingRecord:
+        entity["embedding"] = _decode_vector(entity["embedding"])
+        return super()._from_entity(entity)
+
     async def get_by_type(self, splitter_type: SplitterType, embedder_type: EmbedderType) -> list[EmbeddingRecord]:
         return await self.get_many(
             splitter_type=str(splitter_type),
             embedder_type=str(embedder_type),
         )
 
+    async def get_by_portrait_ids(
+        self,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        portrait_ids: Collection[ObjectId],
+        experiment: str | None = None,
+    ) -> list[EmbeddingRecord]:
+        return await self.get_many(
+            **self._type_filter(splitter_type, embedder_type, experiment), portrait_id={"$in": list(portrait_ids)}
+        )
+
+    async def get_embedded_portrait_ids(
+        self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None = None
+    ) -> set[ObjectId]:
+        # covered by the index, documents are not fetched
+        filter = self._type_filter(splitter_type, embedder_type, experiment)
+        return set(await self.db[self.collection].distinct("portrait_id", filter))
+
+    async def get_description_hashes(
+        self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None = None
+    ) -> dict[ObjectId, str | None]:
+        entities = self.db[self.collection].aggregate(
+            [
+                {"$match": self._type_filter(splitter_type, embedder_type, experiment)},
+                {"$group": {"_id": "$portrait_id", "description_hash": {"$first": "$description_hash"}}},
+            ]
+        )
+        return {entity["_id"]: entity["description_hash"] async for entity in entities}
+
+    async def delete_by_portrait_ids(
+        self,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        portrait_ids: Collection[ObjectId],
+        experiment: str | None = None,
+    ) -> None:
+        filter = {
+            **self._type_filter(splitter_type, embedder_type, experiment),
+            "portrait_id": {"$in": list(portrait_ids)},
+        }
+        await self.db[self.collection].delete_many(filter)
+        INDEX_GENERATION.bump()
+
+    def _type_filter(
+        self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None
+    ) -> dict[str, str]:
+        filter = {"splitter_type": str(splitter_type), "embedder_type": str(embedder_type)}
+        if experiment:
+            filter["experiment"] = experiment
+        return filter
+
+    async def prepare_collection_resources(self) -> None:
+        await self.db[self.collection].create_index(
+            [
+                ("splitter_type", 1),
+                ("embedder_type", 1),
+                ("experiment", 1),
+                ("portrait_id", 1),
+                ("description_hash", 1),
+            ]
+        )
+
     async def vector_search(
         self,
-        query_vector: list[float],
+        query_vector: Vectors,
         splitter_type: SplitterType,
         embedder_type: EmbedderType,
         distance_type: DistanceType,
         experiment: str | None = None,
         limit: int = 10,
+        portrait_ids: Collection[ObjectId] | None = None,
     ) -> list[EmbeddingSimilarity]:
         """Returns a list of Embeddings and their similarities that match the query vector."""
-        filter = [
+        similarities = await self.vector_search_many(
+            query_vector[np.newaxis],
+            splitter_type,
+            embedder_type,
+            distance_type,
+            experiment=experiment,
+            limit=limit,
+            portrait_ids=portrait_ids,
+        )
+        return similarities[0]
+
+    async def vector_search_many(
+        self,
+        query_vectors: Vectors,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        distance_type: DistanceType,
+        experiment: str | None = None,
+        limit: int = 10,
+        portrait_ids: Collection[ObjectId] | None = None,
+    ) -> list[list[EmbeddingSimilarity]]:
+        """
+        Runs a $vectorSearch pipeline per query vector concurrently: $vectorSearch has to be the first stage
+        of a pipeline, so the searches can not be combined into one aggregation.
+        """
+        filter: list[dict[str, Any]] = [
             {"splitter_type": splitter_type},
             {"embedder_type": embedder_type},
         ]
         if experiment:
             filter.append({"experiment": experiment})
-        entities = self.db[self.collection].aggregate(
-            [
-                {
-                    "$vectorSearch": {
-                        "index": f"portrait-embeddings-search-{distance_type}",
-                        "path": "embedding",
-                        "queryVector": query_vector,
-                        "numCandidates": limit * 20,
-                        "limit": limit,
-                        "filter": {
-                            "$and": filter  # for some reason, $and is required here
-                        },
-                    }
-                },
-                {
-                    "$project": {
-                        "portrait_id": 1,
-                        "embedding": 1,
-                        "embedded_text": 1,
-                        "similarity": {"$meta": "vectorSearchScore"},
-                    }
-                },
+        if portrait_ids is not None:
+            if not portrait_ids:
+                return [[] for _ in query_vectors]
+            # portrait_id is a filter field of the search index, candidates are drawn from the portraits only
+            filter.append({"portrait_id": {"$in": list(portrait_ids)}})
+        params = self.index_params.for_collection(splitter_type, embedder_type)
+        num_candidates = min(max(limit * params.num_candidates_factor, limit), self.MAX_NUM_CANDIDATES)
+
+        async def search(query_vector: Vectors) -> list[EmbeddingSimilarity]:
+            entities = self.db[self.collection].aggregate(
+                [
+                    {
+                        "$vectorSearch": {
+                            "index": f"portrait-embeddings-search-{distance_type}",
+                            "path": "embedding",
+                            "queryVector": query_vector.tolist(),
+                            "numCandidates": num_candidates,
+                            "limit": limit,
+                            "filter": {
+                                "$and": filter  # for some reason, $and is required here
+                            },
+                        }
+                    },
+                    {"$project": {"portrait_id": 1, "embedding": 1, "embedded_text": 1}},
+                ]
+            )
+            found = [
+                {**entity, "embedding": to_vectors(_decode_vector(entity["embedding"]))} async for entity in entities
+            ]
+            if not found:
+                return []
+            # vectorSearchScore is normalized per similarity function, scored from the vectors as by other backends
+            embeddings = np.stack([entity["embedding"] for entity in found])
+            norms = np.linalg.norm(embeddings, axis=1)
+            query = to_vectors(query_vector)[np.newaxis]
+            similarities = similarity_matrix(embeddings, norms, query, distance_type)[:, 0]
+            return [
+                EmbeddingSimilarity.model_validate({**found[i], "similarity": float(similarities[i])})
+                for i in np.argsort(-similarities, kind="stable")
             ]
+
+        return list(await asyncio.gather(*(search(query_vector) for query_vector in query_vectors)))
+
+
+class _NumpyCollection:
+    """
+    On-disk layout of one (splitter, embedder) collection, one row per vector in every file:
+    - vectors.f32: contiguous float32 matrix (count x dimensionality), memory-mapped on load
+    - norms.f32: L2 norm of every vector, so cosine and euclidean scores need no pass over the matrix
+    - ids.bin, portrait_ids.bin: raw 12 bytes ObjectIds of embeddings and their portraits
+    - text_ends.i64, texts.bin: utf-8 chunk texts and the offset in texts.bin where every chunk ends
+    - experiments.i32: index of the experiment of each vector in meta.json "experiments"
+    - description_hashes.bin: 64 bytes description hash of each vector, zero padded
+    meta.json holds the count of rows and is written last: rows past the count, left by an interrupted append,
+    are ignored on load and truncated by the next append. Every write replaces meta.json, so a collection opened
+    before a write of another process is found outdated by the file status of meta.json.
+    """
+
+    # file name, dtype and elements per row of every file besides vectors.f32 and texts.bin
+    ROW_FILES: dict[str, tuple[str, np.dtype[Any], int]] = {
+        "norms": ("norms.f32", np.dtype(np.float32), 1),
+        "ids": ("ids.bin", np.dtype(np.uint8), 12),
+        "portrait_ids": ("portrait_ids.bin", np.dtype(np.uint8), 12),
+        "text_ends": ("text_ends.i64", np.dtype(np.int64), 1),
+        "experiment_indices": ("experiments.i32", np.dtype(np.int32), 1),
+        "description_hashes": ("description_hashes.bin", np.dtype("S64"), 1),
+    }
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        meta_path = path / "meta.json"
+        # status before the read: a write during the load makes the collection outdated
+        self.meta_status = self._meta_status()
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+        self.count: int = meta.get("count", 0)
+        self.dimensionality: int | None = meta.get("dimensionality")
+        self.experiments: list[str] = meta.get("experiments", [])
+
+        self.vectors: NDArray[np.float32] = np.zeros((0, self.dimensionality or 0), dtype=np.float32)
+        self.norms: NDArray[np.float32] = np.zeros(0, dtype=np.float32)
+        self.ids: NDArray[np.uint8] = np.zeros((0, 12), dtype=np.uint8)
+        self.portrait_ids: NDArray[np.uint8] = np.zeros((0, 12), dtype=np.uint8)
+        self.offsets: NDArray[np.int64] = np.zeros(1, dtype=np.int64)
+        self.experiment_indices: NDArray[np.int32] = np.zeros(0, dtype=np.int32)
+        self.description_hashes: NDArray[np.bytes_] = np.zeros(0, dtype="S64")
+        self.texts = b""
+        self.portrait_order: NDArray[np.intp] | None = None
+        self.sorted_portrait_ids: NDArray[np.bytes_] | None = None
+        if self.count:
+            self.vectors = np.memmap(
+                path / "vectors.f32", dtype=np.float32, mode="r", shape=(self.count, self.dimensionality or 0)
+            )
+            self.norms = self._read("norms")
+            self.ids = self._read("ids")
+            self.portrait_ids = self._read("portrait_ids")
+            self.offsets = np.concatenate(([0], self._read("text_ends")))
+            self.experiment_indices = self._read("experiment_indices")
+            self.description_hashes = self._read("description_hashes")
+            with open(path / "texts.bin", "rb") as f:
+                self.texts = f.read(int(self.offsets[-1]))
+
+    def _meta_status(self) -> tuple[int, int] | None:
+        try:
+            status = os.stat(self.path / "meta.json")
+        except FileNotFoundError:
+            return None
+        return status.st_ino, status.st_mtime_ns
+
+    def is_outdated(self) -> bool:
+        """Whether the collection was written since it was opened, by this or another process."""
+        return self._meta_status() != self.meta_status
+
+    def _read(self, name: str) -> Any:
+        file_name, dtype, width = self.ROW_FILES[name]
+        rows = np.fromfile(self.path / file_name, dtype=dtype, count=self.count * width)
+        return rows.reshape(-1, width) if width > 1 else rows
+
+    def _append(self, file_name: str, data: bytes, size: int) -> None:
+        """Appends to a file after its first size bytes, dropping what an interrupted append left after them."""
+        with open(self.path / file_name, "ab") as f:
+            f.truncate(size)
+            f.write(data)
+
+    def text(self, i: int) -> str:
+        return self.texts[self.offsets[i] : self.offsets[i + 1]].decode("utf-8")
+
+    def portrait_rows(self, portrait_ids: Collection[ObjectId]) -> NDArray[np.intp]:
+        """Returns rows of the vectors of the portraits, looked up in the rows sorted by portrait id."""
+        if self.portrait_order is None or self.sorted_portrait_ids is None:
+            # sorted once per opened collection, the collection is reopened after every write
+            self.portrait_order = np.argsort(self.portrait_ids.view("S12").ravel(), kind="stable")
+            self.sorted_portrait_ids = self.portrait_ids.view("S12").ravel()[self.portrait_order]
+        sorted_portrait_ids = self.sorted_portrait_ids
+        keys = np.array([portrait_id.binary for portrait_id in portrait_ids], dtype="S12")
+        starts = np.searchsorted(sorted_portrait_ids, keys, side="left")
+        ends = np.searchsorted(sorted_portrait_ids, keys, side="right")
+        rows = [self.portrait_order[start:end] for start, end in zip(starts, ends)]
+        return np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.intp)
+
+    def experiment_mask(self, experiment: str | None) -> NDArray[np.bool_] | None:
+        if not experiment:
+            return None
+        if experiment not in self.experiments:
+            return np.zeros(self.count, dtype=np.bool_)
+        return self.experiment_indices == self.experiments.index(experiment)
+
+    def append(self, records: list[EmbeddingRecord]) -> None:
+        """Appends the records to every file, only the new rows are written."""
+        vectors = np.stack([record.embedding for record in records]).astype(np.float32, copy=False)
+        if self.dimensionality is not None and vectors.shape[1] != self.dimensionality:
+            raise ValueError(
+                f"Collection {self.path.name} stores {self.dimensionality}-dimensional vectors, "
+                f"got {vectors.shape[1]}-dimensional"
+            )
+        experiments = list(self.experiments)
+        for record in records:
+            if (record.experiment or "") not in experiments:
+                experiments.append(record.experiment or "")
+        encoded_texts = [record.embedded_text.encode("utf-8") for record in records]
+        rows: dict[str, NDArray[Any]] = {
+            "norms": np.linalg.norm(vectors, axis=1).astype(np.float32),
+            "ids": _object_ids_to_array(r.id for r in records),
+            "portrait_ids": _object_ids_to_array(r.portrait_id for r in records),
+            "text_ends": self.offsets[-1] + np.cumsum([len(text) for text in encoded_texts], dtype=np.int64),
+            "experiment_indices": np.array([experiments.index(r.experiment or "") for r in records], dtype=np.int32),
+            "description_hashes": np.array([r.description_hash or "" for r in records], dtype="S64"),
+        }
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._append("vectors.f32", vectors.tobytes(), self.count * vectors.shape[1] * vectors.itemsize)
+        self._append("texts.bin", b"".join(encoded_texts), int(self.offsets[-1]))
+        for name, (file_name, dtype, width) in self.ROW_FILES.items():
+            self._append(file_name, rows[name].tobytes(), self.count * width * dtype.itemsize)
+        # meta.json is written last: it defines how many rows of the other files are valid
+        meta = {"count": self.count + len(records), "dimensionality": vectors.shape[1], "experiments": experiments}
+        self._write_meta(meta)
+
+    def delete(self, mask: NDArray[np.bool_]) -> None:
+        """Rewrites the collection without the masked vectors."""
+        keep = ~mask
+        encoded_texts = [self.texts[self.offsets[i] : self.offsets[i + 1]] for i in np.flatnonzero(keep)]
+        # replaced, not truncated: vectors returned before stay readable through the old memory map
+        tmp_path = self.path / "vectors.f32.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(np.ascontiguousarray(self.vectors[keep]).tobytes())
+        tmp_path.replace(self.path / "vectors.f32")
+        (self.path / "texts.bin").write_bytes(b"".join(encoded_texts))
+        rows = {
+            "norms": self.norms[keep],
+            "ids": self.ids[keep],
+            "portrait_ids": self.portrait_ids[keep],
+            "text_ends": np.cumsum([len(text) for text in encoded_texts], dtype=np.int64),
+            "experiment_indices": self.experiment_indices[keep],
+            "description_hashes": self.description_hashes[keep],
+        }
+        for name, (file_name, _, _) in self.ROW_FILES.items():
+            (self.path / file_name).write_bytes(np.ascontiguousarray(rows[name]).tobytes())
+        meta = {"count": int(keep.sum()), "dimensionality": self.dimensionality, "experiments": self.experiments}
+        self._write_meta(meta)
+
+    def _write_meta(self, meta: dict[str, Any]) -> None:
+        tmp_path = self.path / "meta.json.tmp"
+        tmp_path.write_text(json.dumps(meta))
+        tmp_path.replace(self.path / "meta.json")
+
+
+def _object_ids_to_array(ids: Iterable[ObjectId | None]) -> NDArray[np.uint8]:
+    return np.array([list(id.binary) for id in ids if id is not None], dtype=np.uint8).reshape(-1, 12)
+
+
+class NumpyEmbeddingRepository(EmbeddingRepository):
+    """
+    Exact in-process vector search over memory-mapped float32 matrices.
+    At our corpus size a matmul over the whole collection is faster than an HNSW lookup through Chroma.
+    """
+
+    def __init__(self, databases_path: Path):
+        self.path = databases_path / "numpy.db"
+        self.collections: dict[tuple[SplitterType, EmbedderType], _NumpyCollection] = {}
+
+    def get_collection(self, splitter_type: SplitterType, embedder_type: EmbedderType) -> _NumpyCollection:
+        """Returns the opened collection, reopened if it was written since, as by the generation scripts."""
+        key = (splitter_type, embedder_type)
+        collection = self.collections.get(key)
+        if collection is None or collection.is_outdated():
+            collection = self.collections[key] = _NumpyCollection(self.path / f"e-{splitter_type}-{embedder_type}")
+        return collection
+
+    def _records(
+        self,
+        collection: _NumpyCollection,
+        rows: Iterable[int],
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+    ) -> list[EmbeddingRecord]:
+        return [
+            EmbeddingRecord(
+                id=PyObjectId(collection.ids[i].tobytes()),  # type: ignore
+                portrait_id=PyObjectId(collection.portrait_ids[i].tobytes()),
+                embedding=collection.vectors[i],
+                embedded_text=collection.text(i),
+                splitter_type=splitter_type,
+                embedder_type=embedder_type,
+                experiment=collection.experiments[collection.experiment_indices[i]] or None,
+                description_hash=collection.description_hashes[i].decode() or None,
+            )
+            for i in rows
+        ]
+
+    async def get_by_type(self, splitter_type: SplitterType, embedder_type: EmbedderType) -> list[EmbeddingRecord]:
+        collection = self.get_collection(splitter_type, embedder_type)
+        return self._records(collection, range(collection.count), splitter_type, embedder_type)
+
+    async def get_by_portrait_ids(
+        self,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        portrait_ids: Collection[ObjectId],
+        experiment: str | None = None,
+    ) -> list[EmbeddingRecord]:
+        collection = self.get_collection(splitter_type, embedder_type)
+        if collection.count == 0 or not portrait_ids:
+            return []
+        rows = collection.portrait_rows(portrait_ids)
+        if experiment:
+            experiment_index = collection.experiments.index(experiment) if experiment in collection.experiments else -1
+            rows = rows[collection.experiment_indices[rows] == experiment_index]
+        return self._records(collection, rows, splitter_type, embedder_type)
+
+    async def get_embedded_portrait_ids(
+        self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None = None
+    ) -> set[ObjectId]:
+        collection = self.get_collection(splitter_type, embedder_type)
+        mask = collection.experiment_mask(experiment)
+        portrait_ids = collection.portrait_ids if mask is None else collection.portrait_ids[mask]
+        return {ObjectId(portrait_id.tobytes()) for portrait_id in np.unique(portrait_ids, axis=0)}
+
+    async def get_description_hashes(
+        self, splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None = None
+    ) -> dict[ObjectId, str | None]:
+        collection = self.get_collection(splitter_type, embedder_type)
+        mask = collection.experiment_mask(experiment)
+        rows = range(collection.count) if mask is None else np.flatnonzero(mask)
+        return {
+            ObjectId(collection.portrait_ids[i].tobytes()): collection.description_hashes[i].decode() or None
+            for i in rows
+        }
+
+    async def delete_by_portrait_ids(
+        self,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        portrait_ids: Collection[ObjectId],
+        experiment: str | None = None,
+    ) -> None:
+        collection = self.get_collection(splitter_type, embedder_type)
+        mask = np.isin(
+            collection.portrait_ids.view("S12").ravel(), [portrait_id.binary for portrait_id in portrait_ids]
         )
-        return [EmbeddingSimilarity.model_validate(entity) async for entity in entities]
+        experiment_mask = collection.experiment_mask(experiment)
+        if experiment_mask is not None:
+            mask &= experiment_mask
+        if not mask.any():
+            return
+        collection.delete(mask)
+        # reopen to memory-map the rewritten files
+        del self.collections[(splitter_type, embedder_type)]
+        INDEX_GENERATION.bump()
+
+    async def vector_search(
+        self,
+        query_vector: Vectors,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        distance_type: DistanceType,
+        experiment: str | None = None,
+        limit: int = 10,
+        portrait_ids: Collection[ObjectId] | None = None,
+    ) -> list[EmbeddingSimilarity]:
+        similarities = await self.vector_search_many(
+            query_vector[np.newaxis],
+            splitter_type,
+            embedder_type,
+            distance_type,
+            experiment=experiment,
+            limit=limit,
+            portrait_ids=portrait_ids,
+        )
+        return similarities[0]
+
+    async def vector_search_many(
+        self,
+        query_vectors: Vectors,
+        splitter_type: SplitterType,
+        embedder_type: EmbedderType,
+        distance_type: DistanceType,
+        experiment: str | None = None,
+        limit: int = 10,
+        portrait_ids: Collection[ObjectId] | None = None,
+    ) -> list[list[EmbeddingSimilarity]]:
+        if len(query_vectors) == 0:
+            return []
+        collection = self.get_collection(splitter_type, embedder_type)
+        if collection.count == 0:
+            return [[] for _ in query_vectors]
+
+        queries = to_vectors(query_vectors)
+        mask = collection.experiment_mask(experiment)
+        rows: NDArray[np.intp] | None = None
+        if portrait_ids is None:
+            scores = similarity_matrix(collection.vectors, collection.norms, queries, distance_type)
+            candidates = collection.count
+            if mask is not None:
+                scores[~mask] = -np.inf
+                candidates = int(mask.sum())
+        else:
+            # only vectors of the portraits are scored
+            rows = collection.portrait_rows(portrait_ids)
+            if mask is not None:
+                rows = rows[mask[rows]]
+            scores = similarity_matrix(collection.vectors[rows], collection.norms[rows], queries, distance_type)
+            candidates = len(rows)
+        k = min(limit, candidates)
+        if k == 0:
+            return [[] for _ in query_vectors]
+
+        all_similarities = []
+        for query_vector, query_scores in zip(query_vectors, scores.T):
+            top = np.argpartition(-query_scores, k - 1)[:k] if k < len(query_scores) else np.arange(len(query_scores))
+            top = top[np.argsort(-query_scores[top], kind="stable")][:k]
+            all_similarities.append(
+                [
+                    EmbeddingSimilarity(
+                        portrait_id=PyObjectId(collection.portrait_ids[i].tobytes()),
+                        embedding=collection.vectors[i],
+                        embedded_text=collection.text(i),
+                        query=query_vector,
+                        similarity=float(score),
+                    )
+                    for i, score in zip(top if rows is None else rows[top], query_scores[top])
+                ]
+            )
+        return all_similarities
+
+    async def insert_many(self, records: list[EmbeddingRecord]) -> list[EmbeddingRecord]:
+        records_by_type = defaultdict(list)
+        for record in records:
+            record.id = PyObjectId()
+            records_by_type[(record.splitter_type, record.embedder_type)].append(record)
+
+        for (splitter_type, embedder_type), type_records in records_by_type.items():
+            self.get_collection(splitter_type, embedder_type).append(type_records)
+            # reopen to memory-map the grown files
+            del self.collections[(splitter_type, embedder_type)]
+        INDEX_GENERATION.bump()
+        return records
@@ -0,0 +1,126 @@
+import asyncio
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .cache import EmbeddingCache
+from .embedders import Embedder
+from .entities import Vectors
+
+EmbeddingRequest = tuple[list[str], asyncio.Future[Vectors]]
+
+
+def init_embedding_executor() -> Iterator[ThreadPoolExecutor]:
+    """The inference thread shared by embedding services, shut down with the resources of the container."""
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedder")
+    yield executor
+    executor.shutdown(wait=False)
+
+
+class BatchingEmbeddingService:
+    """
+    Runs embedder inference in a dedicated worker thread, off the event loop.
+    Requests arriving within max_wait_ms from the first one are coalesced, up to max_batch_size texts,
+    into a single Embedder.embed call, and each caller gets back its own part of the result.
+    The disk tier of the cache is read and written in the worker thread too, only memory hits are served on the loop.
+    Without a given executor, the service runs its own worker thread until it is closed.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        cache: EmbeddingCache | None = None,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        executor: ThreadPoolExecutor | None = None,
+    ) -> None:
+        self.embedder = embedder
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedder")
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue[EmbeddingRequest] | None = None
+        self._worker: asyncio.Task[None] | None = None
+
+        self.batches = 0
+
+    async def embed(self, texts: list[str]) -> Vectors:
+        if not texts:
+            return self.embedder.embed([])
+        if self.cache is None:
+            return await self._submit(texts)
+
+        keys = [self.cache.key(self.embedder, text) for text in texts]
+        # memory hits are served on the event loop, the disk tier is read in the worker thread
+        vectors = [self.cache.get_from_memory(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        loop = asyncio.get_running_loop()
+        if missing:
+            cached_vectors = await loop.run_in_executor(self.executor, self.cache.get_many, [keys[i] for i in missing])
+            for i, vector in zip(missing, cached_vectors):
+                vectors[i] = vector
+            missing = [i for i in missing if vectors[i] is None]
+        if missing:
+            new_vectors = await self._submit([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+            await loop.run_in_executor(
+                self.executor, self.cache.put_many, [(keys[i], vector) for i, vector in zip(missing, new_vectors)]
+            )
+        return np.stack(vectors)  # type: ignore[arg-type]
+
+    async def _submit(self, texts: list[str]) -> Vectors:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._queue is None:
+            # the queue and the worker are bound to the event loop they were created in
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run(self._queue))
+
+        future: asyncio.Future[Vectors] = loop.create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _run(self, queue: asyncio.Queue[EmbeddingRequest]) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            batch_size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait_ms / 1000
+            while batch_size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                batch_size += len(request[0])
+
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                vectors = await loop.run_in_executor(self.executor, self.embedder.embed, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            offset = 0
+            for request_texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[offset : offset + len(request_texts)])
+                offset += len(request_texts)
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+            self._queue = None
+        if self.owns_executor:
+            self.executor.shutdown(wait=False)
@@ -1,8 +1,9 @@
 import abc
-
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from collections.abc import Callable
+from functools import partial
 
 from portrait_search.core.enums import SplitterType
+from portrait_search.core.registry import LazyRegistry
 
 
 class Splitter(abc.ABC):
@@ -31,12 +32,18 @@ class Splitter(abc.ABC):
         raise NotImplementedError()
 
 
-SPLITTERS: dict[SplitterType, Splitter] = {}
+SPLITTERS: LazyRegistry[SplitterType, Splitter] = LazyRegistry()
+
 
+def register_splitter(splitter_type: SplitterType, factory: Callable[[], Splitter]) -> None:
+    """Registers a splitter factory, the splitter is built only when it is first used."""
 
-def register_splitter(splitter_type: SplitterType, splitter: Splitter) -> None:
-    SPLITTERS[splitter_type] = splitter
-    splitter.type = splitter_type
+    def build() -> Splitter:
+        splitter = factory()
+        splitter.type = splitter_type
+        return splitter
+
+    SPLITTERS.register(splitter_type, build)
 
 
 class DoNotSplitQueryMixin(Splitter, abc.ABC):
@@ -46,10 +53,24 @@ class DoNotSplitQueryMixin(Splitter, abc.ABC):
 
 class CombineSplitter(Splitter):
     def __init__(self, splitters: list[Splitter]) -> None:
+        super().__init__()
         self.splitters = splitters
 
     def split(self, text: str) -> list[str]:
-        return [chunk for splitter in self.splitters for chunk in splitter.split(text)]
+        return list(self.split_with_provenance(text))
+
+    def split_with_provenance(self, text: str) -> dict[str, list[int]]:
+        """
+        Returns unique chunks of all splitters in order of appearance, each mapped to the indices of
+        the splitters which produced it. Overlapping splitters often produce the same chunk, it is embedded once.
+        """
+        provenance: dict[str, list[int]] = {}
+        for i, splitter in enumerate(self.splitters):
+            for chunk in splitter.split(text):
+                sources = provenance.setdefault(chunk, [])
+                if i not in sources:
+                    sources.append(i)
+        return provenance
 
     def split_query(self, text: str) -> list[str]:
         return [chunk for splitter in self.splitters for chunk in splitter.split_query(text)]
@@ -57,6 +78,8 @@ class CombineSplitter(Splitter):
 
 class LangChainRecursiveSplitter(Splitter):
     def __init__(self, chunk_size: int, chunk_overlap: int) -> None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
         self.splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -73,31 +96,31 @@ class LangChainRecursiveSplitter(Splitter):
 
 # register_splitter(
 #     SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_300_OVERLAP_100,
-#     LangChainRecursiveSplitter(chunk_size=300, chunk_overlap=100),
+#     partial(LangChainRecursiveSplitter, chunk_size=300, chunk_overlap=100),
 # )
 # register_splitter(
 #     SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_200_OVERLAP_80,
-#     LangChainRecursiveSplitter(chunk_size=200, chunk_overlap=80),
+#     partial(LangChainRecursiveSplitter, chunk_size=200, chunk_overlap=80),
 # )
 register_splitter(
     SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40,
-    LangChainRecursiveSplitter(chunk_size=160, chunk_overlap=40),
+    partial(LangChainRecursiveSplitter, chunk_size=160, chunk_overlap=40),
 )
 # register_splitter(
 #     SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
-#     LangChainRecursiveSplitter(chunk_size=120, chunk_overlap=60),
+#     partial(LangChainRecursiveSplitter, chunk_size=120, chunk_overlap=60),
 # )
 # register_splitter(
 #     SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_100_OVERLAP_60,
-#     LangChainRecursiveSplitter(chunk_size=100, chunk_overlap=60),
+#     partial(LangChainRecursiveSplitter, chunk_size=100, chunk_overlap=60),
 # )
 # register_splitter(
 #     SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_40,
-#     LangChainRecursiveSplitter(chunk_size=120, chunk_overlap=40),
+#     partial(LangChainRecursiveSplitter, chunk_size=120, chunk_overlap=40),
 # )
 # register_splitter(
 #     SplitterType.COMBINE_LCHUNK_160_O40_AND_LCHUNK_120_O60,
-#     CombineSplitter(
+#     lambda: CombineSplitter(
 #         [
 #             LangChainRecursiveSplitter(chunk_size=160, chunk_overlap=40),
 #             LangChainRecursiveSplitter(chunk_size=120, chunk_overlap=60),
@@ -1,23 +1,52 @@
+import hashlib
+
 from portrait_search.portraits.entities import PortraitRecord
 
+from .cache import EmbeddingCache, SplitCache
 from .embedders import Embedder
-from .entities import EmbeddingRecord
+from .entities import EmbeddingRecord, Vectors
 from .splitters import Splitter
 
 
+def description_hash(description: str, splitter: Splitter, embedder: Embedder) -> str:
+    """Changes when a description, its splitter or its embedder changes and its embeddings have to be replaced."""
+    return hashlib.sha256(
+        f"{splitter.type}\0{embedder.type}\0{embedder.instructions}\0{description}".encode()
+    ).hexdigest()
+
+
 def portraits2embeddings(
     portraits: list[PortraitRecord],
     splitter: Splitter,
     embedder: Embedder,
+    cache: EmbeddingCache | None = None,
+    batch_size: int | None = None,
+    split_cache: SplitCache | None = None,
 ) -> list[EmbeddingRecord]:
-    """Returns a list of EmbeddingRecords for the given portraits and their descriptions."""
+    """
+    Returns a list of EmbeddingRecords for the given portraits and their descriptions.
+    If a cache is given, only chunks missing from it are passed to the embedder.
+    If a batch size is given, the embedder encodes chunks in batches of this size.
+    If a split cache is given, only descriptions missing from it are split.
+    """
     if not portraits:
         return []
 
     texts = [portrait.description for portrait in portraits]
-    text_chunks, indices = zip(*[(chunk, i) for i, text in enumerate(texts) for chunk in splitter.split(text)])
-    embeddings = embedder.embed(text_chunks)  # type: ignore
+    if split_cache is not None:
+        splits = split_cache.split(splitter, texts)
+    else:
+        splits = [splitter.split(text) for text in texts]
+    chunks_with_indices = [(chunk, i) for i, chunks in enumerate(splits) for chunk in chunks]
+    if not chunks_with_indices:
+        return []
+    text_chunks, indices = zip(*chunks_with_indices)
+    if cache is not None:
+        embeddings = cache.embed(embedder, list(text_chunks), batch_size)
+    else:
+        embeddings = embedder.embed(list(text_chunks), batch_size)
 
+    hashes = [description_hash(text, splitter, embedder) for text in texts]
     embeddings_records = []
     for i, embedding, text_chunk in zip(indices, embeddings, text_chunks):
         portrait = portraits[i]
@@ -27,14 +56,20 @@ def portraits2embeddings(
             embedded_text=text_chunk,
             splitter_type=splitter.type,
             embedder_type=embedder.type,
+            description_hash=hashes[i],
         )
         embeddings_records.append(embedding_record)
 
     return embeddings_records
 
 
-def query2embeddings(query: str, splitter: Splitter, embedder: Embedder) -> tuple[list[list[float]], list[str]]:
+def query2embeddings(
+    query: str, splitter: Splitter, embedder: Embedder, cache: EmbeddingCache | None = None
+) -> tuple[Vectors, list[str]]:
     """Returns a tuple of embeddings and the query chunks."""
     query_chunks = splitter.split_query(query)
-    embeddings = embedder.embed(query_chunks)
+    if cache is not None:
+        embeddings = cache.embed(embedder, query_chunks)
+    else:
+        embeddings = embedder.embed(query_chunks)
     return embeddings, query_chunks
@@ -11,6 +11,8 @@ from portrait_search.open_ai.client import OpenAIClient
 from portrait_search.open_ai.queries import PORTRAIT_DESCRIPTION_QUERY_V1
 from portrait_search.portraits.entities import Portrait
 from portrait_search.portraits.repository import PortraitRepository
+from portrait_search.retrieval.lexical import LexicalIndex
+from portrait_search.retrieval.tags import TagIndex
 
 # each worker uses ~10k tokens per minute, with a current limit 20k tokens it should be fine to use 2 workers
 N_JOBS = 2
@@ -21,6 +23,8 @@ async def _generate_portraint_description_and_store(
     portrait: Portrait,
     openai_client: OpenAIClient,
     portrait_repository: PortraitRepository,
+    lexical_index: LexicalIndex,
+    tag_index: TagIndex,
 ) -> None:
     async with openai_semaphore:
         description = await openai_client.make_image_query(
@@ -35,7 +39,10 @@ async def _generate_portraint_description_and_store(
     portrait_record.description = description
     portrait_record.query = PORTRAIT_DESCRIPTION_QUERY_V1
 
-    await portrait_repository.insert_one(portrait_record)
+    portrait_record = await portrait_repository.insert_one(portrait_record)
+    if portrait_record.id is not None:
+        lexical_index.add(portrait_record.id, portrait_record.description)
+        tag_index.add(portrait_record.id, portrait_record.tags)
 
 
 @inject
@@ -44,6 +51,8 @@ async def generate_descriptions(
     data_sources: list[BaseDataSource] = Provide[Container.data_sources],
     portrait_repository: PortraitRepository = Provide[Container.portrait_repository],
     openai_client: OpenAIClient = Provide[Container.openai_client],
+    lexical_index: LexicalIndex = Provide[Container.lexical_index],
+    tag_index: TagIndex = Provide[Container.tag_index],
 ) -> None:
     if isinstance(local_data_folder, Provide):
         local_data_folder = local_data_folder.provider  # type: ignore
@@ -80,11 +89,18 @@ async def generate_descriptions(
                 portrait,
                 openai_client,
                 portrait_repository,
+                lexical_index,
+                tag_index,
             )
         )
         for portrait in new_portraits
     ]
-    await tqdm_asyncio.gather(*tasks, desc="Generating descriptions")
+    try:
+        await tqdm_asyncio.gather(*tasks, desc="Generating descriptions")
+    finally:
+        # portraits inserted before a failure are indexed too
+        lexical_index.save()
+        tag_index.save()
 
     print("Done!")
 
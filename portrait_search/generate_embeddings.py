@@ -1,43 +1,297 @@
 import asyncio
+import multiprocessing
+import queue
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
 from itertools import product
+from pathlib import Path
 
+from bson import ObjectId
 from dependency_injector.wiring import Provide, inject
 
+from portrait_search.core.enums import EmbedderType, SplitterType
 from portrait_search.dependencies import Container
+from portrait_search.embeddings.cache import EmbeddingCache, SplitCache
+from portrait_search.embeddings.checkpoint import GenerationCheckpoint
 from portrait_search.embeddings.embedders import EMBEDDERS
+from portrait_search.embeddings.entities import EmbeddingRecord
+from portrait_search.embeddings.generation import WorkerMessage, WorkerTask, embed_portraits, embedder_worker
+from portrait_search.embeddings.pooled import PooledVectors, PooledVectorStore
 from portrait_search.embeddings.repository import EmbeddingRepository
 from portrait_search.embeddings.splitters import SPLITTERS
-from portrait_search.embeddings.t2v import portraits2embeddings
 from portrait_search.portraits.repository import PortraitRepository
 
+# how often the parent checks for dead workers while waiting for their messages
+WORKER_POLL_SECONDS = 1.0
+# batches waiting for the parent per worker, workers wait when the parent falls behind writing them
+QUEUED_BATCHES_PER_WORKER = 2
+
+
+async def write_embeddings(
+    embedding_repository: EmbeddingRepository,
+    checkpoint: GenerationCheckpoint,
+    pooled_vectors: PooledVectors,
+    splitter_type: SplitterType,
+    embedder_type: EmbedderType,
+    embeddings: list[EmbeddingRecord],
+    changed_portrait_ids: set[ObjectId],
+    last_portrait_id: ObjectId,
+    experiment: str | None,
+    existing_hashes: dict[ObjectId, str | None],
+) -> None:
+    """
+    Inserts a batch of embeddings, pools them per portrait and saves the pooled vectors and the checkpoint after it.
+    Stale embeddings of portraits with changed descriptions are deleted first, also if a new description has no chunks.
+    """
+    if experiment:
+        for embedding in embeddings:
+            embedding.experiment = experiment
+    stale_portrait_ids = changed_portrait_ids & existing_hashes.keys()
+    if stale_portrait_ids:
+        await embedding_repository.delete_by_portrait_ids(splitter_type, embedder_type, stale_portrait_ids, experiment)
+        pooled_vectors.remove(stale_portrait_ids)
+    if embeddings:
+        await embedding_repository.insert_many(embeddings)
+        pooled_vectors.update(embeddings)
+    pooled_vectors.save()
+    checkpoint.save(last_portrait_id)
+
+
+async def open_pooled_vectors(
+    pooled_vector_store: PooledVectorStore,
+    embedding_repository: EmbeddingRepository,
+    splitter_type: SplitterType,
+    embedder_type: EmbedderType,
+    existing_hashes: dict[ObjectId, str | None],
+    experiment: str | None,
+) -> PooledVectors:
+    """Loads the pooled vectors of a task when it starts, pools embeddings stored before or by an interrupted run."""
+    pooled_vectors = pooled_vector_store.get(splitter_type, embedder_type, experiment)
+    await pooled_vectors.sync(embedding_repository, splitter_type, embedder_type, existing_hashes, experiment)
+    return pooled_vectors
+
+
+def finish_task(
+    pooled_vector_store: PooledVectorStore,
+    pooled_vectors: PooledVectors,
+    checkpoint: GenerationCheckpoint,
+    splitter_type: SplitterType,
+    embedder_type: EmbedderType,
+    experiment: str | None,
+) -> None:
+    """Saves the pooled vectors of a completed task and releases them, the next run checks all portraits again."""
+    pooled_vectors.save()
+    pooled_vector_store.release(splitter_type, embedder_type, experiment)
+    checkpoint.clear()
+
+
+async def generate_in_process(
+    tasks: dict[EmbedderType, list[WorkerTask]],
+    checkpoints: dict[tuple[SplitterType, EmbedderType], GenerationCheckpoint],
+    pooled_vector_store: PooledVectorStore,
+    portrait_repository: PortraitRepository,
+    embedding_repository: EmbeddingRepository,
+    chunk_embedding_cache: EmbeddingCache,
+    split_cache: SplitCache,
+    experiment: str | None,
+    portrait_batch_size: int,
+    embed_batch_size: int,
+) -> None:
+    for embedder_type, embedder_tasks in tasks.items():
+        embedder = EMBEDDERS[embedder_type]
+        for task in embedder_tasks:
+            print(f"Generating embeddings for splitter {task.splitter_type}, embedder {embedder_type}")
+            generated = 0
+            batches = embed_portraits(
+                SPLITTERS[task.splitter_type],
+                embedder,
+                portrait_repository,
+                chunk_embedding_cache,
+                task.existing_hashes,
+                task.after_id,
+                portrait_batch_size,
+                embed_batch_size,
+                split_cache,
+            )
+            checkpoint = checkpoints[task.splitter_type, embedder_type]
+            pooled_vectors = await open_pooled_vectors(
+                pooled_vector_store,
+                embedding_repository,
+                task.splitter_type,
+                embedder_type,
+                task.existing_hashes,
+                experiment,
+            )
+            async for embeddings, changed_portrait_ids, last_portrait_id in batches:
+                await write_embeddings(
+                    embedding_repository,
+                    checkpoint,
+                    pooled_vectors,
+                    task.splitter_type,
+                    embedder_type,
+                    embeddings,
+                    changed_portrait_ids,
+                    last_portrait_id,
+                    experiment,
+                    task.existing_hashes,
+                )
+                generated += len(embeddings)
+                print(f"Generated: {generated}, last portrait {last_portrait_id}")
+            finish_task(pooled_vector_store, pooled_vectors, checkpoint, task.splitter_type, embedder_type, experiment)
+            print("Done!")
+            print("-----")
+
+
+def _raise_worker_errors(futures: list[Future[None]]) -> None:
+    """Raises the error of a finished worker, a worker killed by the OS breaks the pool and fails every future."""
+    for future in futures:
+        if future.done():
+            future.result()
+
+
+async def generate_in_workers(
+    tasks: dict[EmbedderType, list[WorkerTask]],
+    checkpoints: dict[tuple[SplitterType, EmbedderType], GenerationCheckpoint],
+    pooled_vector_store: PooledVectorStore,
+    embedding_repository: EmbeddingRepository,
+    experiment: str | None,
+    portrait_batch_size: int,
+    embed_batch_size: int,
+    workers: int,
+) -> None:
+    """
+    Fans embedders out to worker processes, each worker loads one embedder and embeds portraits for every splitter.
+    This process is the single writer of the embedding repository, the queue of embedded batches is bounded so that
+    at most a few batches per worker are kept in memory. Pooled vectors are loaded on the first message of a task and
+    released on its done message.
+    A worker which dies without sending its done message, killed by the OS, fails the generation instead of hanging it.
+    """
+    # spawn, forked torch and motor state is not safe to use in children
+    context = multiprocessing.get_context("spawn")
+    loop = asyncio.get_running_loop()
+    generated: defaultdict[tuple[SplitterType, EmbedderType], int] = defaultdict(int)
+    pooled_vectors: dict[tuple[SplitterType, EmbedderType], PooledVectors] = {}
+    existing_hashes = {
+        (task.splitter_type, embedder_type): task.existing_hashes
+        for embedder_type, embedder_tasks in tasks.items()
+        for task in embedder_tasks
+    }
+    # the manager is shut down first on errors: workers waiting on the full queue fail instead of blocking the pool
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool, context.Manager() as manager:
+        results = manager.Queue(maxsize=workers * QUEUED_BATCHES_PER_WORKER)
+        futures = [
+            pool.submit(embedder_worker, embedder_type, embedder_tasks, results, portrait_batch_size, embed_batch_size)
+            for embedder_type, embedder_tasks in tasks.items()
+        ]
+        running = len(futures)
+        while running:
+            try:
+                message: WorkerMessage = await loop.run_in_executor(None, results.get, True, WORKER_POLL_SECONDS)
+            except queue.Empty:
+                _raise_worker_errors(futures)
+                continue
+            if message.splitter_type is None:
+                running -= 1
+                print(f"[worker {message.worker_id}] embedder {message.embedder_type} done")
+                continue
+
+            key = (message.splitter_type, message.embedder_type)
+            if key not in pooled_vectors:
+                pooled_vectors[key] = await open_pooled_vectors(
+                    pooled_vector_store, embedding_repository, *key, existing_hashes[key], experiment
+                )
+            if message.done:
+                finish_task(pooled_vector_store, pooled_vectors.pop(key), checkpoints[key], *key, experiment)
+                continue
+
+            assert message.last_portrait_id is not None
+            await write_embeddings(
+                embedding_repository,
+                checkpoints[key],
+                pooled_vectors[key],
+                message.splitter_type,
+                message.embedder_type,
+                message.embeddings,
+                message.changed_portrait_ids,
+                message.last_portrait_id,
+                experiment,
+                existing_hashes[key],
+            )
+            generated[key] += len(message.embeddings)
+            print(
+                f"[worker {message.worker_id}] splitter {message.splitter_type}, embedder {message.embedder_type}: "
+                f"generated {generated[key]}, last portrait {message.last_portrait_id}"
+            )
+
+        # raise worker errors, a worker sends its done message before its future is done
+        for future in futures:
+            future.result()
+
 
 @inject
 async def generate_embeddings(
     portrait_repository: PortraitRepository = Provide[Container.portrait_repository],
     embedding_repository: EmbeddingRepository = Provide[Container.embedding_repository],
+    pooled_vector_store: PooledVectorStore = Provide[Container.pooled_vector_store],
+    chunk_embedding_cache: EmbeddingCache = Provide[Container.chunk_embedding_cache],
+    split_cache: SplitCache = Provide[Container.split_cache],
+    local_data_folder: Path = Provide[Container.config.provided.local_data_folder],
+    portrait_batch_size: int = Provide[Container.config.provided.generation_portrait_batch_size],
+    embed_batch_size: int = Provide[Container.config.provided.generation_embed_batch_size],
+    workers: int = Provide[Container.config.provided.generation_workers],
     experiment: str = Provide[Container.config.provided.experiment],
 ) -> None:
-    all_splitters_and_providers = product(SPLITTERS.values(), EMBEDDERS.values())
-    all_portraits = await portrait_repository.get_many()
-    for splitter, embedder in all_splitters_and_providers:
-        print(f"Generating embeddings for splitter {splitter.type}, embedder {embedder.type}")
-        # find existing embeddings
-        existing_embeddings = await embedding_repository.get_by_type(
-            embedder_type=embedder.type, splitter_type=splitter.type
+    # registry keys, embedders are loaded where they are used
+    tasks: dict[EmbedderType, list[WorkerTask]] = defaultdict(list)
+    checkpoints = {}
+    portrait_ids = await portrait_repository.get_ids()
+    for embedder_type, splitter_type in product(EMBEDDERS, SPLITTERS):
+        checkpoint = GenerationCheckpoint(
+            local_data_folder / "generation_checkpoints", splitter_type, embedder_type, experiment
         )
-        print("Already generated: ", len(existing_embeddings))
-        existing_portraits = {embedding.portrait_id for embedding in existing_embeddings}
-
-        portraits_without_embeddings_ids = {p.id for p in all_portraits} - existing_portraits
-        portraits_without_embeddings = [p for p in all_portraits if p.id in portraits_without_embeddings_ids]
-        embeddings = portraits2embeddings(portraits_without_embeddings, splitter, embedder)
-        print("Generated: ", len(embeddings))
-        if experiment:
-            for embedding in embeddings:
-                embedding.experiment = experiment
-        await embedding_repository.insert_many(embeddings)
-        print("Done!")
-        print("-----")
+        checkpoints[splitter_type, embedder_type] = checkpoint
+        # find existing embeddings, the checkpoint may be missing or behind the last inserted batch
+        existing_hashes = await embedding_repository.get_description_hashes(splitter_type, embedder_type, experiment)
+        deleted_portraits = existing_hashes.keys() - portrait_ids
+        if deleted_portraits:
+            await embedding_repository.delete_by_portrait_ids(
+                splitter_type, embedder_type, deleted_portraits, experiment
+            )
+            for portrait_id in deleted_portraits:
+                del existing_hashes[portrait_id]
+        after_id = checkpoint.load()
+        print(
+            f"Splitter {splitter_type}, embedder {embedder_type}: already generated for {len(existing_hashes)} "
+            f"portraits, deleted for {len(deleted_portraits)} portraits, resuming after portrait {after_id}"
+        )
+        tasks[embedder_type].append(WorkerTask(splitter_type, after_id, existing_hashes))
+
+    if workers > 1:
+        await generate_in_workers(
+            tasks,
+            checkpoints,
+            pooled_vector_store,
+            embedding_repository,
+            experiment,
+            portrait_batch_size,
+            embed_batch_size,
+            workers,
+        )
+    else:
+        await generate_in_process(
+            tasks,
+            checkpoints,
+            pooled_vector_store,
+            portrait_repository,
+            embedding_repository,
+            chunk_embedding_cache,
+            split_cache,
+            experiment,
+            portrait_batch_size,
+            embed_batch_size,
+        )
+    print("Cached chunks: ", chunk_embedding_cache.disk_hits)
+    print("Cached splits: ", split_cache.hits)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,26 @@
+from dependency_injector.wiring import Provide, inject
+
+from portrait_search.dependencies import Container
+from portrait_search.embeddings.repository import ChromaEmbeddingRepository
+
+
+@inject
+def migrate_chroma(
+    repository: ChromaEmbeddingRepository = Provide[Container.chroma_embedding_repository],
+) -> None:
+    migrated = repository.migrate_legacy_collections()
+    rebuilt = repository.rebuild_stale_collections()
+    if not migrated and not rebuilt:
+        print("Nothing to migrate")
+    for name, count in migrated.items():
+        print(f"Migrated {count} embeddings to {name}")
+    for name, count in rebuilt.items():
+        print(f"Rebuilt the index of {count} embeddings of {name} with the configured HNSW parameters")
+
+
+if __name__ == "__main__":
+    container = Container()
+    container.init_resources()
+    container.wire(modules=[__name__])
+
+    migrate_chroma()
@@ -1,11 +1,40 @@
+from collections.abc import Collection
+from datetime import timedelta
+from typing import Any
+
+from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from portrait_search.core.generation import INDEX_GENERATION, PORTRAIT_GENERATION
 from portrait_search.core.mongodb import MongoDBRepository
 
 from .entities import PortraitRecord
 
+# ids are generated by the writing process shortly before the insert, so a portrait is inserted after portraits with
+# higher ids at most this long after its id was generated
+INSERT_DELAY = timedelta(minutes=1)
+
+
+def inserted_after(portrait_id: ObjectId | None) -> ObjectId | None:
+    """Returns the id after which portraits can be inserted since the portrait with the given id was inserted."""
+    if portrait_id is None:
+        return None
+    return ObjectId.from_datetime(portrait_id.generation_time - INSERT_DELAY)
+
+
+def _portraits_filter(after_id: ObjectId | None, ids: Collection[ObjectId] | None) -> dict[str, Any]:
+    filter: dict[str, Any] = {}
+    if after_id is not None:
+        filter["$gt"] = after_id
+    if ids is not None:
+        filter["$in"] = list(ids)
+    return {"_id": filter} if filter else {}
+
 
 class PortraitRepository(MongoDBRepository[PortraitRecord]):
+    # portraits are searched too, the indexes of portrait tags and descriptions follow only the portrait writes
+    generations = (INDEX_GENERATION, PORTRAIT_GENERATION)
+
     def __init__(self, db: AsyncIOMotorDatabase):
         super().__init__(db, PortraitRecord)
 
@@ -17,6 +46,32 @@ class PortraitRepository(MongoDBRepository[PortraitRecord]):
         db_hashes = await self.db[self.collection].distinct("hash")
         return set(db_hashes)
 
+    async def count(self) -> int:
+        """Returns the number of portraits from the collection metadata, the collection is not scanned."""
+        return await self.db[self.collection].estimated_document_count()
+
+    async def get_tags(
+        self, after_id: ObjectId | None = None, ids: Collection[ObjectId] | None = None
+    ) -> dict[ObjectId, list[str]]:
+        """
+        Returns the tags of every portrait, or only of portraits inserted after the given id or with the given ids.
+        The rest of the records is not fetched.
+        """
+        entities = await self.db[self.collection].find(_portraits_filter(after_id, ids), {"tags": 1}).to_list(None)
+        return {entity["_id"]: entity["tags"] for entity in entities}
+
+    async def get_descriptions(
+        self, after_id: ObjectId | None = None, ids: Collection[ObjectId] | None = None
+    ) -> dict[ObjectId, str]:
+        """
+        Returns the description of every portrait, or only of portraits inserted after the given id or with the given
+        ids. The rest of the records is not fetched.
+        """
+        entities = (
+            await self.db[self.collection].find(_portraits_filter(after_id, ids), {"description": 1}).to_list(None)
+        )
+        return {entity["_id"]: entity["description"] for entity in entities}
+
     async def prepare_collection_resources(self) -> None:
         await self.db[self.collection].create_index("hash", unique=True)
         portrait_embeddings_pipeline = [
@@ -5,16 +5,16 @@ from itertools import product
 from pathlib import Path
 from typing import Any
 
-from portrait_search.core.enums import DistanceType, EmbedderType, SplitterType
+from portrait_search.core.enums import AggregatorType, DistanceType, EmbedderType, SplitterType
 from portrait_search.dependencies import Container
-from portrait_search.embeddings.embedders import EMBEDDERS
+from portrait_search.embeddings.embedders import EMBEDDERS, ready_embedder_types
 from portrait_search.embeddings.splitters import SPLITTERS
 
 from .judge import EvaluationResult, Judge
 
 EXPERIMENT_TYPE = Callable[[Container], Judge]
 EXPERIMENTS_COLLECTION_TYPE = dict[str, EXPERIMENT_TYPE]
-PARAMETERS_GENERATOR_TYPE = Generator[tuple[EmbedderType, SplitterType, DistanceType, str], Any, Any]
+PARAMETERS_GENERATOR_TYPE = Generator[tuple[EmbedderType, SplitterType, DistanceType, AggregatorType, str], Any, Any]
 
 
 def store_experiment_results(path: Path, results: dict[str, EvaluationResult]) -> None:
@@ -31,25 +31,32 @@ def load_or_create_experiment_results(path: Path) -> dict[str, EvaluationResult]
 
 
 def all_possible_combinations_generator(experiment: str) -> PARAMETERS_GENERATOR_TYPE:
-    for embedder, splitter, distance in product(EMBEDDERS, SPLITTERS, DistanceType):
-        yield embedder, splitter, distance, experiment  # type: ignore
+    # PCA embedders are experimented with once embeddings are generated for them, which fits their projections
+    for embedder, splitter, distance, aggregator in product(
+        ready_embedder_types(), SPLITTERS, DistanceType, AggregatorType
+    ):
+        yield embedder, splitter, distance, aggregator, experiment  # type: ignore
 
 
 def all_possible_combinations_cosine_generator(experiment: str) -> PARAMETERS_GENERATOR_TYPE:
-    for embedder, splitter in product(EMBEDDERS, SPLITTERS):
-        yield embedder, splitter, DistanceType.COSINE, experiment  # type: ignore
+    for embedder, splitter, aggregator in product(ready_embedder_types(), SPLITTERS, AggregatorType):
+        yield embedder, splitter, DistanceType.COSINE, aggregator, experiment  # type: ignore
 
 
 def multi_experiment(
     generator: Callable[[str], PARAMETERS_GENERATOR_TYPE], experiment: str
 ) -> Generator[tuple[str, EXPERIMENT_TYPE], Any, Any]:
-    for embedder, splitter, distance, dataset_name in generator(experiment):
+    for embedder, splitter, distance, aggregator, dataset_name in generator(experiment):
         experiment_name = f"[{dataset_name}] Split {splitter}, embed {embedder}, distance {distance}"
+        # names of experiments run before the aggregator was an axis stay the same, their results are reused
+        if aggregator != AggregatorType.MEAN:
+            experiment_name += f", aggregate {aggregator}"
 
         def generated_experiment(
             embedder: EmbedderType,
             splitter: SplitterType,
             distance: DistanceType,
+            aggregator: AggregatorType,
             dataset_name: str,
             container: Container,
         ) -> Judge:
@@ -57,12 +64,13 @@ def multi_experiment(
                 container.embedder.override(EMBEDDERS[embedder]),
                 container.splitter.override(SPLITTERS[splitter]),
                 container.distance_type.override(distance),
+                container.aggregator_type.override(aggregator),
             ):
                 retriever = container.retriever()
 
             return Judge(retriever, dataset_name)
 
-        yield experiment_name, partial(generated_experiment, embedder, splitter, distance, dataset_name)
+        yield experiment_name, partial(generated_experiment, embedder, splitter, distance, aggregator, dataset_name)
 
 
 def all_possible_combinations_by_experiment(experiment: str) -> EXPERIMENTS_COLLECTION_TYPE:
@@ -0,0 +1,51 @@
+import time
+
+import numpy as np
+
+from portrait_search.core.enums import DistanceType, EmbedderType, SplitterType
+from portrait_search.embeddings.entities import EmbeddingSimilarity, Vectors
+from portrait_search.embeddings.repository import EmbeddingRepository
+
+from .judge import EvaluationResult
+
+
+def _key(similarity: EmbeddingSimilarity) -> tuple[str, str]:
+    # similarities carry no embedding id, a chunk is identified by its portrait and text
+    return str(similarity.portrait_id), similarity.embedded_text
+
+
+async def evaluate_vector_index(
+    repository: EmbeddingRepository,
+    exact_repository: EmbeddingRepository,
+    query_vectors: Vectors,
+    splitter_type: SplitterType,
+    embedder_type: EmbedderType,
+    distance_type: DistanceType,
+    experiment: str | None = None,
+    limit: int = 10,
+) -> EvaluationResult:
+    """
+    Searches for the query vectors one at a time, as they are searched when serving, and returns the recall
+    of the results against exact search with p50 and p99 latencies in milliseconds.
+    """
+    expected_by_query = await exact_repository.vector_search_many(
+        query_vectors, splitter_type, embedder_type, distance_type, experiment=experiment, limit=limit
+    )
+    recalls = []
+    latencies = []
+    for query_vector, expected in zip(query_vectors, expected_by_query):
+        start = time.perf_counter()
+        similarities = await repository.vector_search(
+            query_vector, splitter_type, embedder_type, distance_type, experiment=experiment, limit=limit
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        expected_keys = {_key(similarity) for similarity in expected}
+        if expected_keys:
+            found_keys = {_key(similarity) for similarity in similarities}
+            recalls.append(len(expected_keys & found_keys) / len(expected_keys))
+
+    return {
+        "recall@k": float(np.mean(recalls)) if recalls else 1.0,
+        "p50 ms": float(np.percentile(latencies, 50)) if latencies else 0.0,
+        "p99 ms": float(np.percentile(latencies, 99)) if latencies else 0.0,
+    }
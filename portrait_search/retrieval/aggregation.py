@@ -0,0 +1,101 @@
+from collections.abc import Callable
+from typing import NamedTuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from portrait_search.core.enums import AggregatorType
+from portrait_search.embeddings.entities import EmbeddingSimilarity
+
+# the constant of reciprocal rank fusion, dampens the weight of the top ranks
+RRF_K = 60
+
+
+class Hits(NamedTuple):
+    """Embedding similarities found for all chunks of a query as flat arrays, one element per similarity."""
+
+    # index of the portrait of every similarity among the unique portraits, in order of first appearance
+    portraits: NDArray[np.intp]
+    similarities: NDArray[np.float64]
+    # index of the query chunk and the rank among the results of the query chunk
+    queries: NDArray[np.intp]
+    ranks: NDArray[np.intp]
+    # index of the first similarity of every portrait
+    first_hits: NDArray[np.intp]
+    portrait_count: int
+
+
+def to_hits(similarities_by_query: list[list[EmbeddingSimilarity]]) -> tuple[Hits, list[EmbeddingSimilarity]]:
+    """Returns the hits of the similarities and the similarities in the order of the hits."""
+    similarities = [similarity for query_similarities in similarities_by_query for similarity in query_similarities]
+    lengths = [len(query_similarities) for query_similarities in similarities_by_query]
+    portrait_ids = np.array([similarity.portrait_id.binary for similarity in similarities], dtype="S12")
+    _, first_indices, inverse = np.unique(portrait_ids, return_index=True, return_inverse=True)
+    # np.unique sorts the ids, portraits are renumbered in order of first appearance
+    order = np.argsort(first_indices, kind="stable")
+    portraits = np.empty_like(order)
+    portraits[order] = np.arange(len(order))
+    hits = Hits(
+        portraits=portraits[inverse],
+        similarities=np.array([similarity.similarity for similarity in similarities], dtype=np.float64),
+        queries=np.repeat(np.arange(len(lengths)), lengths),
+        ranks=np.concatenate([np.arange(length) for length in lengths]) if lengths else np.zeros(0, dtype=np.intp),
+        first_hits=first_indices[order],
+        portrait_count=len(order),
+    )
+    return hits, similarities
+
+
+def _sorted_by_portrait(hits: Hits) -> tuple[NDArray[np.intp], NDArray[np.intp]]:
+    """Returns hit indices sorted by portrait and similarity descending, and where every portrait starts."""
+    order = np.lexsort((-hits.similarities, hits.portraits))
+    starts = np.flatnonzero(np.r_[True, hits.portraits[order][1:] != hits.portraits[order][:-1]])
+    return order, starts
+
+
+def mean(hits: Hits) -> NDArray[np.float64]:
+    sums = np.bincount(hits.portraits, weights=hits.similarities, minlength=hits.portrait_count)
+    return sums / np.bincount(hits.portraits, minlength=hits.portrait_count)
+
+
+def maximum(hits: Hits) -> NDArray[np.float64]:
+    order, starts = _sorted_by_portrait(hits)
+    return hits.similarities[order][starts]
+
+
+def sum_top(hits: Hits, m: int) -> NDArray[np.float64]:
+    """Sum of the m best similarities of every portrait: many good chunks beat a single great one."""
+    order, starts = _sorted_by_portrait(hits)
+    rank_in_portrait = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    top = order[rank_in_portrait < m]
+    sums = np.bincount(hits.portraits[top], weights=hits.similarities[top], minlength=hits.portrait_count)
+    return sums.astype(np.float64, copy=False)
+
+
+def reciprocal_rank_fusion(hits: Hits) -> NDArray[np.float64]:
+    """Fuses the rankings of the query chunks by the best rank of every portrait in each of them."""
+    # hits are ordered by query and rank, the first hit of a portrait in a query is its best rank
+    _, best = np.unique(hits.queries * hits.portrait_count + hits.portraits, return_index=True)
+    fused = np.bincount(hits.portraits[best], weights=1 / (RRF_K + hits.ranks[best] + 1), minlength=hits.portrait_count)
+    return fused.astype(np.float64, copy=False)
+
+
+AGGREGATORS: dict[AggregatorType, Callable[[Hits], NDArray[np.float64]]] = {
+    AggregatorType.MEAN: mean,
+    AggregatorType.MAX: maximum,
+    AggregatorType.SUM_TOP_3: lambda hits: sum_top(hits, 3),
+    AggregatorType.RECIPROCAL_RANK_FUSION: reciprocal_rank_fusion,
+}
+
+
+def top_portraits(scores: NDArray[np.float64], limit: int) -> NDArray[np.intp]:
+    """Returns indices of the portraits with the highest scores, best first, ties in order of first appearance."""
+    if limit <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if limit >= len(scores):
+        top = np.arange(len(scores))
+    else:
+        # every portrait tied with the last one is a candidate, the first appearing win
+        threshold = -np.partition(-scores, limit - 1)[limit - 1]
+        top = np.flatnonzero(scores >= threshold)
+    return top[np.lexsort((top, -scores[top]))][:limit]
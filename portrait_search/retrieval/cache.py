@@ -0,0 +1,117 @@
+import time
+from collections import OrderedDict
+from collections.abc import Collection
+from typing import NamedTuple
+
+from portrait_search.core.enums import AggregatorType, DistanceType, EmbedderType, SplitterType
+from portrait_search.core.generation import INDEX_GENERATION, Generation
+from portrait_search.embeddings.embedders import Embedder
+from portrait_search.embeddings.entities import EmbeddingSimilarity
+from portrait_search.embeddings.splitters import Splitter
+from portrait_search.portraits.entities import PortraitRecord
+
+from .retriever import Retriever
+from .tags import normalize_tag
+
+SearchResult = tuple[list[PortraitRecord], list[list[EmbeddingSimilarity]]]
+
+
+class SearchKey(NamedTuple):
+    query: str
+    experiment: str | None
+    limit: int
+    splitter_type: SplitterType
+    embedder_type: EmbedderType
+    distance_type: DistanceType
+    aggregator_type: AggregatorType
+    tags: tuple[str, ...] = ()
+
+
+class SearchResultCache:
+    """
+    Search results cache with TTL and max entries eviction.
+    All entries are dropped as soon as the index generation changes, also by writes of other processes sharing
+    the generation, so results are not served stale after the index is written to.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, generation: Generation = INDEX_GENERATION) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.generation = generation
+        self.entries: OrderedDict[SearchKey, tuple[float, SearchResult]] = OrderedDict()
+        self.entries_generation = generation.value
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _drop_stale_generation(self) -> None:
+        if self.entries_generation != self.generation.value:
+            self.entries.clear()
+            self.entries_generation = self.generation.value
+
+    def get(self, key: SearchKey) -> SearchResult | None:
+        self._drop_stale_generation()
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: SearchKey, result: SearchResult) -> None:
+        self._drop_stale_generation()
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class CachedRetriever(Retriever):
+    def __init__(
+        self,
+        retriever: Retriever,
+        cache: SearchResultCache,
+        distance_type: DistanceType,
+        splitter: Splitter,
+        embedder: Embedder,
+        aggregator_type: AggregatorType = AggregatorType.MEAN,
+    ) -> None:
+        self.retriever = retriever
+        self.cache = cache
+        self.distance_type = distance_type
+        self.splitter = splitter
+        self.embedder = embedder
+        self.aggregator_type = aggregator_type
+
+    async def sync(self) -> None:
+        await self.retriever.sync()
+
+    async def get_portraits(
+        self, query: str, experiment: str | None = None, limit: int = 10, tags: Collection[str] | None = None
+    ) -> tuple[list[PortraitRecord], list[list[EmbeddingSimilarity]]]:
+        """Returns cached results of the wrapped retriever, searches only on a cache miss."""
+        key = SearchKey(
+            query=" ".join(query.lower().split()),
+            experiment=experiment,
+            limit=limit,
+            splitter_type=self.splitter.type,
+            embedder_type=self.embedder.type,
+            distance_type=self.distance_type,
+            aggregator_type=self.aggregator_type,
+            tags=tuple(sorted({normalize_tag(tag) for tag in tags or ()})),
+        )
+        # generation before the search: a write during the search must not be hidden by the cached result
+        generation = self.cache.generation.value
+        result = self.cache.get(key)
+        if result is None:
+            result = await self.retriever.get_portraits(query, experiment=experiment, limit=limit, tags=tags)
+            if generation == self.cache.generation.value:
+                self.cache.put(key, result)
+        return result
@@ -0,0 +1,121 @@
+import asyncio
+from collections import defaultdict
+from collections.abc import Collection
+
+from bson import ObjectId
+
+from portrait_search.core.generation import INDEX_GENERATION, PORTRAIT_GENERATION, Generation
+from portrait_search.embeddings.embedders import Embedder
+from portrait_search.embeddings.entities import EmbeddingSimilarity
+from portrait_search.embeddings.repository import EmbeddingRepository
+from portrait_search.embeddings.splitters import Splitter
+from portrait_search.portraits.entities import PortraitRecord
+from portrait_search.portraits.repository import PortraitRepository
+
+from .lexical import LexicalIndex
+from .retriever import Retriever
+from .tags import TagIndex
+
+
+class HybridRetriever(Retriever):
+    """
+    Fuses BM25 matches of portrait descriptions with the results of a vector retriever by reciprocal rank fusion.
+    Literal terms of a query, like a weapon, are matched by the lexical pass, so the vector retriever is configured
+    to search a smaller candidate pool. Both passes are restricted to portraits with the tags of a search.
+    """
+
+    # the constant of reciprocal rank fusion, dampens the weight of the top ranks
+    RRF_K = 60
+    LEXICAL_CANDIDATES_FACTOR = 3
+
+    def __init__(
+        self,
+        vector_retriever: Retriever,
+        lexical_index: LexicalIndex,
+        tag_index: TagIndex,
+        portrait_repository: PortraitRepository,
+        embedding_repository: EmbeddingRepository,
+        splitter: Splitter,
+        embedder: Embedder,
+        generation: Generation = INDEX_GENERATION,
+        portrait_generation: Generation = PORTRAIT_GENERATION,
+    ) -> None:
+        self.vector_retriever = vector_retriever
+        self.lexical_index = lexical_index
+        self.tag_index = tag_index
+        self.portrait_repository = portrait_repository
+        self.embedding_repository = embedding_repository
+        self.splitter = splitter
+        self.embedder = embedder
+        self.generation = generation
+        self.synced_generation: tuple[int, str] | None = None
+        self.portrait_generation = portrait_generation
+        self.synced_portrait_generation: tuple[int, str] | None = None
+        self.sync_lock = asyncio.Lock()
+        self.experiment_portrait_ids: dict[str, set[ObjectId]] = {}
+
+    async def sync(self) -> None:
+        """
+        Updates the lexical index with portraits written since the last sync, once per portrait generation, and
+        drops the portraits embedded in experiments once per index generation. The index is saved by the server
+        on shutdown, not on the search path. The vector retriever is synced first, the tag index it shares is used
+        by both passes.
+        """
+        await self.vector_retriever.sync()
+        async with self.sync_lock:
+            # generations before the sync: a write during the sync must trigger another one
+            portrait_generation = self.portrait_generation.value
+            if self.synced_portrait_generation != portrait_generation:
+                await self.lexical_index.sync(self.portrait_repository)
+                self.synced_portrait_generation = portrait_generation
+            generation = self.generation.value
+            if self.synced_generation != generation:
+                self.experiment_portrait_ids.clear()
+                self.synced_generation = generation
+
+    async def _experiment_portrait_ids(self, experiment: str) -> set[ObjectId]:
+        # lexical matches are limited to the portraits the vector retriever can find in the experiment
+        if experiment not in self.experiment_portrait_ids:
+            self.experiment_portrait_ids[experiment] = await self.embedding_repository.get_embedded_portrait_ids(
+                self.splitter.type, self.embedder.type, experiment
+            )
+        return self.experiment_portrait_ids[experiment]
+
+    async def get_portraits(
+        self, query: str, experiment: str | None = None, limit: int = 10, tags: Collection[str] | None = None
+    ) -> tuple[list[PortraitRecord], list[list[EmbeddingSimilarity]]]:
+        """Returns the portraits ranked best by both retrievers, lexical only matches have no explanations."""
+        await self.sync()
+        portrait_ids = await self._experiment_portrait_ids(experiment) if experiment else None
+        if tags:
+            tagged_portrait_ids = self.tag_index.portrait_ids_with(tags)
+            portrait_ids = tagged_portrait_ids if portrait_ids is None else portrait_ids & tagged_portrait_ids
+        lexical_matches = self.lexical_index.search(
+            query, limit=limit * self.LEXICAL_CANDIDATES_FACTOR, portrait_ids=portrait_ids
+        )
+        vector_portraits, vector_explanations = await self.vector_retriever.get_portraits(
+            query, experiment=experiment, limit=limit, tags=tags
+        )
+
+        fused_scores: dict[ObjectId, float] = defaultdict(float)
+        for rank, (portrait_id, _) in enumerate(lexical_matches):
+            fused_scores[portrait_id] += 1 / (self.RRF_K + rank + 1)
+        for rank, portrait in enumerate(vector_portraits):
+            if portrait.id is not None:
+                fused_scores[portrait.id] += 1 / (self.RRF_K + rank + 1)
+        top_portrait_ids = [
+            portrait_id for portrait_id, _ in sorted(fused_scores.items(), key=lambda item: item[1], reverse=True)
+        ][:limit]
+
+        portraits_by_id: dict[ObjectId | None, PortraitRecord] = {
+            portrait.id: portrait for portrait in vector_portraits
+        }
+        explanations_by_id: dict[ObjectId | None, list[EmbeddingSimilarity]] = {
+            portrait.id: explanations for portrait, explanations in zip(vector_portraits, vector_explanations)
+        }
+        lexical_only_ids = [portrait_id for portrait_id in top_portrait_ids if portrait_id not in portraits_by_id]
+        for portrait in await self.portrait_repository.get_by_ids(lexical_only_ids):
+            portraits_by_id[portrait.id] = portrait
+
+        portraits = [portraits_by_id[portrait_id] for portrait_id in top_portrait_ids]
+        return portraits, [explanations_by_id.get(portrait_id, []) for portrait_id in top_portrait_ids]
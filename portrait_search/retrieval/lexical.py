@@ -0,0 +1,197 @@
+import math
+import re
+from array import array
+from collections import Counter
+from collections.abc import Collection
+from pathlib import Path
+
+import numpy as np
+from bson import ObjectId
+
+from portrait_search.portraits.repository import PortraitRepository, inserted_after
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 inverted index over portrait descriptions: the postings of every term are two int arrays,
+    the documents containing the term and the term frequencies in them.
+    Portraits are added incrementally, removed or replaced portraits are only marked deleted until the index is
+    compacted on save. Persisted as one npz file, the postings of all terms concatenated.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = path
+        self.portrait_ids: list[ObjectId] = []
+        self.docs_by_portrait_id: dict[ObjectId, int] = {}
+        self.lengths = array("i")
+        self.deleted = array("B")
+        self.postings: dict[str, tuple[array, array]] = {}
+        self.last_portrait_id: ObjectId | None = None
+        self.total_length = 0
+        self.changed = False
+        if path is not None and path.exists():
+            self._load(path)
+
+    def __len__(self) -> int:
+        return len(self.docs_by_portrait_id)
+
+    def __contains__(self, portrait_id: ObjectId) -> bool:
+        return portrait_id in self.docs_by_portrait_id
+
+    def add(self, portrait_id: ObjectId, description: str) -> None:
+        """Indexes the description of a portrait, replacing the indexed description of the same portrait."""
+        self.remove(portrait_id)
+        doc = len(self.portrait_ids)
+        term_frequencies = Counter(tokenize(description))
+        for term, frequency in term_frequencies.items():
+            docs, frequencies = self.postings.setdefault(term, (array("i"), array("i")))
+            docs.append(doc)
+            frequencies.append(frequency)
+        length = sum(term_frequencies.values())
+        self.portrait_ids.append(portrait_id)
+        self.docs_by_portrait_id[portrait_id] = doc
+        if self.last_portrait_id is None or portrait_id > self.last_portrait_id:
+            self.last_portrait_id = portrait_id
+        self.lengths.append(length)
+        self.deleted.append(0)
+        self.total_length += length
+        self.changed = True
+
+    def remove(self, portrait_id: ObjectId) -> None:
+        doc = self.docs_by_portrait_id.pop(portrait_id, None)
+        if doc is None:
+            return
+        self.deleted[doc] = 1
+        self.total_length -= self.lengths[doc]
+        self.changed = True
+
+    async def sync(self, portrait_repository: PortraitRepository) -> None:
+        """
+        Indexes portraits inserted since the last indexed one, only their descriptions are fetched. Portraits are not
+        updated, a regenerated description is a new portrait. Deleted portraits are found by comparing the number of
+        portraits with the index, only then all portrait ids are fetched to catch up.
+        """
+        descriptions_by_portrait_id = await portrait_repository.get_descriptions(
+            after_id=inserted_after(self.last_portrait_id)
+        )
+        self._add_all({id: description for id, description in descriptions_by_portrait_id.items() if id not in self})
+        if await portrait_repository.count() == len(self):
+            return
+        portrait_ids = await portrait_repository.get_ids()
+        for portrait_id in self.docs_by_portrait_id.keys() - portrait_ids:
+            self.remove(portrait_id)
+        missing_portrait_ids = portrait_ids - self.docs_by_portrait_id.keys()
+        if missing_portrait_ids:
+            self._add_all(await portrait_repository.get_descriptions(ids=missing_portrait_ids))
+
+    def _add_all(self, descriptions_by_portrait_id: dict[ObjectId, str]) -> None:
+        for portrait_id in sorted(descriptions_by_portrait_id):
+            self.add(portrait_id, descriptions_by_portrait_id[portrait_id])
+
+    def search(
+        self, query: str, limit: int = 10, portrait_ids: Collection[ObjectId] | None = None
+    ) -> list[tuple[ObjectId, float]]:
+        """Returns ids of the portraits matching the query, best first, with their BM25 scores."""
+        if not self.docs_by_portrait_id:
+            return []
+        count = len(self.docs_by_portrait_id)
+        average_length = max(self.total_length / count, 1.0)
+        deleted = np.frombuffer(self.deleted, dtype=np.uint8).astype(np.bool_)
+        lengths = np.frombuffer(self.lengths, dtype=np.intc)
+        scores = np.zeros(len(self.portrait_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            docs = np.frombuffer(self.postings[term][0], dtype=np.intc)
+            frequencies = np.frombuffer(self.postings[term][1], dtype=np.intc)
+            live = ~deleted[docs]
+            docs, frequencies = docs[live], frequencies[live]
+            if len(docs) == 0:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            length_norms = self.K1 * (1 - self.B + self.B * lengths[docs] / average_length)
+            # every document is once in the postings of a term
+            scores[docs] += idf * frequencies * (self.K1 + 1) / (frequencies + length_norms)
+
+        matches = np.flatnonzero(scores > 0)
+        results = []
+        for doc in matches[np.argsort(-scores[matches], kind="stable")]:
+            portrait_id = self.portrait_ids[doc]
+            if portrait_ids is not None and portrait_id not in portrait_ids:
+                continue
+            results.append((portrait_id, float(scores[doc])))
+            if len(results) == limit:
+                break
+        return results
+
+    def _compact(self) -> None:
+        """Drops deleted documents, their postings and their ids."""
+        if not any(self.deleted):
+            return
+        deleted = np.frombuffer(self.deleted, dtype=np.uint8).astype(np.bool_)
+        new_docs = (np.cumsum(~deleted) - 1).astype(np.intc)
+        postings = {}
+        for term, (docs, frequencies) in self.postings.items():
+            term_docs = np.frombuffer(docs, dtype=np.intc)
+            live = ~deleted[term_docs]
+            if live.any():
+                term_frequencies = np.frombuffer(frequencies, dtype=np.intc)[live]
+                postings[term] = (
+                    array("i", new_docs[term_docs[live]].tobytes()),
+                    array("i", term_frequencies.tobytes()),
+                )
+        self.postings = postings
+        self.portrait_ids = [id for id, is_deleted in zip(self.portrait_ids, deleted) if not is_deleted]
+        self.docs_by_portrait_id = {portrait_id: doc for doc, portrait_id in enumerate(self.portrait_ids)}
+        self.lengths = array("i", np.frombuffer(self.lengths, dtype=np.intc)[~deleted].tobytes())
+        self.deleted = array("B", bytes(len(self.portrait_ids)))
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self._compact()
+        terms = sorted(self.postings)
+        offsets = np.cumsum([0] + [len(self.postings[term][0]) for term in terms], dtype=np.int64)
+        docs = b"".join(self.postings[term][0].tobytes() for term in terms)
+        frequencies = b"".join(self.postings[term][1].tobytes() for term in terms)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path,
+            terms=np.array(terms, dtype=str),
+            offsets=offsets,
+            docs=np.frombuffer(docs, dtype=np.intc),
+            frequencies=np.frombuffer(frequencies, dtype=np.intc),
+            portrait_ids=np.frombuffer(b"".join(id.binary for id in self.portrait_ids), dtype=np.uint8).reshape(-1, 12),
+            lengths=np.frombuffer(self.lengths, dtype=np.intc),
+        )
+        tmp_path.replace(self.path)
+        self.changed = False
+
+    def _load(self, path: Path) -> None:
+        data = np.load(path)
+        offsets = data["offsets"]
+        docs = data["docs"].astype(np.intc)
+        frequencies = data["frequencies"].astype(np.intc)
+        self.postings = {
+            str(term): (
+                array("i", docs[offsets[i] : offsets[i + 1]].tobytes()),
+                array("i", frequencies[offsets[i] : offsets[i + 1]].tobytes()),
+            )
+            for i, term in enumerate(data["terms"])
+        }
+        self.portrait_ids = [ObjectId(portrait_id.tobytes()) for portrait_id in data["portrait_ids"]]
+        self.docs_by_portrait_id = {portrait_id: doc for doc, portrait_id in enumerate(self.portrait_ids)}
+        self.lengths = array("i", data["lengths"].astype(np.intc).tobytes())
+        self.deleted = array("B", bytes(len(self.portrait_ids)))
+        self.total_length = sum(self.lengths)
+        self.last_portrait_id = max(self.portrait_ids, default=None)
@@ -1,4 +1,5 @@
 import abc
+from collections.abc import Collection
 
 from portrait_search.embeddings.entities import EmbeddingSimilarity
 from portrait_search.portraits.entities import PortraitRecord
@@ -7,6 +8,11 @@ from portrait_search.portraits.entities import PortraitRecord
 class Retriever(abc.ABC):
     @abc.abstractmethod
     async def get_portraits(
-        self, query: str, experiment: str | None = None, limit: int = 10
+        self, query: str, experiment: str | None = None, limit: int = 10, tags: Collection[str] | None = None
     ) -> tuple[list[PortraitRecord], list[list[EmbeddingSimilarity]]]:
+        """Returns the portraits matching the query best, limited to portraits with all the tags if given."""
         raise NotImplementedError()
+
+    async def sync(self) -> None:
+        """Updates in-memory indexes of the retriever with writes to the index since the last sync, if it has any."""
+        pass
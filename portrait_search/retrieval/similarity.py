@@ -1,20 +1,36 @@
-from collections import defaultdict
+import asyncio
+from collections.abc import Collection
 
 import numpy as np
+from bson import ObjectId
 
-from portrait_search.core.enums import DistanceType
+from portrait_search.core.enums import AggregatorType, DistanceType
+from portrait_search.core.generation import PORTRAIT_GENERATION, Generation
+from portrait_search.embeddings.cache import EmbeddingCache
 from portrait_search.embeddings.embedders import Embedder
-from portrait_search.embeddings.entities import EmbeddingSimilarity
+from portrait_search.embeddings.entities import EmbeddingSimilarity, Vectors
+from portrait_search.embeddings.pooled import PooledVectorStore
 from portrait_search.embeddings.repository import EmbeddingRepository
+from portrait_search.embeddings.service import BatchingEmbeddingService
 from portrait_search.embeddings.splitters import Splitter
 from portrait_search.embeddings.t2v import query2embeddings
 from portrait_search.portraits.entities import PortraitRecord
 from portrait_search.portraits.repository import PortraitRepository
 
+from .aggregation import AGGREGATORS, to_hits, top_portraits
 from .retriever import Retriever
+from .tags import TagIndex
 
 
 class SimilarityRetriever(Retriever):
+    """
+    Ranks portraits by the similarities of their chunks to the chunks of the query.
+    With a shortlist factor, portraits are shortlisted by their pooled vectors first and only their chunks are scored,
+    so a search scales with the number of portraits instead of chunks. Without pooled vectors, all chunks are searched.
+    Tags are resolved to portrait ids by the tag index and the search is restricted to them in the repository,
+    the tag index is synced with the portraits once per portrait generation.
+    """
+
     def __init__(
         self,
         distance_type: DistanceType,
@@ -22,55 +38,112 @@ class SimilarityRetriever(Retriever):
         portrait_repository: PortraitRepository,
         splitter: Splitter,
         embedder: Embedder,
+        query_embedding_cache: EmbeddingCache | None = None,
+        embedding_service: BatchingEmbeddingService | None = None,
+        candidates_factor: int = 3,
+        aggregator_type: AggregatorType = AggregatorType.MEAN,
+        pooled_vector_store: PooledVectorStore | None = None,
+        shortlist_factor: int = 0,
+        tag_index: TagIndex | None = None,
+        portrait_generation: Generation = PORTRAIT_GENERATION,
     ) -> None:
         self.distance_type = distance_type
         self.embedding_repository = embedding_repository
         self.portrait_repository = portrait_repository
         self.splitter = splitter
         self.embedder = embedder
+        self.query_embedding_cache = query_embedding_cache
+        self.embedding_service = embedding_service
+        self.candidates_factor = candidates_factor
+        self.aggregator_type = aggregator_type
+        self.pooled_vector_store = pooled_vector_store
+        self.shortlist_factor = shortlist_factor
+        self.tag_index = tag_index
+        self.portrait_generation = portrait_generation
+        self.synced_portrait_generation: tuple[int, str] | None = None
+        self.sync_lock = asyncio.Lock()
+
+    async def sync(self) -> None:
+        """
+        Updates the tag index with portraits written since the last sync, once per portrait generation.
+        The index is saved by the server on shutdown, not on the search path.
+        """
+        if self.tag_index is None:
+            return
+        async with self.sync_lock:
+            if self.synced_portrait_generation == self.portrait_generation.value:
+                return
+            # generation before the sync: a write during the sync must trigger another one
+            portrait_generation = self.portrait_generation.value
+            await self.tag_index.sync(self.portrait_repository)
+            self.synced_portrait_generation = portrait_generation
 
     async def get_portraits(
-        self, query: str, experiment: str | None = None, limit: int = 10
+        self, query: str, experiment: str | None = None, limit: int = 10, tags: Collection[str] | None = None
     ) -> tuple[list[PortraitRecord], list[list[EmbeddingSimilarity]]]:
         """Returns a list of PortraitRecords that match the query string."""
+        portrait_ids = None
+        if tags:
+            if self.tag_index is None:
+                raise ValueError("Filtering by tags requires a tag index")
+            await self.sync()
+            portrait_ids = self.tag_index.portrait_ids_with(tags)
+            if not portrait_ids:
+                return [], []
 
-        # First get the embeddings for the query
-        query_embeddings_and_texts = query2embeddings(query, self.splitter, self.embedder)
-
-        # Then search for the embeddings in the database
-        all_embedding_similarities = []
-        for query_embedding_and_text in zip(*query_embeddings_and_texts):
-            query_embedding, query_text = query_embedding_and_text
-            embedding_similarities = await self.embedding_repository.vector_search(
-                query_embedding,
-                self.splitter.type,
-                self.embedder.type,
-                self.distance_type,
-                experiment=experiment,
-                # Get more candidates to widen search
-                limit=limit * 3,
+        # First get the embeddings for the query, off the event loop if the embedding service is available
+        if self.embedding_service is not None:
+            query_texts = self.splitter.split_query(query)
+            query_embeddings = await self.embedding_service.embed(query_texts)
+        else:
+            query_embeddings, query_texts = query2embeddings(
+                query, self.splitter, self.embedder, self.query_embedding_cache
             )
+
+        # Then search for all query embeddings at once, get more candidates to widen search
+        embedding_similarities_by_query = await self._search_chunks(query_embeddings, experiment, limit, portrait_ids)
+        for query_embedding, query_text, embedding_similarities in zip(
+            query_embeddings, query_texts, embedding_similarities_by_query
+        ):
             for embedding_similarity in embedding_similarities:
                 embedding_similarity.query_text = query_text
                 embedding_similarity.query = query_embedding
+        hits, all_embedding_similarities = to_hits(embedding_similarities_by_query)
+        if not all_embedding_similarities:
+            return [], []
 
-            all_embedding_similarities.extend(embedding_similarities)
-
-        # Find all similarities for all unique portraits
-        portrait_similarity = defaultdict(list)
-        portrait_similarity_explanation = defaultdict(list)
-        for embedding_similarity in all_embedding_similarities:
-            portrait_similarity[embedding_similarity.portrait_id].append(embedding_similarity.similarity)
-            portrait_similarity_explanation[embedding_similarity.portrait_id].append(embedding_similarity)
+        # Aggregate similarities of all unique portraits and take top N with the highest score where N is the limit
+        portrait_scores = AGGREGATORS[self.aggregator_type](hits)
+        top_portraits_indices = top_portraits(portrait_scores, limit)
+        top_portrait_ids = [all_embedding_similarities[hits.first_hits[i]].portrait_id for i in top_portraits_indices]
 
-        # Calculate the average similarity for each portrait
-        portrait_similarity_average = {k: np.mean(v) for k, v in portrait_similarity.items()}
-
-        # Take top N with the highest similarity where N is the limit
-        top_portrait_ids = [
-            p for p, _ in sorted(portrait_similarity_average.items(), key=lambda item: item[1], reverse=True)
-        ][:limit]
-
-        portraits = [await self.portrait_repository.get_one(portrait_id) for portrait_id in top_portrait_ids]
-        similarity_explanations = [portrait_similarity_explanation[portrait_id] for portrait_id in top_portrait_ids]
+        portraits = await self.portrait_repository.get_by_ids(top_portrait_ids)
+        similarity_explanations = [
+            [all_embedding_similarities[i] for i in np.flatnonzero(hits.portraits == portrait_index)]
+            for portrait_index in top_portraits_indices
+        ]
         return portraits, similarity_explanations
+
+    async def _search_chunks(
+        self,
+        query_embeddings: Vectors,
+        experiment: str | None,
+        limit: int,
+        portrait_ids: Collection[ObjectId] | None = None,
+    ) -> list[list[EmbeddingSimilarity]]:
+        if self.shortlist_factor > 0 and self.pooled_vector_store is not None:
+            pooled_vectors = self.pooled_vector_store.get(self.splitter.type, self.embedder.type, experiment)
+            if len(pooled_vectors):
+                # only chunks of the shortlisted portraits are searched, scored as by the search over all chunks
+                portrait_ids = pooled_vectors.search(
+                    query_embeddings, self.distance_type, limit=limit * self.shortlist_factor, portrait_ids=portrait_ids
+                )
+        return await self.embedding_repository.vector_search_many(
+            query_embeddings,
+            self.splitter.type,
+            self.embedder.type,
+            self.distance_type,
+            experiment=experiment,
+            limit=limit * self.candidates_factor,
+            portrait_ids=portrait_ids,
+        )
@@ -0,0 +1,159 @@
+from collections.abc import Collection, Iterable
+from pathlib import Path
+
+import numpy as np
+from bson import ObjectId
+from numpy.typing import NDArray
+
+from portrait_search.portraits.repository import PortraitRepository, inserted_after
+
+
+def normalize_tag(tag: str) -> str:
+    return " ".join(tag.lower().split())
+
+
+class TagIndex:
+    """
+    Bitmap index of portrait tags: every portrait is numbered and every tag has a bitmap with the bits of the portraits
+    tagged with it, so filtering by several tags is a bitwise and of their bitmaps. Tags match case insensitively.
+    Removed portraits are only cleared from the bitmaps until the index is compacted on save.
+    Persisted as one npz file, the bitmaps of all tags padded to the same length.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = path
+        self.portrait_ids: list[ObjectId | None] = []
+        self.docs_by_portrait_id: dict[ObjectId, int] = {}
+        self.bitmaps: dict[str, bytearray] = {}
+        self.last_portrait_id: ObjectId | None = None
+        self.changed = False
+        if path is not None and path.exists():
+            self._load(path)
+
+    def __len__(self) -> int:
+        return len(self.docs_by_portrait_id)
+
+    def __contains__(self, portrait_id: ObjectId) -> bool:
+        return portrait_id in self.docs_by_portrait_id
+
+    def add(self, portrait_id: ObjectId, tags: Iterable[str]) -> None:
+        """Indexes the tags of a portrait, replacing the indexed tags of the same portrait."""
+        self.remove(portrait_id)
+        doc = len(self.portrait_ids)
+        byte, bit = divmod(doc, 8)
+        normalized_tags = {normalize_tag(tag) for tag in tags}
+        for tag in normalized_tags:
+            bitmap = self.bitmaps.setdefault(tag, bytearray())
+            if len(bitmap) <= byte:
+                bitmap.extend(bytes(byte + 1 - len(bitmap)))
+            bitmap[byte] |= 1 << bit
+        self.portrait_ids.append(portrait_id)
+        self.docs_by_portrait_id[portrait_id] = doc
+        if self.last_portrait_id is None or portrait_id > self.last_portrait_id:
+            self.last_portrait_id = portrait_id
+        self.changed = True
+
+    def remove(self, portrait_id: ObjectId) -> None:
+        doc = self.docs_by_portrait_id.pop(portrait_id, None)
+        if doc is None:
+            return
+        byte, bit = divmod(doc, 8)
+        for bitmap in self.bitmaps.values():
+            if len(bitmap) > byte:
+                bitmap[byte] &= ~(1 << bit) & 0xFF
+        self.portrait_ids[doc] = None
+        self.changed = True
+
+    async def sync(self, portrait_repository: PortraitRepository) -> None:
+        """
+        Indexes portraits inserted since the last indexed one, only their tags are fetched. Portraits are not
+        updated, re-tagging a portrait inserts a new one. Deleted portraits are found by comparing the number of
+        portraits with the index, only then all portrait ids are fetched to catch up.
+        """
+        tags_by_portrait_id = await portrait_repository.get_tags(after_id=inserted_after(self.last_portrait_id))
+        self._add_all({id: tags for id, tags in tags_by_portrait_id.items() if id not in self})
+        if await portrait_repository.count() == len(self):
+            return
+        portrait_ids = await portrait_repository.get_ids()
+        for portrait_id in self.docs_by_portrait_id.keys() - portrait_ids:
+            self.remove(portrait_id)
+        missing_portrait_ids = portrait_ids - self.docs_by_portrait_id.keys()
+        if missing_portrait_ids:
+            self._add_all(await portrait_repository.get_tags(ids=missing_portrait_ids))
+
+    def _add_all(self, tags_by_portrait_id: dict[ObjectId, list[str]]) -> None:
+        for portrait_id in sorted(tags_by_portrait_id):
+            self.add(portrait_id, tags_by_portrait_id[portrait_id])
+
+    def portrait_ids_with(self, tags: Collection[str]) -> set[ObjectId]:
+        """Returns ids of the portraits tagged with all the tags."""
+        bitmaps = [self.bitmaps.get(normalize_tag(tag)) for tag in tags]
+        if not bitmaps or any(bitmap is None for bitmap in bitmaps):
+            return set()
+        # bitmaps end at the last portrait with the tag, the bits after it are zeros
+        size = min(len(bitmap) for bitmap in bitmaps if bitmap is not None)
+        matches = np.bitwise_and.reduce(
+            [np.frombuffer(bitmap, dtype=np.uint8, count=size) for bitmap in bitmaps if bitmap is not None]
+        )
+        docs = np.flatnonzero(np.unpackbits(matches, bitorder="little"))
+        return {portrait_id for doc in docs if (portrait_id := self.portrait_ids[doc]) is not None}
+
+    def tag_counts(self) -> dict[str, int]:
+        """Returns the number of portraits with every tag."""
+        counts = {
+            tag: int(np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8)).sum()) for tag, bitmap in self.bitmaps.items()
+        }
+        return {tag: count for tag, count in sorted(counts.items()) if count}
+
+    def _matrix(self) -> tuple[list[str], NDArray[np.uint8]]:
+        """Returns the tags and their bitmaps as rows of a bit matrix, one column per portrait."""
+        tags = sorted(self.bitmaps)
+        size = (len(self.portrait_ids) + 7) // 8
+        bitmaps = np.zeros((len(tags), size), dtype=np.uint8)
+        for row, tag in enumerate(tags):
+            bitmaps[row, : len(self.bitmaps[tag])] = np.frombuffer(self.bitmaps[tag], dtype=np.uint8)
+        return tags, np.unpackbits(bitmaps, axis=1, count=len(self.portrait_ids), bitorder="little")
+
+    def _compact(self) -> None:
+        """Drops removed portraits and tags left without portraits."""
+        live = np.array([portrait_id is not None for portrait_id in self.portrait_ids], dtype=np.bool_)
+        if live.all():
+            return
+        tags, bits = self._matrix()
+        bits = bits[:, live]
+        self.bitmaps = {
+            tag: bytearray(np.packbits(tag_bits, bitorder="little").tobytes())
+            for tag, tag_bits in zip(tags, bits)
+            if tag_bits.any()
+        }
+        self.portrait_ids = [portrait_id for portrait_id in self.portrait_ids if portrait_id is not None]
+        self.docs_by_portrait_id = {
+            portrait_id: doc for doc, portrait_id in enumerate(self.portrait_ids) if portrait_id is not None
+        }
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self._compact()
+        tags, bits = self._matrix()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path,
+            tags=np.array(tags, dtype=str),
+            bitmaps=np.packbits(bits, axis=1, bitorder="little"),
+            portrait_ids=np.frombuffer(
+                b"".join(id.binary for id in self.portrait_ids if id is not None), dtype=np.uint8
+            ).reshape(-1, 12),
+        )
+        tmp_path.replace(self.path)
+        self.changed = False
+
+    def _load(self, path: Path) -> None:
+        data = np.load(path)
+        self.portrait_ids = [ObjectId(portrait_id.tobytes()) for portrait_id in data["portrait_ids"]]
+        self.docs_by_portrait_id = {
+            portrait_id: doc for doc, portrait_id in enumerate(self.portrait_ids) if portrait_id is not None
+        }
+        self.bitmaps = {str(tag): bytearray(bitmap.tobytes()) for tag, bitmap in zip(data["tags"], data["bitmaps"])}
+        self.last_portrait_id = max(self.docs_by_portrait_id, default=None)
@@ -0,0 +1,153 @@
+import asyncio
+from typing import Any
+
+from aiohttp import web
+from dependency_injector.wiring import Provide, inject
+from loguru import logger
+
+from portrait_search.core.enums import RetrieverType
+from portrait_search.dependencies import Container
+from portrait_search.embeddings.entities import EmbeddingSimilarity
+from portrait_search.portraits.entities import PortraitRecord
+from portrait_search.retrieval.retriever import Retriever
+
+MAX_LIMIT = 100
+WARM_UP_QUERY = "A human fighter with a sword"
+
+CONTAINER_KEY = web.AppKey("container", Container)
+RETRIEVER_KEY = web.AppKey("retriever", Retriever)
+
+routes = web.RouteTableDef()
+
+
+def _portrait_to_json(portrait: PortraitRecord, explanations: list[EmbeddingSimilarity]) -> dict[str, Any]:
+    return {
+        "id": str(portrait.id),
+        **portrait.model_dump(exclude={"id", "query"}),
+        "explanations": [
+            {
+                "query_text": explanation.query_text,
+                "embedded_text": explanation.embedded_text,
+                "similarity": explanation.similarity,
+            }
+            for explanation in explanations
+        ],
+    }
+
+
+@routes.get("/search")
+async def search(request: web.Request) -> web.Response:
+    query = request.query.get("q", "").strip()
+    if not query:
+        raise web.HTTPBadRequest(text="Query parameter q is required")
+    try:
+        limit = int(request.query.get("limit", 10))
+    except ValueError:
+        raise web.HTTPBadRequest(text="Query parameter limit must be an integer")
+    if not 0 < limit <= MAX_LIMIT:
+        raise web.HTTPBadRequest(text=f"Query parameter limit must be between 1 and {MAX_LIMIT}")
+    experiment = request.query.get("experiment") or None
+    # comma separated, portraits with all the tags are searched
+    tags = [tag.strip() for tag in request.query.get("tags", "").split(",") if tag.strip()] or None
+
+    portraits, explanations = await request.app[RETRIEVER_KEY].get_portraits(
+        query, experiment=experiment, limit=limit, tags=tags
+    )
+    return web.json_response(
+        {
+            "query": query,
+            "portraits": [
+                _portrait_to_json(portrait, explanation) for portrait, explanation in zip(portraits, explanations)
+            ],
+        }
+    )
+
+
+@routes.get("/tags")
+async def tags(request: web.Request) -> web.Response:
+    # portraits written since the last search are counted too
+    await request.app[RETRIEVER_KEY].sync()
+    return web.json_response({"tags": request.app[CONTAINER_KEY].tag_index().tag_counts()})
+
+
+@routes.get("/healthz")
+async def healthz(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+async def warm_up(app: web.Application) -> None:
+    """
+    Loads the embedder model, opens the index and loads the pooled vectors once, so the first search does not pay
+    for it.
+    """
+    container = app[CONTAINER_KEY]
+    splitter = container.splitter()
+    embedder = container.embedder()
+    distance_type = container.distance_type()
+    logger.info(f"Warming up {embedder} with {splitter}, distance {distance_type}")
+
+    loop = asyncio.get_running_loop()
+    query_vectors = await loop.run_in_executor(None, embedder.embed, splitter.split_query(WARM_UP_QUERY))
+    await container.embedding_repository().vector_search_many(
+        query_vectors, splitter.type, embedder.type, distance_type, limit=1
+    )
+    if container.config().pooled_shortlist_factor > 0:
+        pooled_vectors = container.pooled_vector_store().get(splitter.type, embedder.type, None)
+        # the first search stacks the pooled vectors into a matrix
+        pooled_vectors.search(query_vectors, distance_type, limit=1)
+        logger.info(f"Pooled vectors of {len(pooled_vectors)} portraits loaded")
+    # the indexes kept in memory are synced with the portraits, later on every write of portraits
+    await app[RETRIEVER_KEY].sync()
+    _save_indexes(container)
+    if container.config().retriever_type == RetrieverType.HYBRID:
+        logger.info(f"Lexical index of {len(container.lexical_index())} portraits loaded")
+    logger.info(f"Tag index of {len(container.tag_index())} portraits loaded")
+    logger.info("Warm-up finished")
+
+
+def _save_indexes(container: Container) -> None:
+    """
+    Saves the indexes kept in memory if portraits were indexed since they were loaded. Searches sync the indexes
+    without saving them, saving compacts the index searches read.
+    """
+    tag_index = container.tag_index()
+    if tag_index.changed:
+        tag_index.save()
+    if container.config().retriever_type == RetrieverType.HYBRID:
+        lexical_index = container.lexical_index()
+        if lexical_index.changed:
+            lexical_index.save()
+
+
+async def shut_down(app: web.Application) -> None:
+    """Saves the indexes, stops the inference thread and the other resources of the container."""
+    _save_indexes(app[CONTAINER_KEY])
+    app[CONTAINER_KEY].shutdown_resources()
+
+
+def create_app(container: Container) -> web.Application:
+    app = web.Application()
+    app[CONTAINER_KEY] = container
+    # built before the app is frozen on startup, the warm-up only warms it up
+    app[RETRIEVER_KEY] = container.retriever()
+    app.add_routes(routes)
+    app.on_startup.append(warm_up)  # type: ignore[arg-type]
+    app.on_cleanup.append(shut_down)  # type: ignore[arg-type]
+    return app
+
+
+@inject
+def serve(
+    container: Container,
+    host: str = Provide[Container.config.provided.server_host],
+    port: int = Provide[Container.config.provided.server_port],
+) -> None:
+    web.run_app(create_app(container), host=host, port=port)
+
+
+if __name__ == "__main__":
+    container = Container()
+    container.init_resources()
+    container.wire(modules=[__name__])
+
+    serve(container)
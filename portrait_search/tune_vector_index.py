@@ -0,0 +1,137 @@
+import asyncio
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from itertools import product
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from dependency_injector.wiring import Provide, inject
+from tabulate import tabulate
+
+from portrait_search.core.config import VectorIndexParams
+from portrait_search.core.enums import DistanceType
+from portrait_search.dependencies import Container
+from portrait_search.embeddings.embedders import Embedder
+from portrait_search.embeddings.entities import EmbeddingRecord, Vectors
+from portrait_search.embeddings.repository import (
+    ChromaEmbeddingRepository,
+    EmbeddingRepository,
+    MongoEmbeddingRepository,
+    NumpyEmbeddingRepository,
+)
+from portrait_search.embeddings.splitters import Splitter
+from portrait_search.embeddings.t2v import query2embeddings
+from portrait_search.quality.dataset import load_dataset
+from portrait_search.quality.judge import EvaluationResult
+from portrait_search.quality.vector_index import evaluate_vector_index
+
+# the similarity retriever searches for 3 times more chunks than the portraits it returns
+SEARCH_LIMIT = 30
+RECALL_TARGET = 0.95
+CHROMA_M = (8, 16, 32)
+CHROMA_CONSTRUCTION_EF = (100, 200)
+CHROMA_SEARCH_EF = (10, 50, 100, 200)
+MONGO_NUM_CANDIDATES_FACTORS = (2, 5, 10, 20, 50)
+
+Evaluate = Callable[[EmbeddingRepository], Awaitable[EvaluationResult]]
+
+
+async def _tune_chroma(
+    records: list[EmbeddingRecord], evaluate: Evaluate, index_params: VectorIndexParams
+) -> list[dict[str, Any]]:
+    # Chroma fixes the parameters when a collection is created, every setting is built from scratch
+    results = []
+    for m, construction_ef, search_ef in product(CHROMA_M, CHROMA_CONSTRUCTION_EF, CHROMA_SEARCH_EF):
+        params = index_params.model_copy(
+            update={"m": m, "construction_ef": construction_ef, "search_ef": search_ef, "collections": {}}
+        )
+        with tempfile.TemporaryDirectory() as temp_dir:
+            repository = ChromaEmbeddingRepository(Path(temp_dir), params)
+            start = time.perf_counter()
+            for i in range(0, len(records), ChromaEmbeddingRepository.MIGRATION_BATCH_SIZE):
+                await repository.insert_many(records[i : i + ChromaEmbeddingRepository.MIGRATION_BATCH_SIZE])
+            build_seconds = time.perf_counter() - start
+            result = await evaluate(repository)
+        results.append(
+            {"M": m, "construction_ef": construction_ef, "search_ef": search_ef, "build s": build_seconds, **result}
+        )
+    return results
+
+
+async def _tune_mongo(repository: MongoEmbeddingRepository, evaluate: Evaluate) -> list[dict[str, Any]]:
+    # numCandidates is a query parameter, the existing index is searched
+    index_params = repository.index_params
+    results = []
+    try:
+        for factor in MONGO_NUM_CANDIDATES_FACTORS:
+            repository.index_params = index_params.model_copy(
+                update={"num_candidates_factor": factor, "collections": {}}
+            )
+            results.append({"numCandidates": SEARCH_LIMIT * factor, **await evaluate(repository)})
+    finally:
+        repository.index_params = index_params
+    return results
+
+
+def _query_vectors(experiment: str, splitter: Splitter, embedder: Embedder) -> Vectors:
+    queries = [query.query for entry in load_dataset(experiment) for query in entry.queries]
+    return np.concatenate([query2embeddings(query, splitter, embedder)[0] for query in queries])
+
+
+@inject
+async def tune_vector_index(
+    embedding_repository: EmbeddingRepository = Provide[Container.embedding_repository],
+    splitter: Splitter = Provide[Container.splitter],
+    embedder: Embedder = Provide[Container.embedder],
+    distance_type: DistanceType = Provide[Container.distance_type],
+    index_params: VectorIndexParams = Provide[Container.config.provided.vector_index],
+    experiment: str = Provide[Container.config.provided.experiment],
+) -> None:
+    if not experiment:
+        raise ValueError("No experiment specified")
+    if isinstance(embedding_repository, NumpyEmbeddingRepository):
+        raise ValueError("NumPy search is exact, there is nothing to tune")
+
+    query_vectors = _query_vectors(experiment, splitter, embedder)
+    records = await embedding_repository.get_by_type(splitter.type, embedder.type)
+    print(f"Searching for {len(query_vectors)} query chunks among {len(records)} embeddings")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        exact_repository = NumpyEmbeddingRepository(Path(temp_dir))
+        await exact_repository.insert_many([record.model_copy() for record in records])
+
+        async def evaluate(repository: EmbeddingRepository) -> EvaluationResult:
+            return await evaluate_vector_index(
+                repository,
+                exact_repository,
+                query_vectors,
+                splitter.type,
+                embedder.type,
+                distance_type,
+                experiment=experiment,
+                limit=SEARCH_LIMIT,
+            )
+
+        if isinstance(embedding_repository, MongoEmbeddingRepository):
+            results = await _tune_mongo(embedding_repository, evaluate)
+        else:
+            results = await _tune_chroma(records, evaluate, index_params)
+
+    print(tabulate(results, headers="keys", tablefmt="grid"))
+    passing = [result for result in results if result["recall@k"] >= RECALL_TARGET]
+    if not passing:
+        print(f"No setting reaches recall@{SEARCH_LIMIT} of {RECALL_TARGET}")
+        return
+    cheapest = min(passing, key=lambda result: result["p99 ms"])
+    print(f"Cheapest setting with recall@{SEARCH_LIMIT} of at least {RECALL_TARGET}:")
+    print(tabulate([cheapest], headers="keys", tablefmt="grid"))
+
+
+if __name__ == "__main__":
+    container = Container()
+    container.init_resources()
+    container.wire(modules=[__name__])
+
+    asyncio.run(tune_vector_index())
@@ -13,6 +13,7 @@ from dependency_injector import providers
 
 from portrait_search.core.mongodb import get_database
 from portrait_search.dependencies import Container
+from portrait_search.embeddings.embedders import EMBEDDERS, PCAEmbedder
 
 
 @pytest.fixture(scope="session")
@@ -25,6 +26,15 @@ def event_loop() -> Generator[asyncio.AbstractEventLoop, Any, Any]:
     loop.close()
 
 
+@pytest.fixture(scope="session")
+def fitted_projections() -> None:
+    # projections are fitted in memory, tests must not load or save them in the local data folder
+    texts = ["an elf druid with a staff", "a dwarf fighter in plate armor", "a halfling bard with a lute"]
+    for embedder in EMBEDDERS.values():
+        if isinstance(embedder, PCAEmbedder):
+            embedder.fit(embedder.embedder.embed(texts))
+
+
 @pytest.fixture
 def temp_folder_path() -> Generator[Path, Any, Any]:
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -2,7 +2,13 @@ import pytest
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from portrait_search.core.config import Config
-from portrait_search.core.mongodb import MongoDBRecord, MongoDBRepository, get_connection
+from portrait_search.core.mongodb import (
+    MongoDBRecord,
+    MongoDBRepository,
+    PyObjectId,
+    RecordsNotFoundError,
+    get_connection,
+)
 
 
 class FakeRecord(MongoDBRecord):
@@ -49,3 +55,36 @@ async def test_get_many(fake_repository: FakeRepository) -> None:
     await fake_repository.delete(new_fake_record2.id)
     assert new_fake_record3.id is not None
     await fake_repository.delete(new_fake_record3.id)
+
+
+async def test_get_by_ids(fake_repository: FakeRepository) -> None:
+    # GIVEN 3 records in the collection
+    new_fake_records = [await fake_repository.insert_one(FakeRecord(some_field=f"some_value_{i}")) for i in range(3)]
+    ids = [record.id for record in new_fake_records if record.id is not None]
+    # WHEN getting records by ids in reversed order
+    records = await fake_repository.get_by_ids(list(reversed(ids)))
+    # THEN records are returned in the requested order
+    assert records == list(reversed(new_fake_records))
+    # WHEN one of the ids does not exist
+    missing_id = PyObjectId()
+    # THEN the missing id is reported
+    with pytest.raises(RecordsNotFoundError) as e:
+        await fake_repository.get_by_ids([ids[0], missing_id])
+    assert e.value.missing_ids == [missing_id]
+    for id in ids:
+        await fake_repository.delete(id)
+
+
+async def test_iter_many(fake_repository: FakeRepository) -> None:
+    # GIVEN 5 records in the collection
+    new_fake_records = [await fake_repository.insert_one(FakeRecord(some_field=f"some_value_{i}")) for i in range(5)]
+    # WHEN iterating records in batches of 2
+    batches = [batch async for batch in fake_repository.iter_many(2)]
+    # THEN records are returned in id order
+    assert batches == [new_fake_records[0:2], new_fake_records[2:4], new_fake_records[4:]]
+    # WHEN iterating after the second record
+    batches = [batch async for batch in fake_repository.iter_many(2, after_id=new_fake_records[1].id)]
+    # THEN only the following records are returned
+    assert batches == [new_fake_records[2:4], new_fake_records[4:]]
+    for record in new_fake_records:
+        await fake_repository.delete(record.id)
@@ -0,0 +1,56 @@
+import threading
+import time
+from unittest.mock import Mock
+
+from portrait_search.core.registry import LazyRegistry
+
+
+def test_value_is_built_on_first_access() -> None:
+    # GIVEN a registry with a registered factory
+    factory = Mock(return_value="value")
+    registry: LazyRegistry[str, str] = LazyRegistry()
+    registry.register("key", factory)
+    # THEN the factory is not called on registration, and the key is listed
+    factory.assert_not_called()
+    assert list(registry) == ["key"]
+    assert "key" in registry
+    assert not registry.is_built("key")
+    # WHEN getting the value twice
+    values = [registry["key"], registry["key"]]
+    # THEN the factory is called once
+    assert values == ["value", "value"]
+    factory.assert_called_once()
+    assert registry.is_built("key")
+
+
+def test_value_is_built_once_across_threads() -> None:
+    # GIVEN a registry with a slow factory
+    calls = []
+
+    def slow_factory() -> object:
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    registry: LazyRegistry[str, object] = LazyRegistry()
+    registry.register("key", slow_factory)
+    # WHEN getting the value from several threads at once
+    values = []
+    threads = [threading.Thread(target=lambda: values.append(registry["key"])) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # THEN the factory is called once and all threads get the same value
+    assert len(calls) == 1
+    assert all(value is values[0] for value in values)
+
+
+def test_factory_can_use_registry() -> None:
+    # GIVEN a factory which wraps another value of the same registry
+    registry: LazyRegistry[str, str] = LazyRegistry()
+    registry.register("base", lambda: "base")
+    registry.register("wrapper", lambda: f"wrapped {registry['base']}")
+    # WHEN getting the wrapper
+    # THEN it is built without a deadlock
+    assert registry["wrapper"] == "wrapped base"
@@ -0,0 +1,140 @@
+from pathlib import Path
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from portrait_search.core.enums import EmbedderType, SplitterType
+from portrait_search.embeddings.cache import EmbeddingCache, SplitCache
+from portrait_search.embeddings.embedders import Embedder
+from portrait_search.embeddings.splitters import Splitter
+
+
+@pytest.fixture
+def embedder_mock() -> Mock:
+    m = Mock(spec=Embedder)
+    m.type = EmbedderType.ALL_MINI_LM_L6_V2
+    m.instructions = ""
+    m.cache_namespace = ""
+    m.embed.side_effect = lambda texts, batch_size=None: np.array(
+        [[len(text), 1.0] for text in texts], dtype=np.float32
+    )
+    return m
+
+
+def test_embed__only_misses_are_embedded(embedder_mock: Mock) -> None:
+    # GIVEN a cache with one embedded text
+    cache = EmbeddingCache(max_size=10)
+    cache.embed(embedder_mock, ["elf"])
+    # WHEN embedding the cached text and a new one
+    embeddings = cache.embed(embedder_mock, ["elf", "dwarf"])
+    # THEN only the new text is embedded by the model
+    embedder_mock.embed.assert_called_with(["dwarf"], None)
+    # THEN embeddings are returned in the original order
+    assert embeddings.tolist() == [[3.0, 1.0], [5.0, 1.0]]
+    # THEN hits and misses are counted
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_embed__key_depends_on_instructions(embedder_mock: Mock) -> None:
+    # GIVEN a cache with one embedded text
+    cache = EmbeddingCache(max_size=10)
+    cache.embed(embedder_mock, ["elf"])
+    # WHEN embedding the same text with other instructions
+    embedder_mock.instructions = "Represent a character:"
+    cache.embed(embedder_mock, ["elf"])
+    # THEN the text is embedded again
+    assert cache.misses == 2
+
+
+def test_embed__key_depends_on_cache_namespace(embedder_mock: Mock) -> None:
+    # GIVEN a cache with one embedded text
+    cache = EmbeddingCache(max_size=10)
+    cache.embed(embedder_mock, ["elf"])
+    # WHEN embedding the same text by an embedder of the same type on another backend
+    embedder_mock.cache_namespace = "onnx-int8-0123456789abcdef"
+    cache.embed(embedder_mock, ["elf"])
+    # THEN the text is embedded again
+    assert cache.misses == 2
+
+
+def test_lru_eviction(embedder_mock: Mock) -> None:
+    # GIVEN a cache of size 2 with 2 texts, the first one used recently
+    cache = EmbeddingCache(max_size=2)
+    cache.embed(embedder_mock, ["elf", "dwarf"])
+    cache.embed(embedder_mock, ["elf"])
+    # WHEN embedding a third text
+    cache.embed(embedder_mock, ["gnome"])
+    # THEN the least recently used text is evicted
+    assert len(cache) == 2
+    assert cache.get(EmbeddingCache.key(embedder_mock, "elf")) is not None
+    assert cache.get(EmbeddingCache.key(embedder_mock, "dwarf")) is None
+
+
+def test_disk_tier_survives_restart(embedder_mock: Mock, temp_folder_path: Path) -> None:
+    # GIVEN a text embedded with an on-disk cache
+    EmbeddingCache(max_size=10, path=temp_folder_path).embed(embedder_mock, ["elf"])
+    # WHEN embedding the text with a new cache over the same folder
+    cache = EmbeddingCache(max_size=10, path=temp_folder_path)
+    embeddings = cache.embed(embedder_mock, ["elf"])
+    # THEN the embedding is read from disk
+    assert embeddings.tolist() == [[3.0, 1.0]]
+    assert embedder_mock.embed.call_count == 1
+    assert (cache.hits, cache.disk_hits, cache.misses) == (1, 1, 0)
+
+
+def test_embed__repeated_texts_are_embedded_once(embedder_mock: Mock) -> None:
+    # GIVEN an empty cache
+    cache = EmbeddingCache(max_size=10)
+    # WHEN embedding a list with repeated texts
+    embeddings = cache.embed(embedder_mock, ["elf", "dwarf", "elf"])
+    # THEN each distinct text is passed to the model once
+    embedder_mock.embed.assert_called_once_with(["elf", "dwarf"], None)
+    assert embeddings.tolist() == [[3.0, 1.0], [5.0, 1.0], [3.0, 1.0]]
+
+
+def test_embed__disk_only_cache(embedder_mock: Mock, temp_folder_path: Path) -> None:
+    # GIVEN a cache without memory tier and more texts on disk than a single sqlite query takes
+    texts = [f"elf {i}" for i in range(1200)]
+    EmbeddingCache(max_size=0, path=temp_folder_path).embed(embedder_mock, texts)
+    # WHEN embedding the texts and a new one with a new cache over the same folder
+    cache = EmbeddingCache(max_size=0, path=temp_folder_path)
+    embeddings = cache.embed(embedder_mock, [*texts, "dwarf"])
+    # THEN only the new text is embedded by the model
+    embedder_mock.embed.assert_called_with(["dwarf"], None)
+    assert embeddings[0].tolist() == [5.0, 1.0]
+    assert (cache.disk_hits, cache.misses) == (1200, 1)
+    assert len(cache) == 0
+
+
+@pytest.fixture
+def splitter_mock() -> Mock:
+    m = Mock(spec=Splitter)
+    m.type = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40
+    m.split.side_effect = lambda text: text.split()
+    return m
+
+
+def test_split__only_misses_are_split(splitter_mock: Mock, temp_folder_path: Path) -> None:
+    # GIVEN a description split with a cache on disk
+    SplitCache(path=temp_folder_path).split(splitter_mock, ["an elf"])
+    splitter_mock.split.reset_mock()
+    # WHEN splitting it again with a new cache over the same folder, together with a new description
+    cache = SplitCache(path=temp_folder_path)
+    splits = cache.split(splitter_mock, ["an elf", "a dwarf"])
+    # THEN only the new description is split
+    splitter_mock.split.assert_called_once_with("a dwarf")
+    # THEN splits are returned in the original order
+    assert splits == [["an", "elf"], ["a", "dwarf"]]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_split__key_depends_on_splitter_type(splitter_mock: Mock) -> None:
+    # GIVEN a cache with one split description
+    cache = SplitCache()
+    cache.split(splitter_mock, ["an elf"])
+    # WHEN splitting it with another splitter
+    splitter_mock.type = SplitterType.COMBINE_LCHUNK_160_O40_AND_LCHUNK_120_O60
+    cache.split(splitter_mock, ["an elf"])
+    # THEN it is split again
+    assert splitter_mock.split.call_count == 2
@@ -1,6 +1,11 @@
+import numpy as np
 import pytest
+from numpy.typing import NDArray
 
-from portrait_search.embeddings.embedders import EMBEDDERS, Embedder
+from portrait_search.core.enums import EmbedderType
+from portrait_search.embeddings.embedders import EMBEDDERS, Embedder, ready_embedder_types
+
+pytestmark = pytest.mark.usefixtures("fitted_projections")
 
 
 @pytest.mark.parametrize("embedder", EMBEDDERS.values(), ids=EMBEDDERS.keys())
@@ -16,14 +21,74 @@ def test_embedders(embedder: Embedder) -> None:
 
 
 @pytest.mark.parametrize("embedder", EMBEDDERS.values(), ids=EMBEDDERS.keys())
-def test_embedders_expected_dimensionality(embedder: Embedder) -> None:
+def test_embedders_expected_dimensionality(embedder: Embedder, monkeypatch: pytest.MonkeyPatch) -> None:
     expected_dimensionality = 2048
     texts = [
         "The character depicted in the image appears to be a female elf, given the pointed ears and slender build. She possesses",  # noqa: E501
         "given the pointed ears and slender build. She possesses a demeanor that suggests a neutral alignment, focused more on",  # noqa: E501
         "demeanor that suggests a neutral alignment, focused more on balance or personal goals than strict adherence to good or",  # noqa: E501
     ]
-    embedder.expected_dimensionality = expected_dimensionality
+    # registered embedders are shared, other tests expect them unchanged
+    monkeypatch.setattr(embedder, "expected_dimensionality", expected_dimensionality)
     embeddings = embedder.embed(texts)
     assert len(embeddings) == len(texts)
     assert all(len(embedding) == expected_dimensionality for embedding in embeddings)
+
+
+def test_ready_embedder_types(monkeypatch: pytest.MonkeyPatch) -> None:
+    # GIVEN a PCA embedder without a fitted projection
+    embedder = EMBEDDERS[EmbedderType.ALL_MINI_LM_L6_V2_PCA_128]
+    monkeypatch.setattr(embedder, "components", None)
+    monkeypatch.setattr(embedder, "path", None)
+    # WHEN listing embedders which can embed
+    # THEN the PCA embedder is skipped, the others are listed
+    assert EmbedderType.ALL_MINI_LM_L6_V2_PCA_128 not in ready_embedder_types()
+    assert EmbedderType.ALL_MINI_LM_L6_V2 in ready_embedder_types()
+    assert EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS_PCA_256 in ready_embedder_types()
+
+
+class RecordingEmbedder(Embedder):
+    def __init__(self, batch_size: int) -> None:
+        super().__init__(batch_size=batch_size)
+        self.batches: list[list[str]] = []
+
+    def _embed(self, texts: list[str]) -> NDArray[np.float_]:
+        self.batches.append(texts)
+        return np.array([[float(len(text))] for text in texts])
+
+
+def test_embed__length_bucketed_batches() -> None:
+    # GIVEN texts of mixed lengths
+    texts = ["a" * 5, "a" * 1, "a" * 4, "a" * 2, "a" * 3]
+    embedder = RecordingEmbedder(batch_size=2)
+    # WHEN embedding the texts
+    embeddings = embedder.embed(texts)
+    # THEN texts of similar length are batched together
+    assert embedder.batches == [["a", "aa"], ["aaa", "aaaa"], ["aaaaa"]]
+    # THEN embeddings are returned in the original order, as float32
+    assert embeddings.tolist() == [[5.0], [1.0], [4.0], [2.0], [3.0]]
+    assert embeddings.dtype == np.float32
+
+
+def test_embed__batch_size_argument() -> None:
+    # GIVEN an embedder with the default batch size
+    embedder = RecordingEmbedder(batch_size=32)
+    # WHEN embedding with a smaller batch size
+    embedder.embed(["a", "b", "c"], batch_size=2)
+    # THEN it is used instead of the default
+    assert [len(batch) for batch in embedder.batches] == [2, 1]
+    # WHEN embedding nothing
+    # THEN the model is not called
+    assert len(embedder.embed([])) == 0
+    assert len(embedder.batches) == 2
+
+
+def test_embed__zero_padding() -> None:
+    # GIVEN an embedder expecting more dimensions than the model returns
+    embedder = RecordingEmbedder(batch_size=2)
+    embedder.expected_dimensionality = 3
+    # WHEN embedding texts
+    embeddings = embedder.embed(["aa", "a", "aaa"])
+    # THEN vectors are padded with zeros
+    assert embeddings.tolist() == [[2.0, 0.0, 0.0], [1.0, 0.0, 0.0], [3.0, 0.0, 0.0]]
+    assert embeddings.dtype == np.float32
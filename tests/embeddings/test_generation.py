@@ -0,0 +1,130 @@
+import queue
+from collections.abc import AsyncIterator, Generator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+from unittest.mock import Mock
+
+import pytest
+from bson import ObjectId
+
+from portrait_search.core.enums import EmbedderType, SplitterType
+from portrait_search.core.mongodb import PyObjectId
+from portrait_search.dependencies import Container
+from portrait_search.embeddings.cache import EmbeddingCache, SplitCache
+from portrait_search.embeddings.embedders import PCAEmbedder
+from portrait_search.embeddings.generation import WorkerMessage, WorkerTask, embed_portraits, embedder_worker
+from portrait_search.embeddings.splitters import SPLITTERS
+from portrait_search.portraits.entities import PortraitRecord
+from portrait_search.portraits.repository import PortraitRepository
+
+
+@pytest.fixture
+def portraits() -> list[Mock]:
+    return [Mock(id=PyObjectId(), description=f"description {i}", spec=PortraitRecord) for i in range(3)]
+
+
+@pytest.fixture
+def portraits_repository_mock(portraits: list[Mock]) -> Mock:
+    async def iter_many(batch_size: int, after_id: ObjectId | None = None) -> AsyncIterator[list[Mock]]:
+        remaining = [p for p in portraits if after_id is None or p.id > after_id]
+        for i in range(0, len(remaining), batch_size):
+            yield remaining[i : i + batch_size]
+
+    m = Mock(spec=PortraitRepository)
+    m.iter_many.side_effect = iter_many
+    return m
+
+
+def run_worker(*args: Any) -> None:
+    # in a thread, the worker runs its own event loop
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(embedder_worker, *args).result()
+
+
+@pytest.fixture(autouse=True)
+def worker_container(portraits_repository_mock: Mock) -> Generator[None, Any, Any]:
+    # the worker builds its own container
+    with (
+        Container.portrait_repository.override(portraits_repository_mock),
+        Container.chunk_embedding_cache.override(EmbeddingCache()),
+        Container.split_cache.override(SplitCache()),
+    ):
+        yield
+
+
+def test_embedder_worker(portraits: list[Mock]) -> None:
+    # GIVEN 2 tasks, the second one resuming after the first portrait
+    splitter_type = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40
+    tasks = [
+        WorkerTask(splitter_type, None, {}),
+        WorkerTask(splitter_type, portraits[0].id, {}),
+    ]
+    results: queue.Queue[WorkerMessage] = queue.Queue()
+    # WHEN the worker runs
+    run_worker(EmbedderType.ALL_MINI_LM_L6_V2, tasks, results, 2, 8)
+    # THEN embeddings are sent in batches of portraits for every task, each task followed by its done message,
+    # the worker by its done message
+    messages = list(results.queue)
+    assert [m.last_portrait_id for m in messages] == [
+        portraits[1].id,
+        portraits[2].id,
+        None,
+        portraits[2].id,
+        None,
+        None,
+    ]
+    assert [{e.portrait_id for e in m.embeddings} for m in messages] == [
+        {portraits[0].id, portraits[1].id},
+        {portraits[2].id},
+        set(),
+        {portraits[1].id, portraits[2].id},
+        set(),
+        set(),
+    ]
+    assert all(m.embedder_type == EmbedderType.ALL_MINI_LM_L6_V2 for m in messages)
+    assert [m.done for m in messages] == [False, False, True, False, True, True]
+    assert [m.splitter_type for m in messages if m.done] == [splitter_type, splitter_type, None]
+
+
+def test_embedder_worker__done_on_error(portraits_repository_mock: Mock) -> None:
+    # GIVEN a failing portrait repository
+    portraits_repository_mock.iter_many.side_effect = RuntimeError("no connection")
+    results: queue.Queue[WorkerMessage] = queue.Queue()
+    # WHEN the worker runs
+    # THEN the error is raised
+    with pytest.raises(RuntimeError):
+        run_worker(
+            EmbedderType.ALL_MINI_LM_L6_V2,
+            [WorkerTask(SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40, None, {})],
+            results,
+            2,
+            8,
+        )
+    # THEN the writer is still notified that the worker is done
+    assert [m.done for m in results.queue] == [True]
+
+
+async def test_embed_portraits__fits_projection(portraits_repository_mock: Mock, temp_folder_path: Path) -> None:
+    # GIVEN a PCA embedder without a projection
+    path = temp_folder_path / "projection.npz"
+    embedder = PCAEmbedder(EmbedderType.ALL_MINI_LM_L6_V2, 2, path)
+    embedder.type = EmbedderType.ALL_MINI_LM_L6_V2_PCA_128
+    # WHEN embedding portraits
+    batches = embed_portraits(
+        SPLITTERS[SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40],
+        embedder,
+        portraits_repository_mock,
+        EmbeddingCache(),
+        {},
+        None,
+        2,
+        8,
+    )
+    embeddings = [embedding async for batch, _, _ in batches for embedding in batch]
+    # THEN the projection is fitted on the corpus and saved
+    assert path.exists()
+    assert PCAEmbedder(EmbedderType.ALL_MINI_LM_L6_V2, 2, path).is_fitted
+    # THEN embeddings are projected
+    assert len(embeddings) == 3
+    assert all(embedding.embedding.shape == (2,) for embedding in embeddings)
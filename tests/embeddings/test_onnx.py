@@ -0,0 +1,44 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("sentence_transformers")
+
+from portrait_search.core.enums import EmbedderType  # noqa: E402
+from portrait_search.embeddings.cache import EmbeddingCache  # noqa: E402
+from portrait_search.embeddings.embedders import EMBEDDERS  # noqa: E402
+from portrait_search.embeddings.onnx import OnnxEmbedder  # noqa: E402
+
+TEXTS = [
+    "A dwarf fighter in heavy plate armor with a warhammer",
+    "Elf wizard, long silver hair, reading a glowing spellbook in a dark library",
+    "halfling bard",
+]
+
+
+@pytest.mark.parametrize(
+    "quantize,min_similarity",
+    [
+        (False, 0.999),
+        (True, 0.98),
+    ],
+)
+def test_onnx_embedder__parity_with_torch(tmp_path: Path, quantize: bool, min_similarity: float) -> None:
+    # GIVEN torch and ONNX embedders of the same model
+    torch_embedder = EMBEDDERS.build_new(EmbedderType.ALL_MINI_LM_L6_V2)
+    onnx_embedder = OnnxEmbedder(EMBEDDERS.build_new(EmbedderType.ALL_MINI_LM_L6_V2), tmp_path, quantize=quantize)
+    # WHEN embedding the same texts
+    expected = np.array(torch_embedder.embed(TEXTS))
+    actual = np.array(onnx_embedder.embed(TEXTS))
+    # THEN embeddings are interchangeable
+    assert onnx_embedder.type == torch_embedder.type
+    assert actual.shape == expected.shape
+    similarity = (actual * expected).sum(axis=1) / (np.linalg.norm(actual, axis=1) * np.linalg.norm(expected, axis=1))
+    assert similarity.min() > min_similarity
+    # THEN the exported model is cached
+    assert onnx_embedder.path.exists()
+    # THEN cached vectors are not shared with the torch embedder
+    assert EmbeddingCache.key(onnx_embedder, TEXTS[0]) != EmbeddingCache.key(torch_embedder, TEXTS[0])
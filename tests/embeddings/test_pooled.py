@@ -0,0 +1,126 @@
+from pathlib import Path
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from portrait_search.core.enums import DistanceType, EmbedderType, SplitterType
+from portrait_search.core.mongodb import PyObjectId
+from portrait_search.embeddings.entities import EmbeddingRecord
+from portrait_search.embeddings.pooled import PooledVectors, PooledVectorStore
+from portrait_search.embeddings.repository import EmbeddingRepository
+
+SPLITTER_TYPE = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60
+EMBEDDER_TYPE = EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS
+
+
+def embedding(portrait_id: PyObjectId, vector: list[float], description_hash: str = "a") -> EmbeddingRecord:
+    return EmbeddingRecord(
+        portrait_id=portrait_id,
+        embedding=np.array(vector, dtype=np.float32),
+        embedded_text="chunk",
+        splitter_type=SPLITTER_TYPE,
+        embedder_type=EMBEDDER_TYPE,
+        description_hash=description_hash,
+    )
+
+
+@pytest.fixture
+def pooled_vectors(temp_folder_path: Path) -> PooledVectors:
+    return PooledVectors(temp_folder_path / "pooled.npz")
+
+
+def test_update__mean_of_chunks(pooled_vectors: PooledVectors) -> None:
+    # GIVEN 2 chunks of one portrait and 1 chunk of another
+    first, second = PyObjectId(), PyObjectId()
+    # WHEN the embeddings are pooled
+    pooled_vectors.update([embedding(first, [1, 0]), embedding(first, [0, 1]), embedding(second, [2, 2])])
+    # THEN every portrait has the mean of its chunks
+    assert len(pooled_vectors) == 2
+    assert np.allclose(pooled_vectors.vectors[first], [0.5, 0.5])
+    assert np.allclose(pooled_vectors.vectors[second], [2, 2])
+
+
+@pytest.mark.parametrize("distance_type", DistanceType)
+def test_search(distance_type: DistanceType, pooled_vectors: PooledVectors) -> None:
+    # GIVEN 3 portraits pointing in different directions
+    portrait_ids = [PyObjectId() for _ in range(3)]
+    pooled_vectors.update(
+        [
+            embedding(portrait_ids[0], [1, 0, 0]),
+            embedding(portrait_ids[1], [0, 1, 0]),
+            embedding(portrait_ids[2], [0, 0, 1]),
+        ]
+    )
+    # WHEN searching for 2 portraits with query chunks close to the first and the third
+    query_vectors = np.array([[0.9, 0.1, 0], [0, 0.2, 0.8]], dtype=np.float32)
+    shortlist = pooled_vectors.search(query_vectors, distance_type, limit=2)
+    # THEN the portraits close to any query chunk are shortlisted, best first
+    assert shortlist == [portrait_ids[0], portrait_ids[2]]
+
+
+def test_search__portrait_ids(pooled_vectors: PooledVectors) -> None:
+    # GIVEN 3 portraits, the first one closest to the query
+    portrait_ids = [PyObjectId() for _ in range(3)]
+    pooled_vectors.update(
+        [
+            embedding(portrait_ids[0], [1, 0]),
+            embedding(portrait_ids[1], [0.6, 0.8]),
+            embedding(portrait_ids[2], [0, 1]),
+        ]
+    )
+    # WHEN searching among the last 2 portraits
+    shortlist = pooled_vectors.search(
+        np.array([[1, 0]], dtype=np.float32), DistanceType.COSINE, limit=1, portrait_ids=set(portrait_ids[1:])
+    )
+    # THEN the closest of them is shortlisted
+    assert shortlist == [portrait_ids[1]]
+
+
+def test_save__reloaded(pooled_vectors: PooledVectors) -> None:
+    # GIVEN 2 pooled portraits, one of which is removed
+    kept, removed = PyObjectId(), PyObjectId()
+    pooled_vectors.update([embedding(kept, [1, 2], "hash"), embedding(removed, [3, 4])])
+    pooled_vectors.remove({removed})
+    # WHEN the pooled vectors are saved and loaded again
+    pooled_vectors.save()
+    reloaded = PooledVectors(pooled_vectors.path)
+    # THEN only the kept portrait is loaded, with its description hash
+    assert list(reloaded.vectors) == [kept]
+    assert np.allclose(reloaded.vectors[kept], [1, 2])
+    assert reloaded.description_hashes == {kept: "hash"}
+
+
+async def test_sync(pooled_vectors: PooledVectors) -> None:
+    # GIVEN a pooled portrait with a changed description, an unchanged one and a deleted one
+    changed, unchanged, deleted, new = PyObjectId(), PyObjectId(), PyObjectId(), PyObjectId()
+    pooled_vectors.update([embedding(changed, [1, 1]), embedding(unchanged, [2, 2]), embedding(deleted, [3, 3])])
+    # GIVEN stored embeddings of the changed portrait and a portrait which is not pooled yet
+    embedding_repository_mock = Mock(spec=EmbeddingRepository)
+    embedding_repository_mock.get_by_portrait_ids.return_value = [
+        embedding(changed, [5, 5], "b"),
+        embedding(new, [6, 6], "b"),
+    ]
+    # WHEN the pooled vectors are synced with description hashes of stored embeddings
+    await pooled_vectors.sync(
+        embedding_repository_mock, SPLITTER_TYPE, EMBEDDER_TYPE, {changed: "b", unchanged: "a", new: "b"}
+    )
+    # THEN only embeddings of the changed and new portraits are fetched and pooled
+    assert set(embedding_repository_mock.get_by_portrait_ids.call_args[0][2]) == {changed, new}
+    assert np.allclose(pooled_vectors.vectors[changed], [5, 5])
+    assert np.allclose(pooled_vectors.vectors[unchanged], [2, 2])
+    # THEN the deleted portrait is removed
+    assert set(pooled_vectors.vectors) == {changed, unchanged, new}
+
+
+def test_store__reloads_rewritten_file(temp_folder_path: Path) -> None:
+    # GIVEN pooled vectors loaded by one store
+    store = PooledVectorStore(temp_folder_path)
+    assert len(store.get(SPLITTER_TYPE, EMBEDDER_TYPE, None)) == 0
+    # WHEN another store, as in another process, saves pooled vectors for the same types
+    writer = PooledVectorStore(temp_folder_path).get(SPLITTER_TYPE, EMBEDDER_TYPE, None)
+    writer.update([embedding(PyObjectId(), [1, 2])])
+    writer.save()
+    # THEN the first store loads them, pooled vectors of other experiments are separate
+    assert len(store.get(SPLITTER_TYPE, EMBEDDER_TYPE, None)) == 1
+    assert len(store.get(SPLITTER_TYPE, EMBEDDER_TYPE, "test")) == 0
@@ -3,14 +3,23 @@ from collections.abc import AsyncGenerator, Generator
 from itertools import product
 from pathlib import Path
 from typing import Any
+from unittest.mock import Mock
 
+import bson
+import numpy as np
 import pytest
 
+from portrait_search.core.config import VectorIndexParams
 from portrait_search.core.enums import DistanceType, EmbedderType, SplitterType
 from portrait_search.core.mongodb import PyObjectId
 from portrait_search.dependencies import Container
 from portrait_search.embeddings.entities import EmbeddingRecord
-from portrait_search.embeddings.repository import ChromaEmbeddingRepository, MongoEmbeddingRepository
+from portrait_search.embeddings.repository import (
+    BSON_VECTOR_SUBTYPE,
+    ChromaEmbeddingRepository,
+    MongoEmbeddingRepository,
+    NumpyEmbeddingRepository,
+)
 
 
 @pytest.fixture
@@ -18,14 +27,15 @@ def embedding_records_for_test() -> list[EmbeddingRecord]:
     records = [
         EmbeddingRecord(
             portrait_id=PyObjectId(),
-            embedding=[1, 2, 3],
+            embedding=np.array([1, 2, 3], dtype=np.float32),
             embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
             splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
             embedded_text="spaghetti",
+            description_hash="a" * 64,
         ),
         EmbeddingRecord(
             portrait_id=PyObjectId(),
-            embedding=[-1, -2, -3],
+            embedding=np.array([-1, -2, -3], dtype=np.float32),
             embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
             splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
             embedded_text="not spaghetti",
@@ -50,19 +60,30 @@ class TestChromaEmbeddingRepository:
         records_new = await embedding_repository.insert_many(embedding_records_for_test)
         yield records_new
 
-    @pytest.mark.parametrize(
-        "embedder_type, splitter_type, similarity_type", product(EmbedderType, SplitterType, DistanceType)
-    )
+    @pytest.mark.parametrize("embedder_type, splitter_type", product(EmbedderType, SplitterType))
     def test_get_collection(
         self,
         embedder_type: EmbedderType,
         splitter_type: SplitterType,
-        similarity_type: DistanceType,
         embedding_repository: ChromaEmbeddingRepository,
     ) -> None:
-        collection = embedding_repository.get_collection(splitter_type, embedder_type, similarity_type)
+        collection = embedding_repository.get_collection(splitter_type, embedder_type)
         assert collection is not None
 
+    async def test_insert_many__single_collection(
+        self, embedding_repository: ChromaEmbeddingRepository, existing_embedding_records: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        _ = existing_embedding_records
+        # WHEN listing collections
+        collections = embedding_repository.client.list_collections()
+        # THEN embeddings are stored once, normalized, with their norms
+        assert len(collections) == 1
+        stored = collections[0].get(include=["embeddings", "metadatas"])
+        assert stored["embeddings"] is not None and stored["metadatas"] is not None
+        assert np.allclose(np.linalg.norm(stored["embeddings"], axis=1), 1)
+        assert [metadata["norm"] for metadata in stored["metadatas"]] == pytest.approx([14**0.5, 14**0.5])
+
     async def test_get_by_type(
         self, embedding_repository: ChromaEmbeddingRepository, existing_embedding_records: list[EmbeddingRecord]
     ) -> None:
@@ -78,6 +99,83 @@ class TestChromaEmbeddingRepository:
         assert embeddings[0] == existing_embedding_records[0]
         assert embeddings[1] == existing_embedding_records[1]
 
+    async def test_delete_by_portrait_ids(
+        self, embedding_repository: ChromaEmbeddingRepository, existing_embedding_records: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        splitter_type = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60
+        embedder_type = EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS
+        deleted, kept = existing_embedding_records
+        # WHEN deleting embeddings of the first portrait
+        await embedding_repository.delete_by_portrait_ids(splitter_type, embedder_type, {deleted.portrait_id})
+        # THEN only embeddings of the second portrait are left
+        assert await embedding_repository.get_by_type(splitter_type, embedder_type) == [kept]
+        assert await embedding_repository.get_description_hashes(splitter_type, embedder_type) == {
+            kept.portrait_id: kept.description_hash
+        }
+
+    @pytest.mark.parametrize("distance_type", DistanceType)
+    async def test_vector_search__portrait_ids(
+        self,
+        distance_type: DistanceType,
+        embedding_repository: ChromaEmbeddingRepository,
+        existing_embedding_records: list[EmbeddingRecord],
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        _, not_spaghetti = existing_embedding_records
+        # WHEN searching among embeddings of the second portrait only
+        embedding_similarities = await embedding_repository.vector_search(
+            query_vector=np.array([1, 2, 3], dtype=np.float32),
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+            distance_type=distance_type,
+            portrait_ids={not_spaghetti.portrait_id},
+        )
+        # THEN only its embedding is found, although the other one is more similar
+        assert [similarity.embedded_text for similarity in embedding_similarities] == ["not spaghetti"]
+        # THEN nothing is found among no portraits
+        assert not await embedding_repository.vector_search(
+            query_vector=np.array([1, 2, 3], dtype=np.float32),
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+            distance_type=distance_type,
+            portrait_ids=set(),
+        )
+
+    async def test_get_by_portrait_ids(
+        self, embedding_repository: ChromaEmbeddingRepository, existing_embedding_records: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        splitter_type = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60
+        embedder_type = EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS
+        first, _ = existing_embedding_records
+        # WHEN getting embeddings of the first portrait
+        embeddings = await embedding_repository.get_by_portrait_ids(splitter_type, embedder_type, [first.portrait_id])
+        # THEN only its embeddings are returned
+        assert embeddings == [first]
+        # THEN none are returned for another experiment
+        assert not await embedding_repository.get_by_portrait_ids(
+            splitter_type, embedder_type, [first.portrait_id], experiment="test"
+        )
+
+    async def test_get_embedded_portrait_ids(
+        self, embedding_repository: ChromaEmbeddingRepository, existing_embedding_records: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        # WHEN getting ids of embedded portraits
+        portrait_ids = await embedding_repository.get_embedded_portrait_ids(
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        )
+        # THEN both portraits are returned
+        assert portrait_ids == {record.portrait_id for record in existing_embedding_records}
+        # THEN no portraits are returned for another experiment
+        assert not await embedding_repository.get_embedded_portrait_ids(
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+            experiment="test",
+        )
+
     @pytest.mark.parametrize("distance_type", DistanceType)
     async def test_vector_search(
         self,
@@ -89,7 +187,7 @@ class TestChromaEmbeddingRepository:
         _ = existing_embedding_records
         # WHEN searching for similar embeddings
         embedding_similarities = await embedding_repository.vector_search(
-            query_vector=[1, 1, 1],
+            query_vector=np.array([1, 1, 1], dtype=np.float32),
             splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
             embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
             distance_type=distance_type,
@@ -101,6 +199,438 @@ class TestChromaEmbeddingRepository:
         # THEN the first one is spaghetti
         assert embedding_similarities[0].embedded_text == "spaghetti"
 
+    @pytest.mark.parametrize("distance_type", DistanceType)
+    async def test_vector_search_many(
+        self,
+        distance_type: DistanceType,
+        embedding_repository: ChromaEmbeddingRepository,
+        existing_embedding_records: list[EmbeddingRecord],
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        _ = existing_embedding_records
+        # WHEN searching for similar embeddings for 2 query vectors at once
+        embedding_similarities = await embedding_repository.vector_search_many(
+            query_vectors=np.array([[1, 1, 1], [-1, -1, -1]], dtype=np.float32),
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+            distance_type=distance_type,
+        )
+
+        # THEN found 2 embedding similarities for each query vector
+        assert [len(similarities) for similarities in embedding_similarities] == [2, 2]
+
+        # THEN the first one is spaghetti for the first query and not spaghetti for the second
+        assert embedding_similarities[0][0].embedded_text == "spaghetti"
+        assert embedding_similarities[0][0].query is not None
+        assert embedding_similarities[0][0].query.tolist() == [1, 1, 1]
+        assert embedding_similarities[1][0].embedded_text == "not spaghetti"
+        assert embedding_similarities[1][0].query is not None
+        assert embedding_similarities[1][0].query.tolist() == [-1, -1, -1]
+
+    @pytest.mark.parametrize(
+        "distance_type, expected_similarities",
+        [
+            # the higher the better, as on every backend
+            (DistanceType.COSINE, [6 / (42**0.5), -6 / (42**0.5)]),
+            (DistanceType.DOT_PRODUCT, [12, -12]),
+            (DistanceType.EUCLIDEAN, [1 / (1 + 2**0.5), 1 / (1 + 50**0.5)]),
+        ],
+    )
+    async def test_vector_search__similarities(
+        self,
+        distance_type: DistanceType,
+        expected_similarities: list[float],
+        embedding_repository: ChromaEmbeddingRepository,
+        existing_embedding_records: list[EmbeddingRecord],
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        # WHEN searching with a query vector which is not normalized
+        embedding_similarities = await embedding_repository.vector_search(
+            query_vector=np.array([1, 1, 1], dtype=np.float32) * 2,
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+            distance_type=distance_type,
+        )
+        # THEN similarities are derived from the normalized embeddings and the norms
+        assert [s.similarity for s in embedding_similarities] == pytest.approx(expected_similarities, rel=1e-4)
+        # THEN the original embeddings are returned
+        assert embedding_similarities[0].embedding == pytest.approx(existing_embedding_records[0].embedding, rel=1e-5)
+
+    async def test_migrate_legacy_collections(
+        self, embedding_repository: ChromaEmbeddingRepository, embedding_records_for_test: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN embeddings replicated across legacy collections, one per distance type
+        for record in embedding_records_for_test:
+            record.id = PyObjectId()
+        for space in ChromaEmbeddingRepository.LEGACY_SPACES:
+            collection = embedding_repository.client.create_collection(
+                f"e-langchainRec120o60-instrLargePFChar-{space}", metadata={"hnsw:space": space}
+            )
+            collection.add(
+                ids=[str(record.id) for record in embedding_records_for_test],
+                documents=[record.embedded_text for record in embedding_records_for_test],
+                embeddings=[record.embedding.tolist() for record in embedding_records_for_test],
+                metadatas=[
+                    {"portrait_id": str(record.portrait_id), "experiment": ""} for record in embedding_records_for_test
+                ],
+            )
+
+        # WHEN migrating them
+        migrated = embedding_repository.migrate_legacy_collections()
+
+        # THEN only the new collection is left
+        assert migrated == {"e-langchainRec120o60-instrLargePFChar": 2}
+        assert [c.name for c in embedding_repository.client.list_collections()] == [
+            "e-langchainRec120o60-instrLargePFChar"
+        ]
+        # THEN embeddings are the same as before
+        embeddings = await embedding_repository.get_by_type(
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        )
+        embeddings_by_id = {e.id: e for e in embeddings}
+        for record in embedding_records_for_test:
+            assert embeddings_by_id[record.id].embedded_text == record.embedded_text
+            assert np.allclose(embeddings_by_id[record.id].embedding, record.embedding)
+        # THEN rerunning the migration is a no-op
+        assert embedding_repository.migrate_legacy_collections() == {}
+
+    def test_get_collection__index_params(self, embedding_repository: ChromaEmbeddingRepository) -> None:
+        # GIVEN HNSW parameters with an override for one collection
+        embedding_repository.index_params = VectorIndexParams(
+            search_ef=50,
+            collections={
+                f"{SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60}/"
+                f"{EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS}": {"m": 32}
+            },
+        )
+        # WHEN collections are created
+        overridden = embedding_repository.get_collection(
+            SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        )
+        other = embedding_repository.get_collection(
+            SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40,
+            EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        )
+        # THEN they are created with the parameters of the collection
+        assert overridden.metadata == {
+            "hnsw:space": "ip",
+            "hnsw:construction_ef": 100,
+            "hnsw:search_ef": 50,
+            "hnsw:M": 32,
+        }
+        assert other.metadata == {"hnsw:space": "ip", "hnsw:construction_ef": 100, "hnsw:search_ef": 50, "hnsw:M": 16}
+
+    async def test_rebuild_stale_collections(
+        self, embedding_repository: ChromaEmbeddingRepository, existing_embedding_records: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN 2 test records added to a collection with the default HNSW parameters
+        # THEN nothing is rebuilt while the parameters are the same
+        assert embedding_repository.rebuild_stale_collections() == {}
+
+        # WHEN the parameters change and the collections are rebuilt
+        embedding_repository.index_params = VectorIndexParams(construction_ef=200, search_ef=50)
+        rebuilt = embedding_repository.rebuild_stale_collections()
+
+        # THEN the collection is rebuilt with the new parameters
+        assert rebuilt == {"e-langchainRec120o60-instrLargePFChar": 2}
+        collection = embedding_repository.get_collection(
+            SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        )
+        assert collection.metadata is not None
+        assert collection.metadata["hnsw:construction_ef"] == 200
+        assert collection.metadata["hnsw:search_ef"] == 50
+        assert [c.name for c in embedding_repository.client.list_collections()] == [collection.name]
+        # THEN embeddings are the same as before
+        embeddings = await embedding_repository.get_by_type(
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        )
+        embeddings_by_id = {e.id: e for e in embeddings}
+        for record in existing_embedding_records:
+            assert np.allclose(embeddings_by_id[record.id].embedding, record.embedding)
+        # THEN rerunning the rebuild is a no-op
+        assert embedding_repository.rebuild_stale_collections() == {}
+
+
+class TestNumpyEmbeddingRepository:
+    @pytest.fixture
+    def databases_path(self) -> Generator[Path, Any, Any]:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            yield Path(temp_dir)
+
+    @pytest.fixture
+    def embedding_repository(self, databases_path: Path) -> NumpyEmbeddingRepository:
+        return NumpyEmbeddingRepository(databases_path=databases_path)
+
+    @pytest.fixture
+    async def existing_embedding_records(
+        self, embedding_records_for_test: list[EmbeddingRecord], embedding_repository: NumpyEmbeddingRepository
+    ) -> AsyncGenerator[list[EmbeddingRecord], None]:
+        records_new = await embedding_repository.insert_many(embedding_records_for_test)
+        yield records_new
+
+    async def test_get_by_type(
+        self, embedding_repository: NumpyEmbeddingRepository, existing_embedding_records: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        # WHEN getting embeddings by their type
+        embeddings = await embedding_repository.get_by_type(
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        )
+        # THEN embeddings are the same as the test records
+        assert embeddings == existing_embedding_records
+
+    async def test_delete_by_portrait_ids(
+        self, embedding_repository: NumpyEmbeddingRepository, existing_embedding_records: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        splitter_type = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60
+        embedder_type = EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS
+        deleted, kept = existing_embedding_records
+        # WHEN deleting embeddings of the first portrait
+        await embedding_repository.delete_by_portrait_ids(splitter_type, embedder_type, {deleted.portrait_id})
+        # THEN only embeddings of the second portrait are left
+        assert await embedding_repository.get_by_type(splitter_type, embedder_type) == [kept]
+        assert await embedding_repository.get_description_hashes(splitter_type, embedder_type) == {
+            kept.portrait_id: kept.description_hash
+        }
+
+    @pytest.mark.parametrize("distance_type", DistanceType)
+    async def test_vector_search__portrait_ids(
+        self,
+        distance_type: DistanceType,
+        embedding_repository: NumpyEmbeddingRepository,
+        existing_embedding_records: list[EmbeddingRecord],
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        _, not_spaghetti = existing_embedding_records
+        # WHEN searching among embeddings of the second portrait only
+        embedding_similarities = await embedding_repository.vector_search(
+            query_vector=np.array([1, 2, 3], dtype=np.float32),
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+            distance_type=distance_type,
+            portrait_ids={not_spaghetti.portrait_id},
+        )
+        # THEN only its embedding is found, although the other one is more similar
+        assert [similarity.embedded_text for similarity in embedding_similarities] == ["not spaghetti"]
+        # THEN nothing is found among no portraits
+        assert not await embedding_repository.vector_search(
+            query_vector=np.array([1, 2, 3], dtype=np.float32),
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+            distance_type=distance_type,
+            portrait_ids=set(),
+        )
+
+    async def test_get_by_portrait_ids(
+        self, embedding_repository: NumpyEmbeddingRepository, existing_embedding_records: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        splitter_type = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60
+        embedder_type = EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS
+        first, _ = existing_embedding_records
+        # WHEN getting embeddings of the first portrait
+        embeddings = await embedding_repository.get_by_portrait_ids(splitter_type, embedder_type, [first.portrait_id])
+        # THEN only its embeddings are returned
+        assert embeddings == [first]
+        # THEN none are returned for another experiment
+        assert not await embedding_repository.get_by_portrait_ids(
+            splitter_type, embedder_type, [first.portrait_id], experiment="test"
+        )
+
+    async def test_get_embedded_portrait_ids(
+        self, embedding_repository: NumpyEmbeddingRepository, existing_embedding_records: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        # WHEN getting ids of embedded portraits
+        portrait_ids = await embedding_repository.get_embedded_portrait_ids(
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        )
+        # THEN both portraits are returned
+        assert portrait_ids == {record.portrait_id for record in existing_embedding_records}
+        # THEN no portraits are returned for another experiment
+        assert not await embedding_repository.get_embedded_portrait_ids(
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+            experiment="test",
+        )
+
+    async def test_get_by_type__reopened(
+        self, databases_path: Path, existing_embedding_records: list[EmbeddingRecord]
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        # WHEN getting embeddings from a new repository over the same files
+        embeddings = await NumpyEmbeddingRepository(databases_path=databases_path).get_by_type(
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+        )
+        # THEN embeddings are the same as the test records
+        assert embeddings == existing_embedding_records
+
+    async def test_get_by_type__written_by_another_process(
+        self,
+        databases_path: Path,
+        embedding_repository: NumpyEmbeddingRepository,
+        embedding_records_for_test: list[EmbeddingRecord],
+    ) -> None:
+        # GIVEN a collection opened with one record
+        splitter_type = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60
+        embedder_type = EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS
+        first, second = embedding_records_for_test
+        await embedding_repository.insert_many([first])
+        assert len(await embedding_repository.get_by_type(splitter_type, embedder_type)) == 1
+        # WHEN another repository over the same files, as of a generation script, inserts a record
+        await NumpyEmbeddingRepository(databases_path=databases_path).insert_many([second])
+        # THEN the collection is reopened and both records are found
+        embeddings = await embedding_repository.get_by_type(splitter_type, embedder_type)
+        assert [embedding.id for embedding in embeddings] == [first.id, second.id]
+        # THEN an unchanged collection is not reopened
+        collection = embedding_repository.get_collection(splitter_type, embedder_type)
+        assert embedding_repository.get_collection(splitter_type, embedder_type) is collection
+
+    async def test_insert_many__after_interrupted_append(
+        self,
+        databases_path: Path,
+        embedding_repository: NumpyEmbeddingRepository,
+        embedding_records_for_test: list[EmbeddingRecord],
+    ) -> None:
+        # GIVEN a stored record and an append interrupted after writing the rows but before meta.json
+        splitter_type = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60
+        embedder_type = EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS
+        stored, crashed = embedding_records_for_test
+        await embedding_repository.insert_many([stored])
+        collection = embedding_repository.get_collection(splitter_type, embedder_type)
+        meta = (collection.path / "meta.json").read_text()
+        crashed.id = PyObjectId()
+        collection.append([crashed])
+        (collection.path / "meta.json").write_text(meta)
+        # WHEN another record is inserted by a new repository
+        inserted = stored.model_copy(update={"embedding": np.array([4, 5, 6], dtype=np.float32), "embedded_text": "c"})
+        repository = NumpyEmbeddingRepository(databases_path=databases_path)
+        await repository.insert_many([inserted])
+        # THEN the rows of the interrupted append are dropped and the inserted record is read back as is
+        embeddings = await repository.get_by_type(splitter_type, embedder_type)
+        assert [embedding.embedded_text for embedding in embeddings] == ["spaghetti", "c"]
+        assert embeddings[1] == inserted
+
+    @pytest.mark.parametrize("distance_type", DistanceType)
+    async def test_vector_search_many(
+        self,
+        distance_type: DistanceType,
+        embedding_repository: NumpyEmbeddingRepository,
+        existing_embedding_records: list[EmbeddingRecord],
+    ) -> None:
+        # GIVEN 2 test records added to embeddings collection
+        _ = existing_embedding_records
+        # WHEN searching for similar embeddings for 2 query vectors at once
+        embedding_similarities = await embedding_repository.vector_search_many(
+            query_vectors=np.array([[1, 1, 1], [-1, -1, -1]], dtype=np.float32),
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+            distance_type=distance_type,
+        )
+
+        # THEN found 2 embedding similarities for each query vector, sorted by similarity
+        assert [len(similarities) for similarities in embedding_similarities] == [2, 2]
+        assert all(s[0].similarity > s[1].similarity for s in embedding_similarities)
+
+        # THEN the first one is spaghetti for the first query and not spaghetti for the second
+        assert embedding_similarities[0][0].embedded_text == "spaghetti"
+        assert embedding_similarities[1][0].embedded_text == "not spaghetti"
+
+    async def test_vector_search__limit_and_experiment(
+        self,
+        embedding_repository: NumpyEmbeddingRepository,
+        embedding_records_for_test: list[EmbeddingRecord],
+    ) -> None:
+        # GIVEN 2 test records of the experiment and 1 record without an experiment
+        for record in embedding_records_for_test:
+            record.experiment = "test"
+        await embedding_repository.insert_many(embedding_records_for_test)
+        await embedding_repository.insert_many(
+            [embedding_records_for_test[0].model_copy(update={"experiment": None, "embedded_text": "no experiment"})]
+        )
+        # WHEN searching for the most similar embedding of the experiment
+        embedding_similarities = await embedding_repository.vector_search(
+            query_vector=np.array([1, 2, 3], dtype=np.float32),
+            splitter_type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60,
+            embedder_type=EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS,
+            distance_type=DistanceType.COSINE,
+            experiment="test",
+            limit=1,
+        )
+        # THEN only spaghetti of the experiment is found
+        assert len(embedding_similarities) == 1
+        assert embedding_similarities[0].embedded_text == "spaghetti"
+        assert embedding_similarities[0].similarity == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("distance_type", DistanceType)
+async def test_vector_search__same_similarities_on_every_backend(distance_type: DistanceType) -> None:
+    # GIVEN embeddings in the direction of the query, orthogonal and opposite to it, stored in Chroma and NumPy
+    splitter_type = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60
+    embedder_type = EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS
+    records = [
+        EmbeddingRecord(
+            portrait_id=PyObjectId(),
+            embedding=np.array(vector, dtype=np.float32),
+            embedder_type=embedder_type,
+            splitter_type=splitter_type,
+            embedded_text=text,
+        )
+        for text, vector in [("same", [2, 0, 0]), ("orthogonal", [0, 1, 0]), ("opposite", [-3, 0, 0])]
+    ]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        repositories = [ChromaEmbeddingRepository(Path(temp_dir)), NumpyEmbeddingRepository(Path(temp_dir))]
+        # WHEN searching every backend
+        results = []
+        for repository in repositories:
+            await repository.insert_many([record.model_copy() for record in records])
+            similarities = await repository.vector_search(
+                np.array([1, 0, 0], dtype=np.float32), splitter_type, embedder_type, distance_type, limit=3
+            )
+            results.append([(similarity.embedded_text, similarity.similarity) for similarity in similarities])
+    # THEN the backends rank the embeddings the same, the most similar first, with the same similarities
+    chroma, numpy = results
+    assert [text for text, _ in chroma] == [text for text, _ in numpy] == ["same", "orthogonal", "opposite"]
+    assert [similarity for _, similarity in chroma] == pytest.approx([similarity for _, similarity in numpy])
+
+
+@pytest.mark.parametrize("binary_vectors", [False, True])
+def test_mongo_entity_roundtrip(binary_vectors: bool, embedding_records_for_test: list[EmbeddingRecord]) -> None:
+    # GIVEN a Mongo repository storing vectors as arrays of doubles or packed float32
+    embedding_repository = MongoEmbeddingRepository(Mock(), binary_vectors=binary_vectors)
+    record = embedding_records_for_test[0]
+    record.id = PyObjectId()
+    # WHEN a record is written to BSON and read back
+    entity = bson.decode(bson.encode({"_id": record.id, **embedding_repository._to_entity(record)}))
+    read_record = embedding_repository._from_entity(entity)
+    # THEN the record is the same
+    assert read_record == record
+    assert read_record.embedding.dtype == np.float32
+
+
+def test_mongo_binary_vectors(embedding_records_for_test: list[EmbeddingRecord]) -> None:
+    # GIVEN a 768-dimensional record
+    record = embedding_records_for_test[0]
+    record.embedding = np.random.default_rng(0).normal(size=768).astype(np.float32)
+    # WHEN it is encoded with packed float32 vectors and with arrays of doubles
+    binary_entity = bson.encode(MongoEmbeddingRepository(Mock(), binary_vectors=True)._to_entity(record))
+    array_entity = bson.encode(MongoEmbeddingRepository(Mock())._to_entity(record))
+    # THEN the packed vector takes 4 bytes per dimension
+    assert len(binary_entity) < len(array_entity) / 2
+    assert bson.decode(binary_entity)["embedding"].subtype == BSON_VECTOR_SUBTYPE
+    # THEN both formats are read by any repository
+    for entity in (binary_entity, array_entity):
+        read_record = MongoEmbeddingRepository(Mock())._from_entity(bson.decode(entity))
+        assert np.array_equal(read_record.embedding, record.embedding)
+
 
 class TestMongoEmbeddingRepository:
     pytestmark = pytest.mark.usefixtures("inject_mongodb_database_for_test")
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from portrait_search.core.enums import EmbedderType
+from portrait_search.embeddings.cache import EmbeddingCache
+from portrait_search.embeddings.embedders import Embedder
+from portrait_search.embeddings.entities import Vectors
+from portrait_search.embeddings.service import BatchingEmbeddingService
+
+
+@pytest.fixture
+def embedder_mock() -> Mock:
+    m = Mock(spec=Embedder)
+    m.type = EmbedderType.ALL_MINI_LM_L6_V2
+    m.instructions = ""
+    m.embed.side_effect = lambda texts, batch_size=None: np.array([[len(text)] for text in texts], dtype=np.float32)
+    return m
+
+
+async def test_embed__concurrent_requests_are_batched(embedder_mock: Mock) -> None:
+    # GIVEN an embedding service waiting up to 50ms for a batch
+    service = BatchingEmbeddingService(embedder_mock, max_batch_size=32, max_wait_ms=50)
+    # WHEN 3 requests are made concurrently
+    results = await asyncio.gather(
+        service.embed(["elf"]),
+        service.embed(["dwarf", "gnome"]),
+        service.embed(["halfling"]),
+    )
+    # THEN the model is called once with all texts
+    embedder_mock.embed.assert_called_once_with(["elf", "dwarf", "gnome", "halfling"])
+    # THEN each caller gets its own embeddings
+    assert [result.tolist() for result in results] == [[[3.0]], [[5.0], [5.0]], [[8.0]]]
+    await service.close()
+
+
+async def test_embed__max_batch_size(embedder_mock: Mock) -> None:
+    # GIVEN an embedding service with batches of 2 texts
+    service = BatchingEmbeddingService(embedder_mock, max_batch_size=2, max_wait_ms=50)
+    # WHEN 3 requests are made concurrently
+    await asyncio.gather(*(service.embed([text]) for text in ["elf", "dwarf", "gnome"]))
+    # THEN the model is called twice
+    assert service.batches == 2
+    await service.close()
+
+
+async def test_embed__error_is_propagated(embedder_mock: Mock) -> None:
+    # GIVEN an embedder which fails
+    embedder_mock.embed.side_effect = RuntimeError("out of memory")
+    service = BatchingEmbeddingService(embedder_mock, max_wait_ms=1)
+    # WHEN embedding
+    # THEN the error is raised to the caller
+    with pytest.raises(RuntimeError, match="out of memory"):
+        await service.embed(["elf"])
+    await service.close()
+
+
+async def test_embed__cached_texts_skip_model(embedder_mock: Mock) -> None:
+    # GIVEN an embedding service with a cache which has one of the texts
+    cache = EmbeddingCache()
+    cache.embed(embedder_mock, ["elf"])
+    service = BatchingEmbeddingService(embedder_mock, cache=cache, max_wait_ms=1)
+    # WHEN embedding the cached text and a new one
+    result = await service.embed(["elf", "dwarf"])
+    # THEN only the new text is embedded by the model
+    embedder_mock.embed.assert_called_with(["dwarf"])
+    assert result.tolist() == [[3.0], [5.0]]
+    await service.close()
+
+
+async def test_embed__disk_cache_read_off_the_event_loop(embedder_mock: Mock, temp_folder_path: Path) -> None:
+    # GIVEN an embedding service with a disk cache which has one of the texts, not in memory
+    EmbeddingCache(path=temp_folder_path).embed(embedder_mock, ["elf"])
+    cache = EmbeddingCache(path=temp_folder_path)
+    threads = []
+    get_many = cache.get_many
+
+    def recording_get_many(keys: list[str]) -> list[Vectors | None]:
+        threads.append(threading.current_thread())
+        return get_many(keys)
+
+    cache.get_many = recording_get_many  # type: ignore[method-assign]
+    service = BatchingEmbeddingService(embedder_mock, cache=cache, max_wait_ms=1)
+    # WHEN embedding the cached text and a new one
+    result = await service.embed(["elf", "dwarf"])
+    # THEN the disk tier is read once, in the worker thread
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+    # THEN only the new text is embedded by the model
+    embedder_mock.embed.assert_called_with(["dwarf"])
+    assert result.tolist() == [[3.0], [5.0]]
+    # WHEN embedding the texts again
+    await service.embed(["elf", "dwarf"])
+    # THEN they are served from memory, the disk tier is not read
+    assert len(threads) == 1
+    await service.close()
+
+
+async def test_embed__new_texts_cached_on_disk(embedder_mock: Mock, temp_folder_path: Path) -> None:
+    # GIVEN an embedding service with a disk cache, running on a shared executor
+    cache = EmbeddingCache(path=temp_folder_path)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        service = BatchingEmbeddingService(embedder_mock, cache=cache, max_wait_ms=1, executor=executor)
+        # WHEN embedding new texts
+        await service.embed(["elf", "dwarf"])
+        await service.close()
+        # THEN the vectors are written to the disk tier
+        reopened = EmbeddingCache(path=temp_folder_path)
+        vector = reopened.get(cache.key(embedder_mock, "dwarf"))
+        assert vector is not None and vector.tolist() == [5.0]
+        # THEN the shared executor is not shut down by the service
+        assert executor.submit(lambda: "running").result() == "running"
@@ -1,9 +1,29 @@
 import pytest
 
-from portrait_search.embeddings.splitters import SPLITTERS, Splitter
+from portrait_search.embeddings.splitters import SPLITTERS, CombineSplitter, LangChainRecursiveSplitter, Splitter
 
 
 @pytest.mark.parametrize("splitter", SPLITTERS.values(), ids=SPLITTERS.keys())
 def test_splitters(splitter: Splitter, portrait_description_example: str) -> None:
     texts = splitter.split(portrait_description_example)
     assert len(texts) > 1
+
+
+def test_combine_splitter__dedup_with_provenance(portrait_description_example: str) -> None:
+    # GIVEN a combination of a splitter with itself and another splitter
+    splitter = CombineSplitter(
+        [
+            LangChainRecursiveSplitter(chunk_size=160, chunk_overlap=40),
+            LangChainRecursiveSplitter(chunk_size=160, chunk_overlap=40),
+            LangChainRecursiveSplitter(chunk_size=120, chunk_overlap=60),
+        ]
+    )
+    # WHEN splitting a description
+    provenance = splitter.split_with_provenance(portrait_description_example)
+    chunks = splitter.split(portrait_description_example)
+    # THEN every chunk is returned once
+    assert len(chunks) == len(set(chunks))
+    assert chunks == list(provenance)
+    # THEN chunks of the first splitter are attributed to both copies of it
+    for chunk in splitter.splitters[0].split(portrait_description_example):
+        assert provenance[chunk][:2] == [0, 1]
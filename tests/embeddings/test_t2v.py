@@ -1,14 +1,20 @@
 from itertools import product
+from pathlib import Path
+from unittest.mock import Mock
 
+import numpy as np
 import pytest
 from bson import ObjectId
 
 from portrait_search.core.enums import EmbedderType, SplitterType
+from portrait_search.embeddings.cache import EmbeddingCache
 from portrait_search.embeddings.embedders import EMBEDDERS, Embedder
 from portrait_search.embeddings.splitters import SPLITTERS, Splitter
 from portrait_search.embeddings.t2v import portraits2embeddings, query2embeddings
 from portrait_search.portraits.entities import PortraitRecord
 
+pytestmark = pytest.mark.usefixtures("fitted_projections")
+
 
 @pytest.mark.parametrize("embedder_type, splitter_type", product(EMBEDDERS, SPLITTERS))
 def test_portraits2embeddings(
@@ -52,7 +58,9 @@ def test_portraits2embeddings(
 
     # THEN first half of embeddings are equal to the last half of embeddings
     assert all(
-        embeddings_records[i].embedding == embeddings_records[i + int(len(embeddings_records) / 2)].embedding
+        np.array_equal(
+            embeddings_records[i].embedding, embeddings_records[i + int(len(embeddings_records) / 2)].embedding
+        )
         for i in range(int(len(embeddings_records) / 2))
     )
 
@@ -64,6 +72,64 @@ def test_portraits2embeddings(
     assert all(e.embedder_type == embedder_type for e in embeddings_records)
 
 
+def test_portraits2embeddings__cached_chunks_are_not_embedded(
+    portrait_description_example: str, temp_folder_path: Path
+) -> None:
+    # GIVEN a portrait embedded with a chunk cache
+    splitter = SPLITTERS[SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40]
+    embedder = Mock(wraps=EMBEDDERS[EmbedderType.ALL_MINI_LM_L6_V2])
+    embedder.type = EmbedderType.ALL_MINI_LM_L6_V2
+    embedder.instructions = ""
+    portraits = [
+        PortraitRecord(
+            id=ObjectId(),  # type: ignore
+            description=description,
+            fulllength_path="",
+            medium_path="",
+            small_path="",
+            tags=[],
+            url="",
+            hash="",
+            query="",
+        )
+        for description in [portrait_description_example, "A halfling bard with a lute"]
+    ]
+    expected = portraits2embeddings(portraits[:1], splitter, embedder, EmbeddingCache(path=temp_folder_path))
+
+    # WHEN a new portrait is added and the embeddings are generated again with a new cache over the same folder
+    embedder.embed.reset_mock()
+    embeddings_records = portraits2embeddings(portraits, splitter, embedder, EmbeddingCache(path=temp_folder_path))
+
+    # THEN only the chunks of the new portrait are embedded
+    embedder.embed.assert_called_once_with(splitter.split("A halfling bard with a lute"), None)
+
+    # THEN cached embeddings are used for the old portrait
+    assert [r.embedded_text for r in embeddings_records[: len(expected)]] == [r.embedded_text for r in expected]
+    assert all(np.allclose(r.embedding, e.embedding, atol=1e-6) for r, e in zip(embeddings_records, expected))
+
+
+def test_portraits2embeddings__no_chunks() -> None:
+    # GIVEN a portrait whose description splits into no chunks
+    splitter = SPLITTERS[SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40]
+    embedder = Mock(spec=Embedder)
+    portrait = PortraitRecord(
+        id=ObjectId(),  # type: ignore
+        description="",
+        fulllength_path="",
+        medium_path="",
+        small_path="",
+        tags=[],
+        url="",
+        hash="",
+        query="",
+    )
+    # WHEN portraits2embeddings is called
+    embeddings_records = portraits2embeddings([portrait], splitter, embedder)
+    # THEN there are no embeddings and nothing is embedded
+    assert embeddings_records == []
+    embedder.embed.assert_not_called()
+
+
 @pytest.mark.parametrize("embedder, splitter", product(EMBEDDERS.values(), SPLITTERS.values()))
 def test_query2embeddings(embedder: Embedder, splitter: Splitter) -> None:
     # GIVEN a query string
@@ -49,3 +49,72 @@ async def test_get_hashes(portraits_repository: PortraitRepository) -> None:
     assert len(hashes) == 2
     assert "hash1" in hashes
     assert "hash2" in hashes
+
+
+async def test_get_tags(portraits_repository: PortraitRepository) -> None:
+    # GIVEN two records in the collection
+    portraits = [
+        PortraitRecord(
+            fulllength_path="fulllength_path",
+            medium_path="medium_path",
+            small_path="small_path",
+            tags=tags,
+            url="url",
+            hash=f"hash{i}",
+            query="query",
+            description="description",
+        )
+        for i, tags in enumerate([["Elf", "Rogue"], []])
+    ]
+    portraits = await portraits_repository.insert_many(portraits)
+    # WHEN get_tags is called
+    tags = await portraits_repository.get_tags()
+    # THEN the tags of every portrait are returned by its id
+    assert tags == {portraits[0].id: ["Elf", "Rogue"], portraits[1].id: []}
+
+
+async def test_get_descriptions(portraits_repository: PortraitRepository) -> None:
+    # GIVEN a record in the collection
+    portrait = PortraitRecord(
+        fulllength_path="fulllength_path",
+        medium_path="medium_path",
+        small_path="small_path",
+        tags=[],
+        url="url",
+        hash="hash",
+        query="query",
+        description="An elf rogue.",
+    )
+    portrait = await portraits_repository.insert_one(portrait)
+    # WHEN get_descriptions is called
+    descriptions = await portraits_repository.get_descriptions()
+    # THEN the description of the portrait is returned by its id
+    assert descriptions == {portrait.id: "An elf rogue."}
+
+
+async def test_get_descriptions__after_id(portraits_repository: PortraitRepository) -> None:
+    # GIVEN two records in the collection
+    portraits = [
+        PortraitRecord(
+            fulllength_path="fulllength_path",
+            medium_path="medium_path",
+            small_path="small_path",
+            tags=[],
+            url="url",
+            hash=f"hash{i}",
+            query="query",
+            description=description,
+        )
+        for i, description in enumerate(["An elf rogue.", "A dwarf fighter."])
+    ]
+    portraits = await portraits_repository.insert_many(portraits)
+    # WHEN get_descriptions is called after the first portrait
+    descriptions = await portraits_repository.get_descriptions(after_id=portraits[0].id)
+    # THEN only the description of the portrait inserted after it is returned
+    assert descriptions == {portraits[1].id: "A dwarf fighter."}
+    # WHEN get_descriptions is called for the ids of the portraits
+    descriptions = await portraits_repository.get_descriptions(ids=[portraits[0].id])  # type: ignore[list-item]
+    # THEN only the descriptions of the portraits with the ids are returned
+    assert descriptions == {portraits[0].id: "An elf rogue."}
+    # THEN every portrait is counted
+    assert await portraits_repository.count() == 2
@@ -0,0 +1,59 @@
+import tempfile
+from collections.abc import AsyncGenerator
+from pathlib import Path
+from typing import Any
+from unittest.mock import AsyncMock
+
+import numpy as np
+import pytest
+
+from portrait_search.core.enums import DistanceType, EmbedderType, SplitterType
+from portrait_search.core.mongodb import PyObjectId
+from portrait_search.embeddings.entities import EmbeddingRecord
+from portrait_search.embeddings.repository import EmbeddingRepository, NumpyEmbeddingRepository
+from portrait_search.quality.vector_index import evaluate_vector_index
+
+SPLITTER_TYPE = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60
+EMBEDDER_TYPE = EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS
+
+
+@pytest.fixture
+async def exact_repository() -> AsyncGenerator[NumpyEmbeddingRepository, None]:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        repository = NumpyEmbeddingRepository(Path(temp_dir))
+        vectors = np.random.default_rng(0).normal(size=(50, 8)).astype(np.float32)
+        await repository.insert_many(
+            [
+                EmbeddingRecord(
+                    portrait_id=PyObjectId(),
+                    embedding=vector,
+                    embedded_text=f"chunk {i}",
+                    splitter_type=SPLITTER_TYPE,
+                    embedder_type=EMBEDDER_TYPE,
+                )
+                for i, vector in enumerate(vectors)
+            ]
+        )
+        yield repository
+
+
+async def test_evaluate_vector_index(exact_repository: NumpyEmbeddingRepository) -> None:
+    # GIVEN query vectors
+    query_vectors = np.random.default_rng(1).normal(size=(4, 8)).astype(np.float32)
+    # GIVEN an approximate index missing the last result of every query
+    approximate_repository = AsyncMock(spec=EmbeddingRepository)
+
+    async def vector_search(*args: Any, **kwargs: Any) -> Any:
+        return (await exact_repository.vector_search(*args, **kwargs))[: kwargs["limit"] - 1]
+
+    approximate_repository.vector_search.side_effect = vector_search
+
+    for repository, expected_recall in ((exact_repository, 1.0), (approximate_repository, 0.8)):
+        # WHEN evaluating it against exact search
+        result = await evaluate_vector_index(
+            repository, exact_repository, query_vectors, SPLITTER_TYPE, EMBEDDER_TYPE, DistanceType.COSINE, limit=5
+        )
+        # THEN recall is the share of the exact results found
+        assert result["recall@k"] == pytest.approx(expected_recall)
+        # THEN latencies are measured
+        assert 0 < result["p50 ms"] <= result["p99 ms"]
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from portrait_search.core.enums import AggregatorType
+from portrait_search.core.mongodb import PyObjectId
+from portrait_search.embeddings.entities import EmbeddingSimilarity
+from portrait_search.retrieval.aggregation import AGGREGATORS, RRF_K, Hits, to_hits, top_portraits
+
+PORTRAIT_IDS = [PyObjectId() for _ in range(3)]
+
+
+def _similarity(portrait: int, similarity: float) -> EmbeddingSimilarity:
+    return EmbeddingSimilarity(
+        portrait_id=PORTRAIT_IDS[portrait],
+        embedding=np.empty(0, dtype=np.float32),
+        embedded_text=f"chunk of portrait {portrait}",
+        similarity=similarity,
+    )
+
+
+@pytest.fixture
+def hits() -> Hits:
+    # GIVEN results of 2 query chunks, portraits are found several times
+    hits, _ = to_hits(
+        [
+            [_similarity(2, 0.9), _similarity(0, 0.8), _similarity(2, 0.7), _similarity(0, 0.6), _similarity(0, 0.5)],
+            [_similarity(1, 0.4), _similarity(0, 0.3)],
+        ]
+    )
+    return hits
+
+
+def test_to_hits(hits: Hits) -> None:
+    # THEN portraits are numbered in order of first appearance
+    assert hits.portraits.tolist() == [0, 1, 0, 1, 1, 2, 1]
+    assert hits.first_hits.tolist() == [0, 1, 5]
+    assert hits.portrait_count == 3
+    # THEN every hit knows its query chunk and rank in it
+    assert hits.queries.tolist() == [0, 0, 0, 0, 0, 1, 1]
+    assert hits.ranks.tolist() == [0, 1, 2, 3, 4, 0, 1]
+
+
+@pytest.mark.parametrize(
+    "aggregator_type,expected",
+    [
+        (AggregatorType.MEAN, [0.8, (0.8 + 0.6 + 0.5 + 0.3) / 4, 0.4]),
+        (AggregatorType.MAX, [0.9, 0.8, 0.4]),
+        (AggregatorType.SUM_TOP_3, [0.9 + 0.7, 0.8 + 0.6 + 0.5, 0.4]),
+        (
+            AggregatorType.RECIPROCAL_RANK_FUSION,
+            [1 / (RRF_K + 1), 1 / (RRF_K + 2) + 1 / (RRF_K + 2), 1 / (RRF_K + 1)],
+        ),
+    ],
+)
+def test_aggregators(aggregator_type: AggregatorType, expected: list[float], hits: Hits) -> None:
+    # WHEN similarities are aggregated per portrait
+    scores = AGGREGATORS[aggregator_type](hits)
+    # THEN every portrait gets a score
+    assert scores.tolist() == pytest.approx(expected)
+
+
+def test_top_portraits() -> None:
+    # GIVEN portrait scores with ties
+    scores = np.array([0.1, 0.5, 0.3, 0.5, 0.3, 0.2])
+    # THEN the best portraits are first, ties in order of first appearance
+    assert top_portraits(scores, 3).tolist() == [1, 3, 2]
+    assert top_portraits(scores, 10).tolist() == [1, 3, 2, 4, 5, 0]
+    assert top_portraits(scores, 0).tolist() == []
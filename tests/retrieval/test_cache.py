@@ -0,0 +1,121 @@
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+from portrait_search.core.enums import DistanceType, EmbedderType, SplitterType
+from portrait_search.core.generation import Generation
+from portrait_search.embeddings.embedders import Embedder
+from portrait_search.embeddings.splitters import Splitter
+from portrait_search.retrieval.cache import CachedRetriever, SearchResultCache
+from portrait_search.retrieval.retriever import Retriever
+
+
+@pytest.fixture
+def retriever_mock() -> Mock:
+    m = Mock(spec=Retriever)
+    m.get_portraits.side_effect = lambda query, experiment, limit, tags: ([f"Portrait for {query}"], [[]])
+    return m
+
+
+@pytest.fixture
+def generation() -> Generation:
+    return Generation()
+
+
+@pytest.fixture
+def cache(generation: Generation) -> SearchResultCache:
+    return SearchResultCache(ttl_seconds=60, max_entries=2, generation=generation)
+
+
+@pytest.fixture
+def cached_retriever(retriever_mock: Mock, cache: SearchResultCache) -> CachedRetriever:
+    return CachedRetriever(
+        retriever=retriever_mock,
+        cache=cache,
+        distance_type=DistanceType.COSINE,
+        splitter=Mock(spec=Splitter, type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40),
+        embedder=Mock(spec=Embedder, type=EmbedderType.ALL_MINI_LM_L6_V2),
+    )
+
+
+async def test_get_portraits__repeated_query(cached_retriever: CachedRetriever, retriever_mock: Mock) -> None:
+    # GIVEN a query searched once
+    result = await cached_retriever.get_portraits("A rogue elf", limit=2)
+    # WHEN the same query is searched again with different case and whitespace
+    cached_result = await cached_retriever.get_portraits("  a Rogue   elf ", limit=2)
+    # THEN the cached result is returned without searching
+    assert cached_result == result
+    retriever_mock.get_portraits.assert_called_once_with("A rogue elf", experiment=None, limit=2, tags=None)
+    assert (cached_retriever.cache.hits, cached_retriever.cache.misses) == (1, 1)
+
+
+async def test_get_portraits__different_limit(cached_retriever: CachedRetriever, retriever_mock: Mock) -> None:
+    # GIVEN a query searched once
+    await cached_retriever.get_portraits("A rogue elf", limit=2)
+    # WHEN the same query is searched with another limit
+    await cached_retriever.get_portraits("A rogue elf", limit=3)
+    # THEN the query is searched again
+    assert retriever_mock.get_portraits.call_count == 2
+
+
+async def test_get_portraits__tags(cached_retriever: CachedRetriever, retriever_mock: Mock) -> None:
+    # GIVEN a query searched with tags
+    await cached_retriever.get_portraits("A rogue elf", tags=["Elf", "Rogue"])
+    # WHEN the same query is searched with the same tags in another order and case, and without tags
+    await cached_retriever.get_portraits("A rogue elf", tags=["rogue", "elf"])
+    await cached_retriever.get_portraits("A rogue elf")
+    # THEN the query is searched once per set of tags
+    assert retriever_mock.get_portraits.call_count == 2
+
+
+async def test_get_portraits__index_write(
+    cached_retriever: CachedRetriever, retriever_mock: Mock, generation: Generation
+) -> None:
+    # GIVEN a query searched once
+    await cached_retriever.get_portraits("A rogue elf")
+    # WHEN the index is written to
+    generation.bump()
+    await cached_retriever.get_portraits("A rogue elf")
+    # THEN the query is searched again
+    assert retriever_mock.get_portraits.call_count == 2
+
+
+async def test_get_portraits__ttl(cached_retriever: CachedRetriever, retriever_mock: Mock) -> None:
+    # GIVEN a cache with entries expiring immediately
+    cached_retriever.cache.ttl_seconds = -1
+    # WHEN the same query is searched twice
+    await cached_retriever.get_portraits("A rogue elf")
+    await cached_retriever.get_portraits("A rogue elf")
+    # THEN the query is searched twice
+    assert retriever_mock.get_portraits.call_count == 2
+
+
+async def test_get_portraits__max_entries(cached_retriever: CachedRetriever, retriever_mock: Mock) -> None:
+    # GIVEN 3 different queries searched with a cache of 2 entries
+    for query in ["elf", "dwarf", "gnome"]:
+        await cached_retriever.get_portraits(query)
+    # WHEN the first query is searched again
+    await cached_retriever.get_portraits("elf")
+    # THEN the first query was evicted and is searched again
+    assert len(cached_retriever.cache) == 2
+    assert retriever_mock.get_portraits.call_count == 4
+
+
+async def test_get_portraits__index_write_by_another_process(retriever_mock: Mock, temp_folder_path: Path) -> None:
+    # GIVEN a cached retriever with a generation shared through a file, and a query searched once
+    cached_retriever = CachedRetriever(
+        retriever=retriever_mock,
+        cache=SearchResultCache(
+            ttl_seconds=60, max_entries=2, generation=Generation(temp_folder_path / "index_generation")
+        ),
+        distance_type=DistanceType.COSINE,
+        splitter=Mock(spec=Splitter, type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40),
+        embedder=Mock(spec=Embedder, type=EmbedderType.ALL_MINI_LM_L6_V2),
+    )
+    await cached_retriever.get_portraits("A rogue elf")
+    # WHEN the index is written to by another process sharing the file
+    Generation(temp_folder_path / "index_generation").bump()
+    await cached_retriever.get_portraits("A rogue elf")
+    # THEN the query is searched again
+    assert retriever_mock.get_portraits.call_count == 2
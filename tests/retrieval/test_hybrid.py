@@ -0,0 +1,179 @@
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from portrait_search.core.generation import Generation
+from portrait_search.core.mongodb import PyObjectId
+from portrait_search.embeddings.embedders import Embedder
+from portrait_search.embeddings.entities import EmbeddingSimilarity
+from portrait_search.embeddings.repository import EmbeddingRepository
+from portrait_search.embeddings.splitters import Splitter
+from portrait_search.portraits.entities import PortraitRecord
+from portrait_search.portraits.repository import PortraitRepository
+from portrait_search.retrieval.hybrid import HybridRetriever
+from portrait_search.retrieval.lexical import LexicalIndex
+from portrait_search.retrieval.retriever import Retriever
+from portrait_search.retrieval.tags import TagIndex
+
+
+def _portrait(description: str) -> PortraitRecord:
+    return PortraitRecord(
+        id=PyObjectId(),  # type: ignore
+        fulllength_path="fulllength.png",
+        medium_path="medium.png",
+        small_path="small.png",
+        tags=[],
+        url="url",
+        hash=description,
+        query="query",
+        description=description,
+    )
+
+
+@pytest.fixture
+def portraits() -> list[PortraitRecord]:
+    return [
+        _portrait("An elf ranger with a longbow."),
+        _portrait("A halberd."),
+        _portrait("A dwarf fighter with a halberd and a shield."),
+    ]
+
+
+@pytest.fixture
+def explanation(portraits: list[PortraitRecord]) -> EmbeddingSimilarity:
+    return EmbeddingSimilarity(
+        portrait_id=PyObjectId(portraits[1].id),
+        embedding=np.ones(1, dtype=np.float32),
+        embedded_text="A halberd.",
+        similarity=0.5,
+    )
+
+
+@pytest.fixture
+def vector_retriever_mock(portraits: list[PortraitRecord], explanation: EmbeddingSimilarity) -> Mock:
+    m = Mock(spec=Retriever)
+    m.get_portraits.return_value = ([portraits[0], portraits[1]], [[], [explanation]])
+    return m
+
+
+@pytest.fixture
+def portrait_repository_mock(portraits: list[PortraitRecord]) -> Mock:
+    m = Mock(spec=PortraitRepository)
+    portraits_by_id = {portrait.id: portrait for portrait in portraits}
+    m.get_descriptions.return_value = {portrait.id: portrait.description for portrait in portraits}
+    m.count.return_value = len(portraits)
+
+    async def get_by_ids(ids: list[PyObjectId]) -> list[PortraitRecord]:
+        return [portraits_by_id[id] for id in ids]
+
+    m.get_by_ids.side_effect = get_by_ids
+    return m
+
+
+@pytest.fixture
+def embedding_repository_mock() -> Mock:
+    return Mock(spec=EmbeddingRepository)
+
+
+@pytest.fixture
+def generation() -> Generation:
+    return Generation()
+
+
+@pytest.fixture
+def portrait_generation() -> Generation:
+    return Generation()
+
+
+@pytest.fixture
+def hybrid_retriever(
+    vector_retriever_mock: Mock,
+    portrait_repository_mock: Mock,
+    embedding_repository_mock: Mock,
+    generation: Generation,
+    portrait_generation: Generation,
+) -> HybridRetriever:
+    return HybridRetriever(
+        vector_retriever=vector_retriever_mock,
+        lexical_index=LexicalIndex(),
+        tag_index=TagIndex(),
+        portrait_repository=portrait_repository_mock,
+        embedding_repository=embedding_repository_mock,
+        splitter=Mock(spec=Splitter),
+        embedder=Mock(spec=Embedder),
+        generation=generation,
+        portrait_generation=portrait_generation,
+    )
+
+
+async def test_get_portraits__fuses_ranks(
+    hybrid_retriever: HybridRetriever,
+    portraits: list[PortraitRecord],
+    explanation: EmbeddingSimilarity,
+    vector_retriever_mock: Mock,
+) -> None:
+    # GIVEN the vector retriever ranks portraits 0 and 1, the lexical index matches portraits 1 and 2
+    # WHEN searching
+    found_portraits, explanations = await hybrid_retriever.get_portraits("halberd", limit=3)
+    # THEN the portrait found by both ranks first, followed by the best ranks of each retriever
+    assert found_portraits == [portraits[1], portraits[0], portraits[2]]
+    # THEN only portraits found by vectors are explained
+    assert explanations == [[explanation], [], []]
+    # THEN the vector retriever is asked for no more portraits than requested
+    vector_retriever_mock.get_portraits.assert_called_once_with("halberd", experiment=None, limit=3, tags=None)
+
+
+async def test_get_portraits__syncs_once_per_portrait_generation(
+    hybrid_retriever: HybridRetriever,
+    portrait_repository_mock: Mock,
+    embedding_repository_mock: Mock,
+    generation: Generation,
+    portrait_generation: Generation,
+) -> None:
+    # GIVEN two searches in an experiment
+    embedding_repository_mock.get_embedded_portrait_ids.return_value = set()
+    await hybrid_retriever.get_portraits("halberd", experiment="v1")
+    await hybrid_retriever.get_portraits("longbow", experiment="v1")
+    # THEN the lexical index is synced once and the portraits of the experiment are fetched once
+    assert portrait_repository_mock.get_descriptions.call_count == 1
+    assert embedding_repository_mock.get_embedded_portrait_ids.call_count == 1
+    # WHEN embeddings are written to the index
+    generation.bump()
+    await hybrid_retriever.get_portraits("halberd", experiment="v1")
+    # THEN the portraits of the experiment are fetched again, the lexical index is not synced
+    assert embedding_repository_mock.get_embedded_portrait_ids.call_count == 2
+    assert portrait_repository_mock.get_descriptions.call_count == 1
+    # WHEN portraits are written
+    portrait_generation.bump()
+    await hybrid_retriever.get_portraits("halberd", experiment="v1")
+    # THEN the lexical index is synced again
+    assert portrait_repository_mock.get_descriptions.call_count == 2
+
+
+async def test_get_portraits__experiment(
+    hybrid_retriever: HybridRetriever,
+    portraits: list[PortraitRecord],
+    embedding_repository_mock: Mock,
+    vector_retriever_mock: Mock,
+) -> None:
+    # GIVEN an experiment with embeddings of portraits 0 and 1 only
+    embedding_repository_mock.get_embedded_portrait_ids.return_value = {portraits[0].id, portraits[1].id}
+    # WHEN searching in the experiment
+    found_portraits, _ = await hybrid_retriever.get_portraits("halberd", experiment="v1", limit=3)
+    # THEN lexical matches outside of the experiment are not returned
+    assert found_portraits == [portraits[1], portraits[0]]
+
+
+async def test_get_portraits__tags(
+    hybrid_retriever: HybridRetriever, portraits: list[PortraitRecord], vector_retriever_mock: Mock
+) -> None:
+    # GIVEN the dwarf portrait is the only one tagged Dwarf, the vector retriever finds it too
+    hybrid_retriever.tag_index.add(portraits[2].id, ["Dwarf"])  # type: ignore[arg-type]
+    vector_retriever_mock.get_portraits.return_value = ([portraits[2]], [[]])
+    # WHEN searching for a halberd among dwarves
+    found_portraits, _ = await hybrid_retriever.get_portraits("halberd", limit=3, tags=["dwarf"])
+    # THEN the lexical match without the tag is not returned
+    assert found_portraits == [portraits[2]]
+    # THEN the vector retriever is restricted to the tags too
+    vector_retriever_mock.get_portraits.assert_called_once_with("halberd", experiment=None, limit=3, tags=["dwarf"])
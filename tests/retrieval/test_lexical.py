@@ -0,0 +1,147 @@
+import tempfile
+from collections.abc import Collection, Generator
+from pathlib import Path
+from typing import Any
+from unittest.mock import Mock
+
+import pytest
+from bson import ObjectId
+
+from portrait_search.core.mongodb import PyObjectId
+from portrait_search.portraits.repository import PortraitRepository, inserted_after
+from portrait_search.retrieval.lexical import LexicalIndex, tokenize
+
+DESCRIPTIONS = [
+    "A dwarf fighter in full plate armor and a closed helmet, wielding a halberd.",
+    "An elf ranger with a longbow, wearing leather armor.",
+    "A human wizard with a staff, wearing robes and no armor.",
+]
+
+
+@pytest.fixture
+def index_path() -> Generator[Path, Any, Any]:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield Path(temp_dir) / "lexical_index.npz"
+
+
+@pytest.fixture
+def portrait_ids() -> list[PyObjectId]:
+    return [PyObjectId() for _ in DESCRIPTIONS]
+
+
+@pytest.fixture
+def lexical_index(index_path: Path, portrait_ids: list[PyObjectId]) -> LexicalIndex:
+    index = LexicalIndex(index_path)
+    for portrait_id, description in zip(portrait_ids, DESCRIPTIONS):
+        index.add(portrait_id, description)
+    return index
+
+
+def test_tokenize() -> None:
+    assert tokenize('A "Closed-Helmet", +1 halberd') == ["a", "closed", "helmet", "1", "halberd"]
+
+
+def test_search(lexical_index: LexicalIndex, portrait_ids: list[PyObjectId]) -> None:
+    # WHEN searching for a literal term of one description
+    results = lexical_index.search("halberd")
+    # THEN only the portrait with the term is found
+    assert [portrait_id for portrait_id, _ in results] == [portrait_ids[0]]
+    # WHEN searching for a term of all descriptions and a rare term
+    results = lexical_index.search("leather armor", limit=2)
+    # THEN the portrait with the rare term ranks first, and results are limited
+    assert len(results) == 2
+    assert results[0][0] == portrait_ids[1]
+    assert results[0][1] > results[1][1] > 0
+    # WHEN searching among some portraits only
+    results = lexical_index.search("armor", portrait_ids={portrait_ids[2]})
+    # THEN only they are found
+    assert [portrait_id for portrait_id, _ in results] == [portrait_ids[2]]
+    # THEN unknown terms match nothing
+    assert lexical_index.search("spaghetti") == []
+
+
+def test_add_and_remove(lexical_index: LexicalIndex, portrait_ids: list[PyObjectId]) -> None:
+    # WHEN a description of a portrait is replaced and another portrait is removed
+    lexical_index.add(portrait_ids[0], "A gnome bard with a lute.")
+    lexical_index.remove(portrait_ids[1])
+    # THEN only the new description is matched
+    assert lexical_index.search("halberd") == []
+    assert [portrait_id for portrait_id, _ in lexical_index.search("lute")] == [portrait_ids[0]]
+    # THEN the removed portrait is not matched
+    assert [portrait_id for portrait_id, _ in lexical_index.search("armor")] == [portrait_ids[2]]
+    assert len(lexical_index) == 2
+
+
+def test_save_and_load(index_path: Path, lexical_index: LexicalIndex, portrait_ids: list[PyObjectId]) -> None:
+    # GIVEN a removed portrait
+    lexical_index.remove(portrait_ids[1])
+    expected = lexical_index.search("armor with a staff")
+    # WHEN the index is saved and loaded
+    lexical_index.save()
+    loaded = LexicalIndex(index_path)
+    # THEN the loaded index is compacted and finds the same portraits with the same scores
+    assert len(loaded) == 2
+    assert loaded.portrait_ids == [portrait_ids[0], portrait_ids[2]]
+    assert loaded.last_portrait_id == portrait_ids[2]
+    assert loaded.search("armor with a staff") == pytest.approx(expected)
+    # THEN portraits are added to the loaded index incrementally
+    new_portrait_id = PyObjectId()
+    loaded.add(new_portrait_id, "A tiefling warlock.")
+    assert [portrait_id for portrait_id, _ in loaded.search("warlock")] == [new_portrait_id]
+
+
+def _portrait_repository_mock(descriptions_by_portrait_id: dict[ObjectId, str]) -> Mock:
+    portrait_repository = Mock(spec=PortraitRepository)
+
+    async def get_descriptions(
+        after_id: ObjectId | None = None, ids: Collection[ObjectId] | None = None
+    ) -> dict[ObjectId, str]:
+        return {
+            portrait_id: description
+            for portrait_id, description in descriptions_by_portrait_id.items()
+            if (after_id is None or portrait_id > after_id) and (ids is None or portrait_id in ids)
+        }
+
+    portrait_repository.get_descriptions.side_effect = get_descriptions
+    portrait_repository.count.return_value = len(descriptions_by_portrait_id)
+    portrait_repository.get_ids.return_value = set(descriptions_by_portrait_id)
+    return portrait_repository
+
+
+async def test_sync(lexical_index: LexicalIndex, portrait_ids: list[PyObjectId]) -> None:
+    # GIVEN a repository where a new portrait was inserted
+    new_portrait_id = PyObjectId()
+    portrait_repository = _portrait_repository_mock(
+        {**dict(zip(portrait_ids, DESCRIPTIONS)), new_portrait_id: "A halfling rogue with a dagger."}
+    )
+    # WHEN the index is synced
+    await lexical_index.sync(portrait_repository)
+    # THEN the new portrait is indexed
+    assert [portrait_id for portrait_id, _ in lexical_index.search("dagger")] == [new_portrait_id]
+    assert lexical_index.changed
+    # THEN only the description of the new portrait is fetched
+    portrait_repository.get_descriptions.assert_awaited_once_with(after_id=inserted_after(portrait_ids[-1]))
+    # THEN the unchanged portraits are not re-indexed, and the ids of all portraits are not fetched
+    assert lexical_index.docs_by_portrait_id[portrait_ids[0]] == 0
+    portrait_repository.get_ids.assert_not_awaited()
+
+
+async def test_sync__deleted_and_inserted_out_of_order(
+    lexical_index: LexicalIndex, portrait_ids: list[PyObjectId]
+) -> None:
+    # GIVEN a repository where a portrait was deleted and a portrait with a lower id than the indexed ones inserted
+    old_portrait_id = PyObjectId.from_datetime(portrait_ids[0].generation_time)
+    portrait_repository = _portrait_repository_mock(
+        {
+            old_portrait_id: "A gnome bard with a lute.",
+            portrait_ids[0]: DESCRIPTIONS[0],
+            portrait_ids[1]: DESCRIPTIONS[1],
+        }
+    )
+    # WHEN the index is synced
+    await lexical_index.sync(portrait_repository)
+    # THEN the deleted portrait is removed
+    assert portrait_ids[2] not in lexical_index
+    # THEN the portrait inserted out of order is indexed
+    assert [portrait_id for portrait_id, _ in lexical_index.search("lute")] == [old_portrait_id]
+    assert len(lexical_index) == 3
@@ -1,28 +1,55 @@
-from unittest.mock import Mock, call
+from pathlib import Path
+from typing import Any
+from unittest.mock import Mock
 
+import numpy as np
 import pytest
 
-from portrait_search.core.enums import DistanceType
+from portrait_search.core.enums import DistanceType, EmbedderType, SplitterType
+from portrait_search.core.generation import Generation
 from portrait_search.core.mongodb import PyObjectId
 from portrait_search.embeddings.embedders import Embedder
-from portrait_search.embeddings.entities import EmbeddingSimilarity
-from portrait_search.embeddings.repository import EmbeddingRepository
+from portrait_search.embeddings.entities import EmbeddingRecord, EmbeddingSimilarity
+from portrait_search.embeddings.pooled import PooledVectorStore
+from portrait_search.embeddings.repository import (
+    ChromaEmbeddingRepository,
+    EmbeddingRepository,
+    NumpyEmbeddingRepository,
+)
+from portrait_search.embeddings.service import BatchingEmbeddingService
 from portrait_search.embeddings.splitters import Splitter
 from portrait_search.portraits.repository import PortraitRepository
 from portrait_search.retrieval.similarity import SimilarityRetriever
+from portrait_search.retrieval.tags import TagIndex
+
+SPLITTER_TYPE = SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_120_OVERLAP_60
+EMBEDDER_TYPE = EmbedderType.INSTRUCTOR_LARGE_PATHFINDER_CHARACTER_INSTRUCTIONS
+
+
+def _chunks(vectors: list[tuple[PyObjectId, Any]]) -> list[EmbeddingRecord]:
+    return [
+        EmbeddingRecord(
+            portrait_id=portrait_id,
+            embedding=np.array(vector, dtype=np.float32),
+            embedded_text=f"chunk {i}",
+            splitter_type=SPLITTER_TYPE,
+            embedder_type=EMBEDDER_TYPE,
+        )
+        for i, (portrait_id, vector) in enumerate(vectors)
+    ]
 
 
 @pytest.fixture
 def portraits_repository_mock() -> Mock:
     m = Mock(spec=PortraitRepository)
-    m.get_one.return_value = None
+    m.get_by_ids.return_value = []
     return m
 
 
 @pytest.fixture
 def embedding_repository_mock() -> Mock:
     m = Mock(spec=EmbeddingRepository)
-    m.vector_search.return_value = []
+    m.vector_search_many.return_value = []
     return m
 
 
@@ -72,38 +99,39 @@ async def test_get_portraits__several_results(
     # GIVEN splitter mock splits query into 2 parts with overlap
     splitter_mock.split_query.return_value = ["A rogue elf female", "female with a knife"]
     # GIVEN embedder mock returns 2 embeddings
-    embedder_mock.embed.return_value = [[1, 2, 3], [4, 5, 6]]
+    query_embeddings = np.array([[1, 2, 3], [4, 5, 6]], dtype=np.float32)
+    embedder_mock.embed.return_value = query_embeddings
     # GIVEN total number of unique portraits in the database is 10
     unique_portrait_ids = [PyObjectId() for _ in range(10)]
     # GIVEN embeddings repository returns 5 results for the first embedding and 3 for the second
-    embedding_repository_mock.vector_search.side_effect = [
+    embedding_repository_mock.vector_search_many.return_value = [
         [
             EmbeddingSimilarity(
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some original text 1",
                 similarity=0.9,
                 portrait_id=unique_portrait_ids[0],
             ),
             EmbeddingSimilarity(
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some original text 2",
                 similarity=0.8,
                 portrait_id=unique_portrait_ids[1],
             ),
             EmbeddingSimilarity(
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some original text 3",
                 similarity=0.9,
                 portrait_id=unique_portrait_ids[2],
             ),
             EmbeddingSimilarity(
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some original text 4",
                 similarity=0.6,
                 portrait_id=unique_portrait_ids[3],
             ),
             EmbeddingSimilarity(
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some original text 5",
                 similarity=0.5,
                 portrait_id=unique_portrait_ids[4],
@@ -111,19 +139,19 @@ async def test_get_portraits__several_results(
         ],
         [
             EmbeddingSimilarity(
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some other original text ",
                 similarity=0.5,
                 portrait_id=unique_portrait_ids[8],
             ),
             EmbeddingSimilarity(
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some other original text 2",
                 similarity=0.4,
                 portrait_id=unique_portrait_ids[2],
             ),
             EmbeddingSimilarity(
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some other original text 3",
                 similarity=0.3,
                 portrait_id=unique_portrait_ids[1],
@@ -131,7 +159,7 @@ async def test_get_portraits__several_results(
         ],
     ]
     # GIVEN portrait repository returns some string for each unique portrait id
-    portraits_repository_mock.get_one.side_effect = lambda pid: f"Portrait {pid}"
+    portraits_repository_mock.get_by_ids.side_effect = lambda pids: [f"Portrait {pid}" for pid in pids]
 
     # WHEN get_portraits is called with the query and limit 2
     portraits, explanations = await similarity_retriever.get_portraits(query, limit=2)
@@ -140,34 +168,18 @@ async def test_get_portraits__several_results(
     splitter_mock.split_query.assert_called_once_with(query)
     # THEN the embedder is called with the 2 parts of the query
     embedder_mock.embed.assert_called_once_with(["A rogue elf female", "female with a knife"])
-    # THEN the embeddings repository vector search is called twice with the 2 queries
-    embedding_repository_mock.vector_search.assert_has_calls(
-        [
-            call(
-                [1, 2, 3],
-                splitter_mock.type,
-                embedder_mock.type,
-                DistanceType.EUCLIDEAN,
-                experiment=None,
-                limit=6,
-            ),
-            call(
-                [4, 5, 6],
-                splitter_mock.type,
-                embedder_mock.type,
-                DistanceType.EUCLIDEAN,
-                experiment=None,
-                limit=6,
-            ),
-        ]
-    )
-    # THEN the portrait repository is called 2 times with portrait id 0 and portrait id 3
-    portraits_repository_mock.get_one.assert_has_calls(
-        [
-            call(unique_portrait_ids[0]),
-            call(unique_portrait_ids[2]),
-        ]
+    # THEN the embeddings repository vector search is called once with both queries
+    embedding_repository_mock.vector_search_many.assert_called_once_with(
+        query_embeddings,
+        splitter_mock.type,
+        embedder_mock.type,
+        DistanceType.EUCLIDEAN,
+        experiment=None,
+        limit=6,
+        portrait_ids=None,
     )
+    # THEN the portrait repository is called once with portrait id 0 and portrait id 2
+    portraits_repository_mock.get_by_ids.assert_called_once_with([unique_portrait_ids[0], unique_portrait_ids[2]])
     # THEN the portraits returned are the 2 portraits from the repository
     assert portraits == [f"Portrait {unique_portrait_ids[0]}", f"Portrait {unique_portrait_ids[2]}"]
     # THEN the explanations returned are the 2 explanations from the repository
@@ -175,9 +187,9 @@ async def test_get_portraits__several_results(
         [
             EmbeddingSimilarity(
                 portrait_id=unique_portrait_ids[0],
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some original text 1",
-                query=[1, 2, 3],
+                query=np.array([1, 2, 3], dtype=np.float32),
                 query_text="A rogue elf female",
                 similarity=0.9,
             )
@@ -185,19 +197,189 @@ async def test_get_portraits__several_results(
         [
             EmbeddingSimilarity(
                 portrait_id=unique_portrait_ids[2],
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some original text 3",
-                query=[1, 2, 3],
+                query=np.array([1, 2, 3], dtype=np.float32),
                 query_text="A rogue elf female",
                 similarity=0.9,
             ),
             EmbeddingSimilarity(
                 portrait_id=unique_portrait_ids[2],
-                embedding=[],
+                embedding=np.empty(0, dtype=np.float32),
                 embedded_text="some other original text 2",
-                query=[4, 5, 6],
+                query=np.array([4, 5, 6], dtype=np.float32),
                 query_text="female with a knife",
                 similarity=0.4,
             ),
         ],
     ]
+
+
+async def test_get_portraits__embedding_service(
+    similarity_retriever: SimilarityRetriever,
+    splitter_mock: Mock,
+    embedder_mock: Mock,
+    embedding_repository_mock: Mock,
+) -> None:
+    # GIVEN a retriever with an embedding service
+    embedding_service_mock = Mock(spec=BatchingEmbeddingService)
+    embedding_service_mock.embed.return_value = np.array([[1, 2, 3]], dtype=np.float32)
+    similarity_retriever.embedding_service = embedding_service_mock
+    splitter_mock.split_query.return_value = ["A rogue elf female"]
+
+    # WHEN get_portraits is called
+    await similarity_retriever.get_portraits("A rogue elf female")
+
+    # THEN the query is embedded by the service instead of the embedder
+    embedding_service_mock.embed.assert_awaited_once_with(["A rogue elf female"])
+    embedder_mock.embed.assert_not_called()
+    # THEN the service embeddings are searched
+    assert embedding_repository_mock.vector_search_many.call_args[0][0].tolist() == [[1, 2, 3]]
+
+
+async def test_get_portraits__pooled_shortlist(
+    similarity_retriever: SimilarityRetriever,
+    splitter_mock: Mock,
+    embedder_mock: Mock,
+    portraits_repository_mock: Mock,
+    temp_folder_path: Path,
+) -> None:
+    # GIVEN chunks of 3 portraits stored in a repository and pooled, the third one far from the query
+    splitter_mock.type = SPLITTER_TYPE
+    embedder_mock.type = EMBEDDER_TYPE
+    portrait_ids = [PyObjectId() for _ in range(3)]
+    chunks = _chunks(
+        [
+            (portrait_ids[0], [1, 0.2]),
+            (portrait_ids[0], [1, -0.2]),
+            (portrait_ids[1], [0.8, 0.6]),
+            (portrait_ids[2], [-1, 0]),
+        ]
+    )
+    repository = NumpyEmbeddingRepository(temp_folder_path)
+    await repository.insert_many(chunks)
+    store = PooledVectorStore(temp_folder_path)
+    store.get(SPLITTER_TYPE, EMBEDDER_TYPE, None).update(chunks)
+    similarity_retriever.embedding_repository = embedding_repository_spy = Mock(wraps=repository)
+    similarity_retriever.pooled_vector_store = store
+    similarity_retriever.shortlist_factor = 2
+    similarity_retriever.distance_type = DistanceType.COSINE
+    splitter_mock.split_query.return_value = ["A rogue elf female"]
+    embedder_mock.embed.return_value = np.array([[1, 0]], dtype=np.float32)
+    portraits_repository_mock.get_by_ids.side_effect = lambda pids: [f"Portrait {pid}" for pid in pids]
+
+    # WHEN get_portraits is called with limit 1
+    portraits, explanations = await similarity_retriever.get_portraits("A rogue elf female", limit=1)
+
+    # THEN only chunks of the 2 portraits closest to the query are searched
+    shortlist = embedding_repository_spy.vector_search_many.call_args.kwargs["portrait_ids"]
+    assert set(shortlist) == {portrait_ids[0], portrait_ids[1]}
+    # THEN the best portrait is returned with its best chunks, scored exactly
+    assert portraits == [f"Portrait {portrait_ids[0]}"]
+    assert [explanation.embedded_text for explanation in explanations[0]] == ["chunk 0", "chunk 1"]
+    assert explanations[0][0].similarity == pytest.approx(1 / np.sqrt(1.04))
+
+
+@pytest.mark.parametrize("repository_class", [ChromaEmbeddingRepository, NumpyEmbeddingRepository])
+@pytest.mark.parametrize("distance_type", DistanceType)
+async def test_get_portraits__pooled_shortlist_same_as_full_search(
+    repository_class: type[ChromaEmbeddingRepository] | type[NumpyEmbeddingRepository],
+    distance_type: DistanceType,
+    similarity_retriever: SimilarityRetriever,
+    splitter_mock: Mock,
+    embedder_mock: Mock,
+    portraits_repository_mock: Mock,
+    temp_folder_path: Path,
+) -> None:
+    # GIVEN chunks of 6 portraits stored in a repository and pooled
+    splitter_mock.type = SPLITTER_TYPE
+    embedder_mock.type = EMBEDDER_TYPE
+    rng = np.random.default_rng(0)
+    portrait_ids = [PyObjectId() for _ in range(6)]
+    chunks = _chunks([(portrait_id, rng.normal(size=4)) for portrait_id in portrait_ids for _ in range(3)])
+    repository = repository_class(temp_folder_path)
+    await repository.insert_many(chunks)
+    store = PooledVectorStore(temp_folder_path)
+    store.get(SPLITTER_TYPE, EMBEDDER_TYPE, None).update(chunks)
+    similarity_retriever.embedding_repository = repository
+    similarity_retriever.pooled_vector_store = store
+    similarity_retriever.distance_type = distance_type
+    splitter_mock.split_query.return_value = ["A rogue elf female", "with a knife"]
+    embedder_mock.embed.return_value = rng.normal(size=(2, 4)).astype(np.float32)
+    portraits_repository_mock.get_by_ids.side_effect = lambda pids: list(pids)
+
+    # WHEN get_portraits is called by searching all chunks and with a shortlist of all portraits
+    similarity_retriever.shortlist_factor = 0
+    full_portraits, full_explanations = await similarity_retriever.get_portraits("query", limit=3)
+    similarity_retriever.shortlist_factor = 2
+    shortlist_portraits, shortlist_explanations = await similarity_retriever.get_portraits("query", limit=3)
+
+    # THEN the portraits are ranked the same, with the same similarities
+    assert shortlist_portraits == full_portraits
+    assert [[e.similarity for e in explanations] for explanations in shortlist_explanations] == [
+        pytest.approx([e.similarity for e in explanations]) for explanations in full_explanations
+    ]
+
+
+async def test_get_portraits__tags(
+    similarity_retriever: SimilarityRetriever,
+    portraits_repository_mock: Mock,
+    splitter_mock: Mock,
+    embedder_mock: Mock,
+    embedding_repository_mock: Mock,
+) -> None:
+    # GIVEN a tag index of a dwarf fighter and an elf fighter
+    dwarf, elf = PyObjectId(), PyObjectId()
+    similarity_retriever.tag_index = TagIndex()
+    similarity_retriever.portrait_generation = Generation()
+    portraits_repository_mock.get_tags.return_value = {dwarf: ["Dwarf", "Fighter"], elf: ["Elf", "Fighter"]}
+    portraits_repository_mock.count.return_value = 2
+    splitter_mock.split_query.return_value = ["A bearded warrior"]
+    embedder_mock.embed.return_value = np.array([[1, 2, 3]], dtype=np.float32)
+
+    # WHEN get_portraits is called with tags
+    await similarity_retriever.get_portraits("A bearded warrior", tags=["fighter", "dwarf"])
+
+    # THEN the search is restricted to the portraits with all the tags
+    assert embedding_repository_mock.vector_search_many.call_args.kwargs["portrait_ids"] == {dwarf}
+
+    # WHEN get_portraits is called with a tag no portrait has
+    result = await similarity_retriever.get_portraits("A bearded warrior", tags=["wizard"])
+
+    # THEN nothing is searched and nothing is found
+    assert result == ([], [])
+    embedding_repository_mock.vector_search_many.assert_called_once()
+
+
+async def test_get_portraits__tags_synced_once_per_portrait_generation(
+    similarity_retriever: SimilarityRetriever,
+    portraits_repository_mock: Mock,
+    splitter_mock: Mock,
+    embedder_mock: Mock,
+    embedding_repository_mock: Mock,
+) -> None:
+    # GIVEN a tag index synced with one dwarf portrait
+    dwarf, new_dwarf = PyObjectId(), PyObjectId()
+    portrait_generation = Generation()
+    similarity_retriever.tag_index = TagIndex()
+    similarity_retriever.portrait_generation = portrait_generation
+    portraits_repository_mock.get_tags.return_value = {dwarf: ["Dwarf"]}
+    portraits_repository_mock.count.return_value = 1
+    splitter_mock.split_query.return_value = ["A bearded warrior"]
+    embedder_mock.embed.return_value = np.array([[1, 2, 3]], dtype=np.float32)
+    await similarity_retriever.get_portraits("A bearded warrior", tags=["dwarf"])
+
+    # WHEN a dwarf portrait is in the repository, without a portrait write
+    portraits_repository_mock.get_tags.return_value = {new_dwarf: ["Dwarf"]}
+    portraits_repository_mock.count.return_value = 2
+    await similarity_retriever.get_portraits("A bearded warrior", tags=["dwarf"])
+    # THEN the tag index is not synced again
+    assert portraits_repository_mock.get_tags.await_count == 1
+    assert embedding_repository_mock.vector_search_many.call_args.kwargs["portrait_ids"] == {dwarf}
+
+    # WHEN the portrait is written
+    portrait_generation.bump()
+    await similarity_retriever.get_portraits("A bearded warrior", tags=["dwarf"])
+    # THEN the tag index is synced with the inserted portrait
+    assert portraits_repository_mock.get_tags.await_count == 2
+    assert embedding_repository_mock.vector_search_many.call_args.kwargs["portrait_ids"] == {dwarf, new_dwarf}
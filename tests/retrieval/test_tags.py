@@ -0,0 +1,117 @@
+from collections.abc import Collection
+from pathlib import Path
+from unittest.mock import Mock
+
+from bson import ObjectId
+
+from portrait_search.core.mongodb import PyObjectId
+from portrait_search.portraits.repository import PortraitRepository, inserted_after
+from portrait_search.retrieval.tags import TagIndex
+
+
+def test_portrait_ids_with__all_tags() -> None:
+    # GIVEN portraits with overlapping tags
+    index = TagIndex()
+    dwarf_fighter, dwarf_cleric, elf_fighter = PyObjectId(), PyObjectId(), PyObjectId()
+    index.add(dwarf_fighter, ["Dwarf", "Fighter"])
+    index.add(dwarf_cleric, ["Dwarf", "Cleric"])
+    index.add(elf_fighter, ["Elf", "Fighter"])
+    # WHEN filtering by tags
+    # THEN portraits with all the tags are returned, tags match case insensitively
+    assert index.portrait_ids_with(["dwarf"]) == {dwarf_fighter, dwarf_cleric}
+    assert index.portrait_ids_with(["DWARF", "fighter"]) == {dwarf_fighter}
+    # THEN an unknown tag matches nothing
+    assert index.portrait_ids_with(["dwarf", "wizard"]) == set()
+
+
+def test_portrait_ids_with__many_portraits() -> None:
+    # GIVEN more portraits than fit into one byte of a bitmap, every third one tagged
+    index = TagIndex()
+    portrait_ids = [PyObjectId() for _ in range(20)]
+    for i, portrait_id in enumerate(portrait_ids):
+        index.add(portrait_id, ["Human"] + (["Bard"] if i % 3 == 0 else []))
+    # WHEN filtering by both tags
+    # THEN exactly the tagged portraits are returned
+    assert index.portrait_ids_with(["human", "bard"]) == set(portrait_ids[::3])
+
+
+def test_remove() -> None:
+    # GIVEN 2 dwarf portraits, one of which is removed
+    index = TagIndex()
+    kept, removed = PyObjectId(), PyObjectId()
+    index.add(kept, ["Dwarf"])
+    index.add(removed, ["Dwarf", "Cleric"])
+    index.remove(removed)
+    # WHEN filtering by tags
+    # THEN the removed portrait is not returned
+    assert index.portrait_ids_with(["dwarf"]) == {kept}
+    assert index.portrait_ids_with(["cleric"]) == set()
+    assert index.tag_counts() == {"dwarf": 1}
+
+
+def test_save__compacted_and_reloaded(temp_folder_path: Path) -> None:
+    # GIVEN an index with a removed portrait
+    index = TagIndex(temp_folder_path / "tag_index.npz")
+    portrait_ids = [PyObjectId() for _ in range(10)]
+    for i, portrait_id in enumerate(portrait_ids):
+        index.add(portrait_id, ["Elf", "Ranger" if i % 2 else "Druid"])
+    index.remove(portrait_ids[0])
+    # WHEN the index is saved and loaded again
+    index.save()
+    reloaded = TagIndex(temp_folder_path / "tag_index.npz")
+    # THEN the removed portrait is dropped and the tags of the others are kept
+    assert len(reloaded) == 9
+    assert reloaded.last_portrait_id == portrait_ids[-1]
+    assert reloaded.portrait_ids_with(["elf"]) == set(portrait_ids[1:])
+    assert reloaded.portrait_ids_with(["druid"]) == set(portrait_ids[2::2])
+    assert reloaded.portrait_ids_with(["ranger", "elf"]) == set(portrait_ids[1::2])
+
+
+def _portrait_repository_mock(tags_by_portrait_id: dict[ObjectId, list[str]]) -> Mock:
+    portrait_repository_mock = Mock(spec=PortraitRepository)
+
+    async def get_tags(
+        after_id: ObjectId | None = None, ids: Collection[ObjectId] | None = None
+    ) -> dict[ObjectId, list[str]]:
+        return {
+            portrait_id: tags
+            for portrait_id, tags in tags_by_portrait_id.items()
+            if (after_id is None or portrait_id > after_id) and (ids is None or portrait_id in ids)
+        }
+
+    portrait_repository_mock.get_tags.side_effect = get_tags
+    portrait_repository_mock.count.return_value = len(tags_by_portrait_id)
+    portrait_repository_mock.get_ids.return_value = set(tags_by_portrait_id)
+    return portrait_repository_mock
+
+
+async def test_sync() -> None:
+    # GIVEN an indexed portrait which is deleted since, and a new portrait
+    deleted = PyObjectId()
+    new = PyObjectId()
+    index = TagIndex()
+    index.add(deleted, ["Halfling"])
+    portrait_repository_mock = _portrait_repository_mock({new: ["Halfling", "Bard"]})
+    # WHEN the index is synced
+    await index.sync(portrait_repository_mock)
+    # THEN the new portrait is indexed and the deleted one is removed
+    assert index.portrait_ids_with(["halfling"]) == {new}
+    assert deleted not in index
+    # THEN only the tags of portraits inserted since the indexed one are fetched
+    portrait_repository_mock.get_tags.assert_any_await(after_id=inserted_after(deleted))
+
+
+async def test_sync__unchanged() -> None:
+    # GIVEN 2 indexed portraits, and no portraits written since
+    elf_ranger, elf_druid = PyObjectId(), PyObjectId()
+    index = TagIndex()
+    index.add(elf_ranger, ["Elf", "Ranger"])
+    index.add(elf_druid, ["Elf", "Druid"])
+    index.changed = False
+    portrait_repository_mock = _portrait_repository_mock({elf_ranger: ["Elf", "Ranger"], elf_druid: ["Elf", "Druid"]})
+    # WHEN the index is synced
+    await index.sync(portrait_repository_mock)
+    # THEN the portraits are not re-indexed, and the ids of all portraits are not fetched
+    assert not index.changed
+    assert index.docs_by_portrait_id == {elf_ranger: 0, elf_druid: 1}
+    portrait_repository_mock.get_ids.assert_not_awaited()
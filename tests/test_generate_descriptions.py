@@ -14,6 +14,8 @@ from portrait_search.open_ai.client import OpenAIClient
 from portrait_search.open_ai.queries import PORTRAIT_DESCRIPTION_QUERY_V1
 from portrait_search.portraits.entities import Portrait
 from portrait_search.portraits.repository import PortraitRepository
+from portrait_search.retrieval.lexical import LexicalIndex
+from portrait_search.retrieval.tags import TagIndex
 
 
 @pytest.fixture
@@ -21,6 +23,16 @@ def portraits_repository_mock() -> Mock:
     return Mock(spec=PortraitRepository)
 
 
+@pytest.fixture
+def lexical_index_mock() -> Mock:
+    return Mock(spec=LexicalIndex)
+
+
+@pytest.fixture
+def tag_index_mock() -> Mock:
+    return Mock(spec=TagIndex)
+
+
 @pytest.fixture
 def data_source_mock() -> Mock:
     return Mock(spec=BaseDataSource)
@@ -85,10 +97,17 @@ def openai_client_mock() -> Mock:
 
 @pytest.fixture(autouse=True)
 def container(
-    container: Container, portraits_repository_mock: Mock, data_source_mock: Mock, openai_client_mock: Mock
+    container: Container,
+    portraits_repository_mock: Mock,
+    data_source_mock: Mock,
+    openai_client_mock: Mock,
+    lexical_index_mock: Mock,
+    tag_index_mock: Mock,
 ) -> Generator[None, Any, Any]:
     with (
         container.portrait_repository.override(portraits_repository_mock),
+        container.lexical_index.override(lexical_index_mock),
+        container.tag_index.override(tag_index_mock),
         container.data_sources.override([data_source_mock]),
         container.openai_client.override(openai_client_mock),
     ):
@@ -116,6 +135,8 @@ async def test_generate_descriptions__all_new_portraits(
     data_source_mock: Mock,
     portraits_repository_mock: Mock,
     openai_client_mock: Mock,
+    lexical_index_mock: Mock,
+    tag_index_mock: Mock,
 ) -> None:
     # GIVEN data source with images, and some images has duplicates
     data_source_mock.retrieve.return_value = nexus_mods_all_portraits_fixture
@@ -136,6 +157,12 @@ async def test_generate_descriptions__all_new_portraits(
     portrait_record2.query = PORTRAIT_DESCRIPTION_QUERY_V1
     portraits_repository_mock.insert_one.assert_any_call(portrait_record1)
     assert portraits_repository_mock.insert_one.call_count == 2
+    # THEN new portraits are added to the lexical index, which is persisted
+    assert lexical_index_mock.add.call_count == 2
+    lexical_index_mock.save.assert_called_once()
+    # THEN their tags are indexed too
+    assert tag_index_mock.add.call_count == 2
+    tag_index_mock.save.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -1,39 +1,102 @@
-from collections.abc import Generator
+import asyncio
+import os
+import queue
+import signal
+from collections.abc import AsyncIterator, Awaitable, Callable, Generator
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
 from typing import Any
-from unittest.mock import Mock
+from unittest.mock import MagicMock, Mock
 
+import numpy as np
 import pytest
+from bson import ObjectId
 
+from portrait_search import generate_embeddings as generate_embeddings_module
+from portrait_search.core.enums import EmbedderType, SplitterType
 from portrait_search.core.mongodb import PyObjectId
 from portrait_search.dependencies import Container
+from portrait_search.embeddings.cache import EmbeddingCache, SplitCache
+from portrait_search.embeddings.checkpoint import GenerationCheckpoint
+from portrait_search.embeddings.embedders import EMBEDDERS
 from portrait_search.embeddings.entities import EmbeddingRecord
+from portrait_search.embeddings.generation import WorkerMessage, WorkerTask
+from portrait_search.embeddings.pooled import PooledVectors, PooledVectorStore
 from portrait_search.embeddings.repository import EmbeddingRepository
-from portrait_search.generate_embeddings import generate_embeddings
+from portrait_search.embeddings.splitters import SPLITTERS
+from portrait_search.embeddings.t2v import description_hash
+from portrait_search.generate_embeddings import generate_embeddings, generate_in_workers
 from portrait_search.portraits.entities import PortraitRecord
 from portrait_search.portraits.repository import PortraitRepository
 
+pytestmark = pytest.mark.usefixtures("fitted_projections")
+
 
 @pytest.fixture
-def portraits_repository_mock() -> Mock:
+def portraits() -> list[Mock]:
+    return []
+
+
+@pytest.fixture
+def portraits_repository_mock(portraits: list[Mock]) -> Mock:
+    async def iter_many(batch_size: int, after_id: ObjectId | None = None) -> AsyncIterator[list[Mock]]:
+        remaining = [p for p in portraits if after_id is None or p.id > after_id]
+        for i in range(0, len(remaining), batch_size):
+            yield remaining[i : i + batch_size]
+
+    async def get_ids() -> set[ObjectId]:
+        return {p.id for p in portraits}
+
     m = Mock(spec=PortraitRepository)
-    m.get_many.return_value = []
+    m.iter_many.side_effect = iter_many
+    m.get_ids.side_effect = get_ids
     return m
 
 
 @pytest.fixture
 def embeddings_repository_mock() -> Mock:
     m = Mock(spec=EmbeddingRepository)
-    m.get_by_type.return_value = []
+    m.get_description_hashes.return_value = {}
+    m.get_by_portrait_ids.return_value = []
     return m
 
 
+def existing_hashes(portraits: list[Mock]) -> Callable[..., Awaitable[dict[ObjectId, str]]]:
+    """Description hashes of portraits embedded with their current descriptions."""
+    descriptions = {p.id: p.description for p in portraits}
+
+    async def get_description_hashes(
+        splitter_type: SplitterType, embedder_type: EmbedderType, experiment: str | None
+    ) -> dict[ObjectId, str]:
+        splitter, embedder = SPLITTERS[splitter_type], EMBEDDERS[embedder_type]
+        return {id: description_hash(description, splitter, embedder) for id, description in descriptions.items()}
+
+    return get_description_hashes
+
+
+@pytest.fixture
+def pooled_vector_store(temp_folder_path: Path) -> PooledVectorStore:
+    return PooledVectorStore(temp_folder_path / "pooled_vectors")
+
+
 @pytest.fixture(autouse=True)
 def container(
-    container: Container, portraits_repository_mock: Mock, embeddings_repository_mock: Mock
+    container: Container,
+    portraits_repository_mock: Mock,
+    embeddings_repository_mock: Mock,
+    temp_folder_path: Path,
+    pooled_vector_store: PooledVectorStore,
 ) -> Generator[None, Any, Any]:
+    config = container.config().model_copy(
+        update={"local_data_folder": temp_folder_path, "generation_portrait_batch_size": 2}
+    )
     with (
+        container.config.override(config),
         container.portrait_repository.override(portraits_repository_mock),
         container.embedding_repository.override(embeddings_repository_mock),
+        container.chunk_embedding_cache.override(EmbeddingCache()),
+        container.split_cache.override(SplitCache()),
+        container.pooled_vector_store.override(pooled_vector_store),
     ):
         container.wire(modules=["portrait_search.generate_embeddings"])
         yield
@@ -47,12 +110,10 @@ async def test_generate_embeddings__empty_database(embeddings_repository_mock: M
     embeddings_repository_mock.insert_many.assert_has_calls([])
 
 
-async def test_generate_embeddings__no_embeddings(
-    embeddings_repository_mock: Mock, portraits_repository_mock: Mock
-) -> None:
+async def test_generate_embeddings__no_embeddings(embeddings_repository_mock: Mock, portraits: list[Mock]) -> None:
     # GIVEN no records in the embeddings collection and one record in the portraits collection
     portrait_mock = Mock(id=PyObjectId(), description="some description", spec=PortraitRecord)
-    portraits_repository_mock.get_many.return_value = [portrait_mock]
+    portraits.append(portrait_mock)
     # WHEN generate_embeddings is called
     await generate_embeddings()
     # THEN one records is inserted into embeddings_repository
@@ -63,21 +124,54 @@ async def test_generate_embeddings__no_embeddings(
     assert len(inserted_embeddings[0].embedding) > 0
 
 
-async def test_generate_embeddings__new_and_old(
-    embeddings_repository_mock: Mock, portraits_repository_mock: Mock
+async def test_generate_embeddings__pooled_vectors(
+    embeddings_repository_mock: Mock,
+    portraits: list[Mock],
+    temp_folder_path: Path,
+    pooled_vector_store: PooledVectorStore,
+) -> None:
+    # GIVEN 2 portraits in the portraits collection
+    portraits.extend(Mock(id=PyObjectId(), description=f"description {i}", spec=PortraitRecord) for i in range(2))
+    # WHEN generate_embeddings is called
+    await generate_embeddings()
+    # THEN the mean of the inserted chunk embeddings of every portrait is saved, for each splitter and embedder
+    inserted_embeddings = embeddings_repository_mock.insert_many.call_args[0][0]
+    splitter_type, embedder_type = inserted_embeddings[0].splitter_type, inserted_embeddings[0].embedder_type
+    pooled_vectors = PooledVectors(
+        next((temp_folder_path / "pooled_vectors").glob(f"{splitter_type}-{embedder_type}-*.npz"))
+    )
+    assert set(pooled_vectors.vectors) == {portraits[0].id, portraits[1].id}
+    chunks = [e.embedding for e in inserted_embeddings if e.portrait_id == portraits[0].id]
+    assert np.allclose(pooled_vectors.vectors[portraits[0].id], np.mean(chunks, axis=0))
+    # THEN pooled vectors are released when their task finishes
+    assert pooled_vector_store.pooled_vectors == {}
+
+
+async def test_generate_embeddings__pooled_vectors_saved_with_checkpoint(
+    embeddings_repository_mock: Mock, portraits: list[Mock], temp_folder_path: Path
 ) -> None:
+    # GIVEN 3 portraits in batches of 2, and a failing write of the second batch
+    portraits.extend(Mock(id=PyObjectId(), description=f"description {i}", spec=PortraitRecord) for i in range(3))
+    embeddings_repository_mock.insert_many.side_effect = [None, RuntimeError("no connection")]
+    # WHEN generate_embeddings is called
+    with pytest.raises(RuntimeError):
+        await generate_embeddings()
+    # THEN the pooled vectors of the written batch are saved with its checkpoint
+    inserted_embeddings = embeddings_repository_mock.insert_many.call_args_list[0][0][0]
+    splitter_type, embedder_type = inserted_embeddings[0].splitter_type, inserted_embeddings[0].embedder_type
+    pooled_vectors = PooledVectors(
+        next((temp_folder_path / "pooled_vectors").glob(f"{splitter_type}-{embedder_type}-*.npz"))
+    )
+    assert set(pooled_vectors.vectors) == {portraits[0].id, portraits[1].id}
+
+
+async def test_generate_embeddings__new_and_old(embeddings_repository_mock: Mock, portraits: list[Mock]) -> None:
     # GIVEN one record in the embeddings collection and 2 record in the portraits collection
     portrait_mock1 = Mock(id=PyObjectId(), description="some description", spec=PortraitRecord)
     portrait_mock2 = Mock(id=PyObjectId(), description="some other description", spec=PortraitRecord)
-    portraits_repository_mock.get_many.return_value = [portrait_mock1, portrait_mock2]
+    portraits.extend([portrait_mock1, portrait_mock2])
 
-    embedding_mock = Mock(
-        portrait_id=portrait_mock1.id,
-        embedded_texts=[portrait_mock1.description],
-        embeddings=[1.0],
-        spec=EmbeddingRecord,
-    )
-    embeddings_repository_mock.get_by_type.return_value = [embedding_mock]
+    embeddings_repository_mock.get_description_hashes.side_effect = existing_hashes([portrait_mock1])
     # WHEN generate_embeddings is called
     await generate_embeddings()
     # THEN one records is inserted into embeddings_repository
@@ -86,3 +180,204 @@ async def test_generate_embeddings__new_and_old(
     assert inserted_embeddings[0].portrait_id == portrait_mock2.id
     assert inserted_embeddings[0].embedded_text == portrait_mock2.description
     assert len(inserted_embeddings[0].embedding) > 0
+
+
+async def test_generate_embeddings__batches(embeddings_repository_mock: Mock, portraits: list[Mock]) -> None:
+    # GIVEN more portraits than fit into one batch
+    portraits.extend(Mock(id=PyObjectId(), description=f"description {i}", spec=PortraitRecord) for i in range(5))
+    # WHEN generate_embeddings is called
+    await generate_embeddings()
+    # THEN every batch of portraits is inserted separately, for each splitter and embedder
+    inserted_batches = [call[0][0] for call in embeddings_repository_mock.insert_many.call_args_list]
+    batches_per_pair = 3
+    assert len(inserted_batches) % batches_per_pair == 0
+    assert [{e.portrait_id for e in batch} for batch in inserted_batches[:batches_per_pair]] == [
+        {portraits[0].id, portraits[1].id},
+        {portraits[2].id, portraits[3].id},
+        {portraits[4].id},
+    ]
+
+
+async def test_generate_embeddings__resumes_after_checkpoint(
+    embeddings_repository_mock: Mock, portraits: list[Mock]
+) -> None:
+    # GIVEN a run which fails on the second batch
+    portraits.extend(Mock(id=PyObjectId(), description=f"description {i}", spec=PortraitRecord) for i in range(4))
+    embeddings_repository_mock.insert_many.side_effect = [None, RuntimeError("crash")]
+    with pytest.raises(RuntimeError):
+        await generate_embeddings()
+    # WHEN generate_embeddings is called again
+    embeddings_repository_mock.insert_many.reset_mock(side_effect=True)
+    await generate_embeddings()
+    # THEN the first batch is not embedded again
+    inserted_batch = embeddings_repository_mock.insert_many.call_args_list[0][0][0]
+    assert {e.portrait_id for e in inserted_batch} == {portraits[2].id, portraits[3].id}
+
+
+async def test_generate_embeddings__changed_description(
+    embeddings_repository_mock: Mock, portraits: list[Mock]
+) -> None:
+    # GIVEN 2 embedded portraits, the description of the second one changed since
+    portrait_mock1 = Mock(id=PyObjectId(), description="some description", spec=PortraitRecord)
+    portrait_mock2 = Mock(id=PyObjectId(), description="some other description", spec=PortraitRecord)
+    portraits.extend([portrait_mock1, portrait_mock2])
+    embeddings_repository_mock.get_description_hashes.side_effect = existing_hashes(portraits)
+    portrait_mock2.description = "a regenerated description"
+    # WHEN generate_embeddings is called
+    await generate_embeddings()
+    # THEN stale embeddings of the changed portrait are replaced
+    for call in embeddings_repository_mock.delete_by_portrait_ids.call_args_list:
+        assert call[0][2] == {portrait_mock2.id}
+    inserted_embeddings: list[EmbeddingRecord] = embeddings_repository_mock.insert_many.call_args[0][0]
+    assert {e.portrait_id for e in inserted_embeddings} == {portrait_mock2.id}
+    assert inserted_embeddings[0].embedded_text == "a regenerated description"
+    assert (
+        embeddings_repository_mock.delete_by_portrait_ids.call_count
+        == embeddings_repository_mock.insert_many.call_count
+    )
+
+
+async def test_generate_embeddings__changed_description_without_chunks(
+    embeddings_repository_mock: Mock, portraits: list[Mock]
+) -> None:
+    # GIVEN an embedded portrait whose description is emptied since
+    portrait_mock = Mock(id=PyObjectId(), description="some description", spec=PortraitRecord)
+    portraits.append(portrait_mock)
+    embeddings_repository_mock.get_description_hashes.side_effect = existing_hashes(portraits)
+    portrait_mock.description = ""
+    # WHEN generate_embeddings is called
+    await generate_embeddings()
+    # THEN its stale embeddings are deleted for each splitter and embedder, nothing is inserted
+    assert embeddings_repository_mock.delete_by_portrait_ids.call_count == len(EMBEDDERS) * len(SPLITTERS)
+    for call in embeddings_repository_mock.delete_by_portrait_ids.call_args_list:
+        assert call[0][2] == {portrait_mock.id}
+    embeddings_repository_mock.insert_many.assert_not_called()
+
+
+async def test_generate_embeddings__deleted_portrait(embeddings_repository_mock: Mock, portraits: list[Mock]) -> None:
+    # GIVEN an embedded portrait which is deleted since
+    deleted_portrait = Mock(id=PyObjectId(), description="some description", spec=PortraitRecord)
+    embeddings_repository_mock.get_description_hashes.side_effect = existing_hashes([deleted_portrait])
+    # WHEN generate_embeddings is called
+    await generate_embeddings()
+    # THEN its embeddings are deleted for each splitter and embedder
+    assert embeddings_repository_mock.delete_by_portrait_ids.call_count == len(EMBEDDERS) * len(SPLITTERS)
+    for call in embeddings_repository_mock.delete_by_portrait_ids.call_args_list:
+        assert call[0][2] == {deleted_portrait.id}
+    embeddings_repository_mock.insert_many.assert_not_called()
+
+
+async def test_generate_embeddings__checks_all_portraits_after_completed_run(
+    embeddings_repository_mock: Mock, portraits: list[Mock]
+) -> None:
+    # GIVEN a completed run
+    portraits.extend(Mock(id=PyObjectId(), description=f"description {i}", spec=PortraitRecord) for i in range(3))
+    await generate_embeddings()
+    # WHEN the description of the first portrait changes and generate_embeddings is called again
+    embeddings_repository_mock.get_description_hashes.side_effect = existing_hashes(portraits)
+    portraits[0].description = "a regenerated description"
+    embeddings_repository_mock.insert_many.reset_mock()
+    await generate_embeddings()
+    # THEN the first portrait is embedded again, the checkpoint of the completed run does not skip it
+    inserted_batch = embeddings_repository_mock.insert_many.call_args_list[0][0][0]
+    assert {e.portrait_id for e in inserted_batch} == {portraits[0].id}
+
+
+def _killed_worker(*args: Any) -> None:
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+async def test_generate_in_workers__killed_worker(
+    embeddings_repository_mock: Mock, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # GIVEN a worker which is killed before it sends its done message
+    monkeypatch.setattr(generate_embeddings_module, "embedder_worker", _killed_worker)
+    tasks = {
+        EmbedderType.ALL_MINI_LM_L6_V2: [
+            WorkerTask(SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40, None, {})
+        ]
+    }
+    # WHEN embeddings are generated in workers
+    # THEN the generation fails instead of waiting for the worker forever
+    with pytest.raises(BrokenProcessPool):
+        await asyncio.wait_for(
+            generate_in_workers(
+                tasks, {}, Mock(spec=PooledVectorStore), embeddings_repository_mock, None, 2, 2, workers=1
+            ),
+            timeout=60,
+        )
+
+
+def _flooding_worker(
+    embedder_type: EmbedderType,
+    tasks: list[WorkerTask],
+    results: "queue.Queue[WorkerMessage]",
+    portrait_batch_size: int,
+    embed_batch_size: int,
+) -> None:
+    for _ in range(100):
+        results.put(WorkerMessage(os.getpid(), embedder_type, tasks[0].splitter_type, [], set(), ObjectId()))
+
+
+async def test_generate_in_workers__failed_write_with_full_queue(
+    embeddings_repository_mock: Mock, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # GIVEN a worker which sends batches faster than they are written, and a write which fails
+    monkeypatch.setattr(generate_embeddings_module, "embedder_worker", _flooding_worker)
+    tasks = {
+        EmbedderType.ALL_MINI_LM_L6_V2: [
+            WorkerTask(SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40, None, {})
+        ]
+    }
+    checkpoint_mock = Mock(spec=GenerationCheckpoint)
+    checkpoint_mock.save.side_effect = OSError("disk full")
+    key = (SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40, EmbedderType.ALL_MINI_LM_L6_V2)
+    checkpoints: dict[tuple[SplitterType, EmbedderType], GenerationCheckpoint] = {key: checkpoint_mock}
+    pooled_vector_store_mock = Mock(spec=PooledVectorStore)
+    pooled_vector_store_mock.get.return_value = MagicMock(spec=PooledVectors)
+    # WHEN embeddings are generated in workers
+    # THEN the write error is raised, the worker waiting on the full queue does not block the generation
+    with pytest.raises(OSError, match="disk full"):
+        await generate_in_workers(
+            tasks, checkpoints, pooled_vector_store_mock, embeddings_repository_mock, None, 2, 2, workers=1
+        )
+
+
+def _two_task_worker(
+    embedder_type: EmbedderType,
+    tasks: list[WorkerTask],
+    results: "queue.Queue[WorkerMessage]",
+    portrait_batch_size: int,
+    embed_batch_size: int,
+) -> None:
+    for task in tasks:
+        results.put(WorkerMessage(os.getpid(), embedder_type, task.splitter_type, [], set(), ObjectId()))
+        results.put(WorkerMessage(os.getpid(), embedder_type, task.splitter_type, [], set(), None, done=True))
+    results.put(WorkerMessage(os.getpid(), embedder_type, None, [], set(), None, done=True))
+
+
+async def test_generate_in_workers__pooled_vectors_per_task(
+    embeddings_repository_mock: Mock, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # GIVEN a worker with 2 tasks
+    monkeypatch.setattr(generate_embeddings_module, "embedder_worker", _two_task_worker)
+    splitter_types = list(SplitterType)[:2]
+    tasks = {EmbedderType.ALL_MINI_LM_L6_V2: [WorkerTask(splitter_type, None, {}) for splitter_type in splitter_types]}
+    checkpoints: dict[tuple[SplitterType, EmbedderType], GenerationCheckpoint] = {
+        (splitter_type, EmbedderType.ALL_MINI_LM_L6_V2): Mock(spec=GenerationCheckpoint)
+        for splitter_type in splitter_types
+    }
+    pooled_vector_store_mock = Mock(spec=PooledVectorStore)
+    pooled_vector_store_mock.get.side_effect = lambda *key: MagicMock(spec=PooledVectors)
+    # WHEN embeddings are generated in workers
+    await generate_in_workers(tasks, checkpoints, pooled_vector_store_mock, embeddings_repository_mock, None, 2, 2, 1)
+    # THEN the pooled vectors of every task are loaded when the task starts and released when it finishes
+    assert [(name, args) for name, args, _ in pooled_vector_store_mock.method_calls] == [
+        (name, (splitter_type, EmbedderType.ALL_MINI_LM_L6_V2, None))
+        for splitter_type in splitter_types
+        for name in ("get", "release")
+    ]
+    # THEN the pooled vectors are saved with every checkpoint, and the checkpoint is cleared with the finished task
+    for checkpoint in checkpoints.values():
+        checkpoint.save.assert_called_once()  # type: ignore[attr-defined]
+        checkpoint.clear.assert_called_once()  # type: ignore[attr-defined]
@@ -0,0 +1,207 @@
+import warnings
+from collections.abc import AsyncGenerator, Generator
+from pathlib import Path
+from typing import Any
+from unittest.mock import MagicMock, Mock
+
+import numpy as np
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from portrait_search.core.enums import EmbedderType, SplitterType
+from portrait_search.core.mongodb import PyObjectId
+from portrait_search.dependencies import Container
+from portrait_search.embeddings.embedders import Embedder
+from portrait_search.embeddings.entities import EmbeddingSimilarity
+from portrait_search.embeddings.pooled import PooledVectors, PooledVectorStore
+from portrait_search.embeddings.repository import EmbeddingRepository
+from portrait_search.embeddings.splitters import Splitter
+from portrait_search.portraits.entities import PortraitRecord
+from portrait_search.portraits.repository import PortraitRepository
+from portrait_search.retrieval.retriever import Retriever
+from portrait_search.retrieval.tags import TagIndex
+from portrait_search.serve import create_app
+
+
+@pytest.fixture
+def embedder_mock() -> Mock:
+    m = Mock(spec=Embedder, type=EmbedderType.ALL_MINI_LM_L6_V2)
+    m.embed.return_value = np.array([[1.0, 2.0]], dtype=np.float32)
+    return m
+
+
+@pytest.fixture
+def embedding_repository_mock() -> Mock:
+    m = Mock(spec=EmbeddingRepository)
+    m.vector_search_many.return_value = [[]]
+    return m
+
+
+@pytest.fixture
+def retriever_mock() -> Mock:
+    return Mock(spec=Retriever)
+
+
+@pytest.fixture
+def portrait_repository_mock() -> Mock:
+    m = Mock(spec=PortraitRepository)
+    m.get_tags.return_value = {}
+    m.count.return_value = 0
+    return m
+
+
+@pytest.fixture
+def tag_index() -> TagIndex:
+    return TagIndex()
+
+
+@pytest.fixture(autouse=True)
+def container(
+    container: Container,
+    embedder_mock: Mock,
+    embedding_repository_mock: Mock,
+    retriever_mock: Mock,
+    portrait_repository_mock: Mock,
+    tag_index: TagIndex,
+) -> Generator[Container, Any, Any]:
+    splitter_mock = Mock(spec=Splitter, type=SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40)
+    splitter_mock.split_query.side_effect = lambda query: [query]
+    with (
+        container.splitter.override(splitter_mock),
+        container.embedder.override(embedder_mock),
+        container.embedding_repository.override(embedding_repository_mock),
+        container.retriever.override(retriever_mock),
+        container.portrait_repository.override(portrait_repository_mock),
+        container.tag_index.override(tag_index),
+    ):
+        yield container
+
+
+@pytest.fixture
+async def client(container: Container) -> AsyncGenerator[TestClient, Any]:
+    async with TestClient(TestServer(create_app(container))) as client:
+        yield client
+
+
+async def test_warm_up(
+    client: TestClient, embedder_mock: Mock, embedding_repository_mock: Mock, retriever_mock: Mock
+) -> None:
+    # GIVEN a started server
+    # THEN the embedder and the embedding repository were used once
+    embedder_mock.embed.assert_called_once()
+    embedding_repository_mock.vector_search_many.assert_awaited_once()
+    # THEN the indexes of the retriever were synced with the portraits
+    retriever_mock.sync.assert_awaited_once()
+
+
+async def test_warm_up__app_not_changed(container: Container) -> None:
+    # GIVEN a frozen app, as aiohttp freezes it before the startup, changing it after is deprecated
+    app = create_app(container)
+    app.freeze()
+    with warnings.catch_warnings():
+        warnings.filterwarnings("error", "Changing state of started or joined application", DeprecationWarning)
+        # WHEN the app is started
+        # THEN the warm-up does not change the app
+        await app.startup()
+    await app.cleanup()
+
+
+async def test_warm_up__pooled_vectors(container: Container) -> None:
+    # GIVEN searches shortlisted by pooled vectors
+    pooled_vector_store_mock = Mock(spec=PooledVectorStore)
+    pooled_vector_store_mock.get.return_value = MagicMock(spec=PooledVectors)
+    config = container.config().model_copy(update={"pooled_shortlist_factor": 3})
+    with container.config.override(config), container.pooled_vector_store.override(pooled_vector_store_mock):
+        # WHEN the server is started
+        async with TestClient(TestServer(create_app(container))):
+            pass
+    # THEN the pooled vectors of the configured splitter and embedder are loaded and stacked
+    pooled_vector_store_mock.get.assert_called_once_with(
+        SplitterType.LANGCHAIN_RECURSIVE_TEXT_SPLITTER_CHUNK_160_OVERLAP_40, EmbedderType.ALL_MINI_LM_L6_V2, None
+    )
+    pooled_vector_store_mock.get.return_value.search.assert_called_once()
+
+
+async def test_shut_down__saves_indexes(container: Container, temp_folder_path: Path) -> None:
+    # GIVEN a server with a saved tag index
+    tag_index = TagIndex(temp_folder_path / "tag_index.npz")
+    tag_index.save()
+    with container.tag_index.override(tag_index):
+        async with TestClient(TestServer(create_app(container))):
+            # WHEN portraits are indexed by searches
+            tag_index.add(PyObjectId(), ["Elf"])
+            # THEN the index is not saved on the search path
+            assert len(TagIndex(tag_index.path)) == 0
+        # WHEN the server is stopped
+    # THEN the index is saved
+    assert len(TagIndex(tag_index.path)) == 1
+
+
+async def test_healthz(client: TestClient) -> None:
+    response = await client.get("/healthz")
+    assert response.status == 200
+    assert await response.json() == {"status": "ok"}
+
+
+async def test_search(client: TestClient, retriever_mock: Mock) -> None:
+    # GIVEN a retriever which finds one portrait
+    portrait = PortraitRecord(
+        id=PyObjectId(),  # type: ignore
+        fulllength_path="fulllength_path",
+        medium_path="medium_path",
+        small_path="small_path",
+        tags=["elf"],
+        url="url",
+        hash="hash",
+        query="query",
+        description="An elf rogue",
+    )
+    explanation = EmbeddingSimilarity(
+        portrait_id=portrait.id,  # type: ignore
+        embedding=np.empty(0, dtype=np.float32),
+        embedded_text="An elf rogue",
+        query_text="elf rogue",
+        similarity=0.9,
+    )
+    retriever_mock.get_portraits.return_value = ([portrait], [[explanation]])
+
+    # WHEN searching
+    response = await client.get("/search", params={"q": "elf rogue", "limit": "5"})
+
+    # THEN the retriever is called with the query
+    retriever_mock.get_portraits.assert_awaited_once_with("elf rogue", experiment=None, limit=5, tags=None)
+    # THEN the portrait is returned
+    assert response.status == 200
+    result = await response.json()
+    assert result["query"] == "elf rogue"
+    assert [p["id"] for p in result["portraits"]] == [str(portrait.id)]
+    assert result["portraits"][0]["description"] == "An elf rogue"
+    assert result["portraits"][0]["explanations"][0]["similarity"] == 0.9
+
+
+async def test_search__tags(client: TestClient, retriever_mock: Mock) -> None:
+    # GIVEN a retriever which finds nothing
+    retriever_mock.get_portraits.return_value = ([], [])
+    # WHEN searching with comma separated tags
+    response = await client.get("/search", params={"q": "rogue", "tags": "Elf, Rogue,"})
+    # THEN the retriever is called with the tags
+    assert response.status == 200
+    retriever_mock.get_portraits.assert_awaited_once_with("rogue", experiment=None, limit=10, tags=["Elf", "Rogue"])
+
+
+async def test_tags(client: TestClient, tag_index: TagIndex, retriever_mock: Mock) -> None:
+    # GIVEN 2 tagged portraits
+    tag_index.add(PyObjectId(), ["Elf", "Rogue"])
+    tag_index.add(PyObjectId(), ["Elf"])
+    # WHEN listing tags
+    response = await client.get("/tags")
+    # THEN the portraits of every tag are counted
+    assert await response.json() == {"tags": {"elf": 2, "rogue": 1}}
+    # THEN the tag index was synced before counting, once more after the warm-up
+    assert retriever_mock.sync.await_count == 2
+
+
+@pytest.mark.parametrize("params", [{}, {"q": " "}, {"q": "elf", "limit": "many"}, {"q": "elf", "limit": "0"}])
+async def test_search__bad_request(client: TestClient, params: dict[str, str]) -> None:
+    response = await client.get("/search", params=params)
+    assert response.status == 400